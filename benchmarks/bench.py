@@ -0,0 +1,205 @@
+"""Measure rotation throughput per engine, fixture shape and worker count.
+
+Run from the repository root::
+
+    python -m benchmarks.bench --sizes 64K,16M,2G --jobs 1,4 --out bench.json
+    python -m benchmarks.bench --compare bench.json
+
+Each case rotates a fresh set of synthetic fixtures through the worker pool,
+alternating the angle between repeats so every repeat really writes, and
+records files/sec, MB/sec and the bytes touched. ``--compare`` exits with
+status 1 when a case lost more than ``--threshold`` of its files/sec.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+from rotate_that_batch import engines, pool, tools, transcode
+from rotate_that_batch.logger import logger
+
+from . import fixtures
+
+# The containers each engine can rotate.
+ENGINE_FORMATS = {
+    "native": ("mp4", "mov"),
+    "exiftool": ("mp4", "mov"),
+    "remux": ("mkv",),
+    "auto": ("mp4", "mov", "mkv"),
+}
+
+
+def _io_bytes() -> Tuple[int, int]:
+    """Block I/O of this process and its finished children, in bytes."""
+    try:
+        import resource
+    except ImportError:  # pragma: no cover - not on Windows
+        return 0, 0
+    read = written = 0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        read += usage.ru_inblock * 512
+        written += usage.ru_oublock * 512
+    return read, written
+
+
+def engine_ready(name: str, fmt: str) -> bool:
+    if not fixtures.available(fmt):
+        return False
+    needed = list(tools.ENGINE_TOOLS[name])
+    if name == "auto" and fmt == "mkv":
+        needed += ["ffmpeg", "ffprobe"]
+    return all(tools.probe(tool) for tool in needed)
+
+
+def run_once(engine: str, files: List[str], angle: int, jobs: int) -> Dict:
+    factory = partial(engines.create_engine, engine)
+    chunk_size = pool.chunk_size_for(len(files), jobs)
+    read_before, written_before = _io_bytes()
+    start = time.perf_counter()
+    results = []
+    with pool.WorkerPool(jobs, factory, budget=transcode.CoreBudget()) as workers:
+        for chunk in workers.rotate(files, angle, chunk_size):
+            results.extend(chunk)
+    seconds = time.perf_counter() - start
+    read_after, written_after = _io_bytes()
+    return {
+        "seconds": seconds,
+        "failed": sum(not r.ok for r in results),
+        "bytes_written": sum(int(r.metrics.get("bytes_written", 0)) for r in results),
+        "io_read_bytes": read_after - read_before,
+        "io_write_bytes": written_after - written_before,
+    }
+
+
+def run_case(engine: str, files: List[str], jobs: int, repeat: int, size: int) -> Dict:
+    runs = [run_once(engine, files, (90, 270)[i % 2], jobs) for i in range(repeat)]
+    seconds = statistics.median(run["seconds"] for run in runs)
+    total = size * len(files)
+    return {
+        "seconds": seconds,
+        "files_per_sec": len(files) / seconds if seconds else 0.0,
+        "mb_per_sec": total / (1 << 20) / seconds if seconds else 0.0,
+        "bytes_written": max(run["bytes_written"] for run in runs),
+        "io_read_bytes": max(run["io_read_bytes"] for run in runs),
+        "io_write_bytes": max(run["io_write_bytes"] for run in runs),
+        "failed": max(run["failed"] for run in runs),
+    }
+
+
+def run(args: argparse.Namespace) -> Dict:
+    sizes = [fixtures.parse_size(size) for size in args.sizes.split(",")]
+    jobs_levels = [int(jobs) for jobs in args.jobs.split(",")]
+    cases = []
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        for fmt in args.formats.split(","):
+            layouts = ("start",) if fmt == "mkv" else fixtures.LAYOUTS
+            for size in sizes:
+                for layout in layouts:
+                    directory = os.path.join(workdir, f"{fmt}-{size}-{layout}")
+                    files = None
+                    for engine in args.engines.split(","):
+                        if fmt not in ENGINE_FORMATS[engine]:
+                            continue
+                        if not engine_ready(engine, fmt):
+                            print(f"skip {engine} {fmt}: tools missing")
+                            continue
+                        if files is None:
+                            files = fixtures.make_fixtures(
+                                directory, fmt, size, layout, args.files
+                            )
+                        for jobs in jobs_levels:
+                            case = {
+                                "engine": engine,
+                                "format": fmt,
+                                "size": fixtures.format_size(size),
+                                "layout": layout,
+                                "files": len(files),
+                                "jobs": jobs,
+                            }
+                            case.update(
+                                run_case(engine, files, jobs, args.repeat, size)
+                            )
+                            print(
+                                f"{engine:8} {fmt:3} {case['size']:>5} "
+                                f"moov-{layout:5} jobs={jobs:<3} "
+                                f"{case['files_per_sec']:10.1f} files/s "
+                                f"{case['mb_per_sec']:10.1f} MB/s"
+                            )
+                            cases.append(case)
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "tools": {tool: tools.probe(tool) for tool in tools.VERSION_ARGS},
+        "cases": cases,
+    }
+
+
+def _key(case: Dict) -> Tuple:
+    return tuple(case[k] for k in ("engine", "format", "size", "layout", "jobs"))
+
+
+def regressions(baseline: Dict, current: Dict, threshold: float) -> List[str]:
+    """Describe every case whose files/sec fell by more than ``threshold``."""
+    before = {_key(case): case for case in baseline["cases"]}
+    found = []
+    for case in current["cases"]:
+        old = before.get(_key(case))
+        if old is None or not old["files_per_sec"]:
+            continue
+        change = case["files_per_sec"] / old["files_per_sec"] - 1
+        if change < -threshold:
+            found.append(
+                f"{' '.join(map(str, _key(case)))}: {old['files_per_sec']:.1f} -> "
+                f"{case['files_per_sec']:.1f} files/s ({change:+.0%})"
+            )
+    return found
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--engines", default="native,exiftool,remux,auto")
+    parser.add_argument("--formats", default=",".join(fixtures.FORMATS))
+    parser.add_argument("--sizes", default="64K,16M,1G", help="e.g. 64K,16M,4G")
+    parser.add_argument("--files", type=int, default=50, help="Files per case")
+    parser.add_argument("--jobs", default=f"1,{pool.default_jobs()}")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workdir", help="Where to create fixtures (default: tmp)")
+    parser.add_argument("--out", default="bench.json", help="JSON results file")
+    parser.add_argument("--compare", help="Baseline JSON results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args(argv)
+    # Per-file log lines would dominate the timings of the fast engines.
+    logger.setLevel(logging.WARNING)
+
+    baseline = None
+    if args.compare:
+        # Read first: --out may point at the baseline itself.
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = run(args)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {len(results['cases'])} cases to {args.out}")
+
+    if baseline is not None:
+        found = regressions(baseline, results, args.threshold)
+        for line in found:
+            print(f"REGRESSION {line}")
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""Synthetic video fixtures for the benchmarks.
+
+MP4 and MOV fixtures are built box by box: a structurally valid ``moov``
+with one video track and an ``mdat`` of the requested size. The ``mdat`` is
+left as a hole in a sparse file, so even multi-gigabyte fixtures take no
+disk space or time to create. MKV fixtures need real streams and are
+rendered by ffmpeg as raw video, so their size is approximate.
+"""
+
+import os
+import shutil
+import struct
+import subprocess
+from typing import List
+
+FORMATS = ("mp4", "mov", "mkv")
+LAYOUTS = ("start", "end")
+
+_BRANDS = {"mp4": b"isom", "mov": b"qt  "}
+_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+_IDENTITY = struct.pack(">9i", 1 << 16, 0, 0, 0, 1 << 16, 0, 0, 0, 1 << 30)
+# 640x360 yuv420p: bytes per raw MKV frame.
+_MKV_FRAME_BYTES = 640 * 360 * 3 // 2
+
+
+def parse_size(text: str) -> int:
+    """Parse sizes such as ``64K``, ``16M`` or ``2G`` into bytes."""
+    text = text.strip().upper().rstrip("B")
+    unit = text[-1:] if text[-1:] in _UNITS else ""
+    return int(float(text[: len(text) - len(unit)]) * _UNITS[unit])
+
+
+def format_size(size: int) -> str:
+    for unit in ("G", "M", "K"):
+        if size >= _UNITS[unit] and size % _UNITS[unit] == 0:
+            return f"{size // _UNITS[unit]}{unit}"
+    return str(size)
+
+
+def _box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", len(payload) + 8, box_type) + payload
+
+
+def _full_box(box_type: bytes, flags: int, payload: bytes) -> bytes:
+    return _box(box_type, struct.pack(">I", flags) + payload)
+
+
+def _moov() -> bytes:
+    mvhd = _full_box(
+        b"mvhd",
+        0,
+        struct.pack(">4I", 0, 0, 1000, 0)
+        + struct.pack(">IH10x", 1 << 16, 0x0100)
+        + _IDENTITY
+        + b"\0" * 24
+        + struct.pack(">I", 2),
+    )
+    tkhd = _full_box(
+        b"tkhd",
+        3,
+        struct.pack(">5I", 0, 0, 1, 0, 0)
+        + b"\0" * 16
+        + _IDENTITY
+        + struct.pack(">2I", 1920 << 16, 1080 << 16),
+    )
+    mdhd = _full_box(b"mdhd", 0, struct.pack(">4I2H", 0, 0, 1000, 0, 0x55C4, 0))
+    hdlr = _full_box(b"hdlr", 0, b"\0" * 4 + b"vide" + b"\0" * 12 + b"Video\0")
+    dinf = _box(
+        b"dinf",
+        _full_box(b"dref", 0, struct.pack(">I", 1) + _full_box(b"url ", 1, b"")),
+    )
+    empty = struct.pack(">I", 0)
+    stbl = _box(
+        b"stbl",
+        _full_box(b"stsd", 0, empty)
+        + _full_box(b"stts", 0, empty)
+        + _full_box(b"stsc", 0, empty)
+        + _full_box(b"stsz", 0, empty + empty)
+        + _full_box(b"stco", 0, empty),
+    )
+    minf = _box(b"minf", _full_box(b"vmhd", 1, b"\0" * 8) + dinf + stbl)
+    trak = _box(b"trak", tkhd + _box(b"mdia", mdhd + hdlr + minf))
+    return _box(b"moov", mvhd + trak)
+
+
+def write_iso(path: str, size: int, moov_at_end: bool = False, brand=b"isom") -> int:
+    """Write a sparse MP4/MOV of about ``size`` bytes; return its real size."""
+    ftyp = _box(b"ftyp", brand + b"\0\0\0\0" + brand)
+    moov = _moov()
+    payload = max(0, size - len(ftyp) - len(moov) - 16)
+    # Always a 64-bit header, so every size takes the same code paths.
+    mdat_header = struct.pack(">I4sQ", 1, b"mdat", payload + 16)
+    with open(path, "wb") as f:
+        f.write(ftyp)
+        if not moov_at_end:
+            f.write(moov)
+        f.write(mdat_header)
+        f.seek(payload, os.SEEK_CUR)
+        if moov_at_end:
+            f.write(moov)
+        f.truncate()
+    return os.path.getsize(path)
+
+
+def write_mkv(path: str, size: int) -> int:
+    """Render a raw-video MKV of about ``size`` bytes with ffmpeg."""
+    frames = max(1, size // _MKV_FRAME_BYTES)
+    command = ["ffmpeg", "-v", "error", "-y", "-f", "lavfi"]
+    command += ["-i", "testsrc2=size=640x360:rate=30", "-frames:v", str(frames)]
+    command += ["-c:v", "rawvideo", "-pix_fmt", "yuv420p", path]
+    subprocess.run(command, check=True, capture_output=True)
+    return os.path.getsize(path)
+
+
+def available(fmt: str) -> bool:
+    return fmt != "mkv" or shutil.which("ffmpeg") is not None
+
+
+def make_fixtures(
+    directory: str, fmt: str, size: int, layout: str, count: int
+) -> List[str]:
+    """Create ``count`` fixtures in ``directory`` and return their paths.
+
+    The first file is generated; the rest are copies of it, so expensive
+    MKV renders only happen once per set.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = [os.path.join(directory, f"clip{i:05d}.{fmt}") for i in range(count)]
+    if fmt == "mkv":
+        write_mkv(paths[0], size)
+    else:
+        write_iso(paths[0], size, layout == "end", _BRANDS[fmt])
+    for path in paths[1:]:
+        if fmt == "mkv":
+            shutil.copyfile(paths[0], path)
+        else:
+            # Regenerate rather than copy, so the holes stay sparse.
+            write_iso(path, size, layout == "end", _BRANDS[fmt])
+    return paths
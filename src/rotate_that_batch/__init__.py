@@ -0,0 +1,18 @@
+import time
+
+# Start of package import, reported by ``rotate-that-batch --import-time``.
+IMPORT_STARTED = time.perf_counter()
+
+from .result import RotationResult  # noqa: E402
+
+__all__ = ["RotationResult", "rotate_many"]
+
+
+def __getattr__(name: str):
+    # The library API pulls in the whole rotation stack: only load it when
+    # it is used, so the CLI's startup does not pay for it.
+    if name == "rotate_many":
+        from .api import rotate_many
+
+        return rotate_many
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,288 @@
+import asyncio
+import concurrent.futures
+import queue
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from functools import partial
+from typing import (
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Sized,
+    Tuple,
+)
+
+from . import devices, engines, manifest, pool, scan, transcode
+from .result import RotationResult
+
+
+@dataclass
+class ProgressEvent:
+    """One finished file and the running totals of its batch."""
+
+    result: RotationResult
+    completed: int
+    failed: int
+    total: Optional[int]
+    elapsed: float
+
+    @property
+    def rate(self) -> float:
+        """Files finished per second so far."""
+        return self.completed / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        """Seconds until the batch is done at the current rate."""
+        if not self.rate or self.total is None:
+            return None
+        return (self.total - self.completed) / self.rate
+
+
+async def run_process(
+    command: Sequence[str], stdin: Optional[bytes] = None
+) -> Tuple[int, bytes, bytes]:
+    """Run ``command`` to completion, killing it if the caller is cancelled."""
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=asyncio.subprocess.PIPE
+        if stdin is not None
+        else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await process.communicate(stdin)
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    assert process.returncode is not None
+    return process.returncode, stdout, stderr
+
+
+async def run_ffmpeg(command: List[str]) -> Dict[str, float]:
+    """``transcode.run_ffmpeg`` as a coroutine: cancelling it kills ffmpeg."""
+    start = time.monotonic()
+    argv = command[:1] + transcode.PROGRESS_ARGS + command[1:]
+    code, stdout, stderr = await run_process(argv)
+    if code:
+        raise subprocess.CalledProcessError(
+            code, command, stderr=stderr.decode(errors="replace")
+        )
+    return transcode.progress_stats(stdout.decode(errors="replace").splitlines(), start)
+
+
+def _with_angle(path: str, angle: int) -> str:
+    if isinstance(path, manifest.ManifestPath):
+        return path
+    return manifest.ManifestPath(path, angle)
+
+
+class AsyncEngine:
+    """Rotate files from an event loop without blocking it.
+
+    Chunks go to a ``pool.WorkerPool`` of the usual engines, so planning,
+    the journal, verification and output directories behave as in a
+    threaded run. The input is read a few chunks ahead of the workers, off
+    the loop, and finished chunks pass through a bounded queue. ffmpeg runs
+    on the loop through ``asyncio.create_subprocess_exec``: cancelling the
+    consuming task kills it and removes its temporary file, while running
+    native and ExifTool chunks are left to finish. ``engine`` is ``auto``
+    (route by container) or the name of one engine.
+    """
+
+    def __init__(
+        self,
+        jobs: int,
+        mode: Optional[str] = None,
+        output_dir: Optional[str] = None,
+        base_dir: Optional[str] = None,
+        engine: str = "auto",
+        journal=None,
+        on_done: Optional[Callable[[List[RotationResult]], None]] = None,
+        verify: bool = False,
+    ):
+        if engine not in engines.ENGINES:
+            raise ValueError(f"Unknown engine: {engine}")
+        self.jobs = max(1, jobs)
+        self.mode = mode
+        self.output_dir = output_dir
+        self.base_dir = base_dir
+        self.engine = engine
+        self.journal = journal
+        self.on_done = on_done
+        self.verify = verify
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ffmpeg: Set[asyncio.Task] = set()
+        self._cancelled = False
+
+    def rotate(self, files: Iterable[str], angle: int) -> AsyncIterator[ProgressEvent]:
+        """Rotate ``files``, yielding a progress event per finished file.
+
+        Paths that carry an ``angle`` (manifest entries) are rotated by it.
+        """
+        total = len(files) if isinstance(files, Sized) else None
+        if isinstance(files, scan.BackgroundScan):
+            size = pool.STREAM_CHUNK_FILES
+            batches = files.batches(size)
+        else:
+            size = pool.chunk_size_for(total, self.jobs)
+            batches = engines.chunk_files(files, max_files=size)
+        entries = ([_with_angle(path, angle) for path in batch] for batch in batches)
+        groups = manifest.group_chunks(entries, size, self.engine)
+        return self._stream(lambda workers: workers.rotate_groups(groups), total)
+
+    def rotate_scheduled(
+        self, scheduler: devices.DeviceScheduler
+    ) -> AsyncIterator[ProgressEvent]:
+        """Rotate the chunks ``scheduler`` hands out, as ``rotate`` does."""
+        return self._stream(lambda workers: workers.rotate_scheduled(scheduler))
+
+    async def _stream(
+        self,
+        start: Callable[[pool.WorkerPool], Iterator[List[RotationResult]]],
+        total: Optional[int] = None,
+    ) -> AsyncIterator[ProgressEvent]:
+        self._loop = asyncio.get_running_loop()
+        self._cancelled = False
+        factory = partial(engines.create_engine, self.engine, runner=self._run_ffmpeg)
+        workers = pool.WorkerPool(
+            self.jobs,
+            factory,
+            self.output_dir,
+            self.base_dir,
+            self.mode,
+            journal=self.journal,
+            on_done=self.on_done,
+            verify=self.verify,
+        )
+        # One thread steps the pool's blocking result stream, so closing it
+        # waits for the step in flight instead of racing it.
+        feeder = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="rotate-async"
+        )
+        batches = start(workers)
+        finished: asyncio.Queue = asyncio.Queue(maxsize=self.jobs * 2)
+        pump = asyncio.create_task(self._pump(feeder, batches, finished))
+        started = time.monotonic()
+        completed = failed = 0
+        try:
+            while True:
+                item = await finished.get()
+                if item is None:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                for result in item:
+                    completed += 1
+                    failed += not result.ok
+                    elapsed = time.monotonic() - started
+                    yield ProgressEvent(result, completed, failed, total, elapsed)
+        finally:
+            self._cancel()
+            pump.cancel()
+            await asyncio.gather(pump, return_exceptions=True)
+            close = partial(self._close, batches, workers)
+            await asyncio.get_running_loop().run_in_executor(feeder, close)
+            feeder.shutdown()
+
+    async def _pump(
+        self,
+        feeder: concurrent.futures.Executor,
+        batches: Iterator[List[RotationResult]],
+        finished: asyncio.Queue,
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                results = await loop.run_in_executor(feeder, next, batches, None)
+                if results is None:
+                    break
+                await finished.put(results)
+        except Exception as e:
+            await finished.put(e)
+            return
+        await finished.put(None)
+
+    def _cancel(self) -> None:
+        # Stops ffmpeg; a finished run has none left to stop.
+        self._cancelled = True
+        for task in self._ffmpeg:
+            task.cancel()
+
+    def _close(self, batches: Iterator, workers: pool.WorkerPool) -> None:
+        close = getattr(batches, "close", None)
+        if close is not None:
+            close()
+        workers.close(cancel=True)
+
+    def _run_ffmpeg(self, command: List[str]) -> Dict[str, float]:
+        # Called by the engines in worker threads: ffmpeg runs on the loop,
+        # where ``_cancel`` can kill it.
+        if self._cancelled or self._loop is None:
+            raise concurrent.futures.CancelledError()
+        return asyncio.run_coroutine_threadsafe(
+            self._tracked_ffmpeg(command), self._loop
+        ).result()
+
+    async def _tracked_ffmpeg(self, command: List[str]) -> Dict[str, float]:
+        task = asyncio.current_task()
+        assert task is not None
+        if self._cancelled:
+            raise asyncio.CancelledError()
+        self._ffmpeg.add(task)
+        try:
+            return await run_ffmpeg(command)
+        finally:
+            self._ffmpeg.discard(task)
+
+
+def rotate_blocking(
+    events: AsyncIterator[ProgressEvent],
+) -> Iterator[List[RotationResult]]:
+    """Drive ``events`` (from ``AsyncEngine``) on a private event loop.
+
+    Results are yielded one file at a time, in the same shape as
+    ``WorkerPool.rotate_chunks``. Closing the iterator cancels the batch.
+    """
+    results: queue.Queue = queue.Queue()
+    finished = object()
+
+    async def run() -> None:
+        try:
+            async for event in events:
+                results.put([event.result])
+        except BaseException as e:
+            results.put(e)
+        finally:
+            results.put(finished)
+
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(run())
+    thread = threading.Thread(
+        target=loop.run_until_complete, args=(task,), name="rotate-async"
+    )
+    thread.start()
+    try:
+        while True:
+            item = results.get()
+            if item is finished:
+                break
+            if isinstance(item, asyncio.CancelledError):
+                continue
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        loop.call_soon_threadsafe(task.cancel)
+        thread.join()
+        loop.close()
@@ -0,0 +1,72 @@
+"""Library entry point for programs that embed the rotator.
+
+``rotate_many`` streams: it takes any iterable of jobs, such as a generator
+fed by a queue consumer, and yields one result per file as chunks finish.
+It reads ahead only a bounded number of jobs, so an endless input is never
+buffered up and a caller that stops consuming stops the reading as well.
+Unlike the CLI it never touches the config file, index or terminal.
+"""
+
+import os
+from functools import partial
+from typing import Iterable, Iterator, Optional, Tuple, Union
+
+from . import dedup, engines, manifest, plan, pool, scan
+from .result import RotationResult
+
+Job = Union[str, "os.PathLike[str]", Tuple[Union[str, "os.PathLike[str]"], int]]
+
+# Jobs read ahead of the workers, on top of the chunks in flight.
+DEFAULT_BUFFER = 256
+
+
+def _job(job: Job, angle: int) -> manifest.ManifestPath:
+    if isinstance(job, tuple):
+        path, angle = job
+    else:
+        path = job
+    if not isinstance(angle, int) or angle % 90:
+        raise ValueError(f"Angle must be a multiple of 90, got {angle!r}")
+    return manifest.ManifestPath(os.fspath(path), angle)
+
+
+def rotate_many(
+    jobs: Iterable[Job],
+    angle: int = 90,
+    engine: str = "auto",
+    concurrency: Optional[int] = None,
+    mode: str = "absolute",
+    output_dir: Optional[str] = None,
+    base_dir: Optional[str] = None,
+    verify: bool = False,
+    dedup_mode: str = "inode",
+    dedup_link: Optional[str] = None,
+    chunk_size: int = pool.STREAM_CHUNK_FILES,
+    buffer: int = DEFAULT_BUFFER,
+) -> Iterator[RotationResult]:
+    """Rotate the files ``jobs`` yields, yielding a result per file as it lands.
+
+    A job is a path, rotated by ``angle``, or a ``(path, angle)`` pair.
+    Files are batched by angle and engine into chunks of ``chunk_size`` and
+    rotated by ``concurrency`` workers (one per CPU by default).
+    Duplicates are rotated once, as with the CLI's ``--dedup``. Failed
+    files come back with ``error`` set instead of raising; an invalid job
+    raises ``ValueError`` once the jobs before it are done. Closing the
+    iterator early stops reading ``jobs`` and waits for running chunks.
+    """
+    if engine not in engines.ENGINES:
+        raise ValueError(f"Unknown engine: {engine}")
+    if mode not in plan.MODES:
+        raise ValueError(f"Unknown rotation mode: {mode}")
+    deduper = dedup.Deduplicator(dedup_mode, dedup_link, output_dir, base_dir)
+    entries = deduper.unique(_job(job, angle) for job in jobs)
+    factory = partial(engines.create_engine, engine)
+    workers = concurrency or pool.default_jobs()
+    with scan.BackgroundScan(entries, maxsize=max(1, buffer)) as feed:
+        with pool.WorkerPool(
+            workers, factory, output_dir, base_dir, mode, verify=verify
+        ) as rotator:
+            batches = feed.batches(chunk_size)
+            groups = manifest.group_chunks(batches, chunk_size, engine)
+            for results in deduper.fan_out(rotator.rotate_groups(groups)):
+                yield from results
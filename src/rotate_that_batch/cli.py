@@ -1,68 +1,1074 @@
+import contextlib
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from functools import partial
+from typing import Dict, Iterable, Iterator, List, Optional
+
 import typer
 from rich.console import Console
 from rich.progress import Progress
+from rich.table import Table
 
-from . import video_utils
-from .config import get_config_value, set_config_value
-from .logger import logger
+from . import (
+    IMPORT_STARTED,
+    dedup,
+    devices,
+    engines,
+    journal,
+    metrics,
+    plan,
+    pool,
+    scan,
+    sharding,
+    sidecar,
+    tools,
+    video_utils,
+)
+from .config import ConfigStore
+from .logger import LEVELS, configure_logging, logger, shutdown_logging
+from .manifest import Manifest, group_chunks
+from .watch import (
+    DEFAULT_BATCH_WINDOW,
+    DEFAULT_MAX_BATCH,
+    DEFAULT_SETTLE_SECONDS,
+    InboxWatcher,
+)
 
 console = Console()
 app = typer.Typer()
 
+# Loaded once for all option defaults and written back once at the end of a run.
+settings = ConfigStore()
+defaults = settings.config["DEFAULT"]
 
-@app.command()
+# Modules only imported when a run needs them; --import-time reports them.
+LAZY_MODULES = ("exiftool", "asyncio", "sqlite3", "textual")
+
+
+@app.callback(invoke_without_command=True)
 def main(
+    ctx: typer.Context,
     directory: str = typer.Option(
-        get_config_value("default_directory", "."), help="Directory containing videos"
+        defaults.get("default_directory", "."), help="Directory containing videos"
     ),
     angle: int = typer.Option(
-        int(get_config_value("default_angle", 90)),
+        int(defaults.get("default_angle", "90")),
         help="Rotation angle (90, 180, or 270)",
     ),
     preview: bool = typer.Option(
         False, help="Preview rotations without applying changes"
     ),
+    preview_dir: Optional[str] = typer.Option(
+        None,
+        help="With --preview, write before/after contact sheets to this directory "
+        "instead of opening each frame interactively",
+    ),
     output: str = typer.Option(
-        get_config_value("output_directory"), help="Output directory for rotated videos"
+        defaults.get("output_directory"), help="Output directory for rotated videos"
+    ),
+    jobs: int = typer.Option(
+        pool.default_jobs(),
+        "--jobs",
+        "-j",
+        min=1,
+        help="Number of parallel workers (default: CPU count)",
+    ),
+    engine: str = typer.Option(
+        "auto",
+        help="Rotation engine: auto (native MP4/MOV, remux MKV, re-encode "
+        "AVI/FLV/WMV, ExifTool otherwise), native, exiftool, remux or reencode",
+    ),
+    recursive: bool = typer.Option(False, help="Scan subdirectories too"),
+    include: List[str] = typer.Option(
+        [], help="Only rotate files matching this glob (repeatable)"
+    ),
+    exclude: List[str] = typer.Option(
+        [], help="Skip files and directories matching this glob (repeatable)"
+    ),
+    symlinks: str = typer.Option(
+        "files",
+        help="Symlink policy: skip, files (follow links to files) or follow",
+    ),
+    use_index: bool = typer.Option(
+        True, "--index/--no-index", help="Skip files already rotated by earlier runs"
+    ),
+    index_file: Optional[str] = typer.Option(
+        None, help="Rotation index database (default: ~/.rotate_that_batch.sqlite)"
+    ),
+    rebuild_index: bool = typer.Option(
+        False, help="Forget indexed state for this directory and rotate everything"
+    ),
+    mode: str = typer.Option(
+        "absolute",
+        help="absolute: set the rotation to --angle; "
+        "relative: add --angle to the current rotation",
+    ),
+    use_async: bool = typer.Option(
+        False,
+        "--async",
+        help="Rotate from an asyncio event loop, with per-file progress",
+    ),
+    save_config: bool = typer.Option(
+        True,
+        envvar="ROTATE_THAT_BATCH_SAVE_CONFIG",
+        help="Remember the directory, angle and output for the next run; "
+        "disable for parallel batch jobs so they never touch the config file",
+    ),
+    log_level: str = typer.Option(
+        "info", help="Log verbosity: debug, info, warning or error"
+    ),
+    log_json: Optional[str] = typer.Option(
+        None, help="Also write the log to this file as JSON lines"
+    ),
+    metrics_file: Optional[str] = typer.Option(
+        None,
+        help="Write per-file timings, bytes and engine as JSON lines to this "
+        "file, ending with p50/p95/p99 latencies",
+    ),
+    shard: Optional[str] = typer.Option(
+        None,
+        help="Only rotate this process's share of the files: i/n picks the "
+        "i-th of n deterministic partitions (1-based)",
+    ),
+    queue_file: Optional[str] = typer.Option(
+        None,
+        "--queue",
+        help="Share the work with other processes through this SQLite queue "
+        "on a shared volume; every worker claims files under a lease",
+    ),
+    max_attempts: int = typer.Option(
+        sharding.DEFAULT_MAX_ATTEMPTS,
+        min=1,
+        help="With --queue, dead-letter a file after this many failed attempts",
+    ),
+    lease_seconds: float = typer.Option(
+        sharding.DEFAULT_LEASE_SECONDS,
+        min=1,
+        help="With --queue, seconds before a dead worker's files are reclaimed",
+    ),
+    use_journal: bool = typer.Option(
+        True,
+        "--journal/--no-journal",
+        help="Journal every file of the run so an interrupted run can be resumed",
+    ),
+    resume: Optional[str] = typer.Option(
+        None,
+        help="Resume an interrupted run by its id, with its original settings",
+    ),
+    import_time: bool = typer.Option(
+        False,
+        "--import-time",
+        help="Print startup time and the lazily loaded modules as JSON, then exit",
+    ),
+    plan_json: Optional[str] = typer.Option(
+        None,
+        help="Write the rotation plan as JSON to this file ('-' for stdout) "
+        "instead of rotating",
+    ),
+    manifest: Optional[str] = typer.Option(
+        None,
+        help="Rotate the files listed in this CSV or JSON-lines manifest of "
+        "path and angle ('-' for stdin), each by its own angle, instead of "
+        "scanning --directory",
+    ),
+    schedule: bool = typer.Option(
+        False,
+        "--schedule",
+        help="Schedule work per storage device: cap the chunks in flight on "
+        "each device, order its files and report per-device throughput",
+    ),
+    order: str = typer.Option(
+        "size",
+        help="With --schedule, order each device's files by size (smallest "
+        "first) or inode (fewer seeks on spinning disks)",
+    ),
+    hdd_jobs: int = typer.Option(
+        devices.DEFAULT_HDD_JOBS,
+        min=1,
+        help="With --schedule, chunks rotated at once on a spinning disk",
+    ),
+    ssd_jobs: int = typer.Option(
+        0,
+        min=0,
+        help="With --schedule, chunks rotated at once on any other device "
+        "(0: only limited by --jobs)",
+    ),
+    verify: bool = typer.Option(
+        False,
+        help="Re-read each written file's header to confirm its rotation and "
+        "compare a sampled fingerprint of its media data",
+    ),
+    dedup_mode: str = typer.Option(
+        "inode",
+        "--dedup",
+        help="Rotate duplicates once: inode (paths of one file, e.g. hard "
+        "links), content (also byte-identical copies, with --dedup-link) "
+        "or off",
+    ),
+    dedup_link: Optional[str] = typer.Option(
+        None,
+        help="Replace identical copies by the rotated file: copy (a reflink "
+        "where supported), reflink or hardlink; without it copies are "
+        "rotated in place",
+    ),
+    sidecar_mode: str = typer.Option(
+        "off",
+        "--sidecar",
+        help="Record the target rotation in XMP sidecars instead of writing "
+        "the videos: file (one <video>.xmp each), directory (one "
+        f"{sidecar.DIRECTORY_SIDECAR} per directory) or off",
     ),
 ):
+    """Rotate every video in a directory."""
+    if ctx.invoked_subcommand is not None:
+        return
+    if import_time:
+        report_import_time()
+        return
+
+    if log_level not in LEVELS:
+        console.print(
+            f"[bold red]Invalid log level. Please use one of: "
+            f"{', '.join(LEVELS)}.[/bold red]"
+        )
+        raise typer.Exit(code=1)
+    configure_logging(log_level, log_json)
+    ctx.call_on_close(shutdown_logging)
+
+    state = None
+    if resume:
+        try:
+            state = journal.load(resume)
+        except journal.JournalError as e:
+            console.print(f"[bold red]{str(e)}[/bold red]")
+            raise typer.Exit(code=1)
+        if state.finished and not state.failed:
+            console.print(f"Run {resume} already finished.")
+            return
+        run = state.settings
+        if os.getcwd() != run["cwd"]:
+            logger.info(f"Resuming in the run's working directory {run['cwd']}")
+            os.chdir(run["cwd"])
+        directory, angle, mode, engine = (
+            run["directory"],
+            run["angle"],
+            run["mode"],
+            run["engine"],
+        )
+        output, recursive, symlinks = run["output"], run["recursive"], run["symlinks"]
+        include, exclude = run["include"], run["exclude"]
+        if run.get("manifest") and not manifest:
+            if run["manifest"] == "-":
+                console.print(
+                    f"[bold red]Run {resume} read its manifest from stdin: "
+                    f"pipe it in again with --manifest -.[/bold red]"
+                )
+                raise typer.Exit(code=1)
+            manifest = run["manifest"]
+
     logger.info(f"Starting rotation process for directory: {directory}")
-    video_utils.check_ffmpeg()
 
     if angle not in [90, 180, 270]:
         logger.error(f"Invalid angle: {angle}")
         console.print("[bold red]Invalid angle. Please use 90, 180, or 270.[/bold red]")
         raise typer.Exit(code=1)
 
-    video_files = video_utils.get_video_files(directory)
+    if engine not in engines.ENGINES:
+        logger.error(f"Invalid engine: {engine}")
+        console.print(
+            f"[bold red]Invalid engine. Please use one of: "
+            f"{', '.join(engines.ENGINES)}.[/bold red]"
+        )
+        raise typer.Exit(code=1)
 
-    if not video_files:
-        logger.warning(f"No video files found in directory: {directory}")
-        console.print("No video files found in the selected folder. Exiting.")
+    if symlinks not in video_utils.SYMLINK_POLICIES:
+        console.print(
+            f"[bold red]Invalid symlink policy. Please use one of: "
+            f"{', '.join(video_utils.SYMLINK_POLICIES)}.[/bold red]"
+        )
         raise typer.Exit(code=1)
 
+    if mode not in plan.MODES:
+        console.print(
+            f"[bold red]Invalid mode. Please use one of: "
+            f"{', '.join(plan.MODES)}.[/bold red]"
+        )
+        raise typer.Exit(code=1)
+
+    shard_index = shard_count = 0
+    if shard:
+        try:
+            shard_index, shard_count = sharding.parse_shard(shard)
+        except ValueError as e:
+            console.print(f"[bold red]{str(e)}.[/bold red]")
+            raise typer.Exit(code=1)
+
+    if queue_file and (use_async or resume):
+        console.print(
+            "[bold red]--queue cannot be combined with --async or --resume."
+            "[/bold red]"
+        )
+        raise typer.Exit(code=1)
+
+    if manifest and (preview or queue_file):
+        console.print(
+            "[bold red]--manifest cannot be combined with --preview or --queue."
+            "[/bold red]"
+        )
+        raise typer.Exit(code=1)
+    if order not in devices.ORDERS:
+        console.print(
+            f"[bold red]Invalid order. Please use one of: "
+            f"{', '.join(devices.ORDERS)}.[/bold red]"
+        )
+        raise typer.Exit(code=1)
+    if dedup_mode not in dedup.DEDUP_MODES or (
+        dedup_link is not None and dedup_link not in dedup.LINK_METHODS
+    ):
+        console.print(
+            f"[bold red]Invalid dedup setting. Please use --dedup "
+            f"{'|'.join(dedup.DEDUP_MODES)} and --dedup-link "
+            f"{'|'.join(dedup.LINK_METHODS)}.[/bold red]"
+        )
+        raise typer.Exit(code=1)
+
+    if sidecar_mode not in sidecar.SIDECAR_MODES:
+        console.print(
+            f"[bold red]Invalid sidecar mode. Please use one of: "
+            f"{', '.join(sidecar.SIDECAR_MODES)}.[/bold red]"
+        )
+        raise typer.Exit(code=1)
+    if sidecar_mode != "off" and (
+        preview or use_async or queue_file or resume or output or schedule or verify
+    ):
+        console.print(
+            "[bold red]--sidecar cannot be combined with --preview, --async, "
+            "--queue, --resume, --output, --schedule or --verify.[/bold red]"
+        )
+        raise typer.Exit(code=1)
+
+    if manifest and manifest != "-" and not os.path.isfile(manifest):
+        console.print(f"[bold red]Manifest {manifest} not found.[/bold red]")
+        raise typer.Exit(code=1)
+
+    check_tools(engine, preview)
+
+    listing = None
+    video_files: Iterable[str]
+    if manifest:
+        listing = Manifest(manifest)
+        video_files = iter(listing)
+    else:
+        video_files = video_utils.iter_video_files(
+            directory,
+            recursive=recursive,
+            include=include,
+            exclude=exclude,
+            symlinks=symlinks,
+            skip_dirs=[output] if output else [],
+        )
+    if shard_count:
+        video_files = sharding.shard_files(
+            video_files, directory, shard_index, shard_count
+        )
+
+    failures: List[engines.RotationResult] = []
     if preview:
-        video_utils.preview_rotations(video_files, angle)
+        preview_files = list(video_files)
+        if not preview_files:
+            no_videos_found(directory)
+        if preview_dir:
+            from .preview import build_contact_sheets
+
+            sheets = build_contact_sheets(preview_files, angle, preview_dir, jobs=jobs)
+            for sheet in sheets:
+                console.print(sheet)
+        else:
+            video_utils.preview_rotations(preview_files, angle)
         console.print("Preview complete!")
+    elif plan_json:
+        write_plan(
+            video_files, angle, mode, jobs, engine, plan_json, listing is not None
+        )
+        return
+    elif sidecar_mode != "off":
+        failures = write_sidecars(
+            video_files, angle, mode, jobs, engine, sidecar_mode, listing is not None
+        )
+        if failures:
+            print_failures(failures)
     else:
-        with Progress() as progress:
-            task = progress.add_task(
-                "[green]Rotating videos...", total=len(video_files)
+        rotation_index = None
+        if use_index:
+            from . import index
+
+            rotation_index = index.RotationIndex(index_file)
+        target = os.path.abspath(output) if output else ""
+        if rotation_index is not None:
+            if rebuild_index:
+                rotation_index.clear(directory)
+            if mode == "absolute":
+                video_files = rotation_index.pending(video_files, angle, target)
+
+        work = None
+        if queue_file:
+            from . import workqueue
+
+            # The queue already survives crashes: no journal is needed.
+            work = workqueue.WorkQueue(
+                queue_file, directory, None, lease_seconds, max_attempts
+            )
+            video_files = work.files(video_files)
+
+        run_journal = None
+        interrupted: Iterable[List[engines.RotationResult]] = ()
+        if state is not None:
+            run_journal = journal.RunJournal(state.run_id, state.failed)
+            if listing is not None:
+                video_files = resume_manifest(state, video_files, run_journal)
+            else:
+                video_files = resume_files(state, video_files, run_journal)
+            interrupted = redo_interrupted(
+                state, jobs, engine, output, directory, run_journal
+            )
+        elif use_journal and work is None:
+            run_journal = journal.RunJournal.create(
+                {
+                    "cwd": os.getcwd(),
+                    "directory": directory,
+                    "angle": angle,
+                    "mode": mode,
+                    "engine": engine,
+                    "output": output,
+                    "recursive": recursive,
+                    "include": include,
+                    "exclude": exclude,
+                    "symlinks": symlinks,
+                    "manifest": os.path.abspath(manifest)
+                    if manifest and manifest != "-"
+                    else manifest,
+                }
+            )
+            video_files = run_journal.scanned(video_files)
+        if run_journal is not None:
+            logger.info(f"Journal: {run_journal.path}")
+            console.print(
+                f"Run {run_journal.run_id} (resume with --resume "
+                f"{run_journal.run_id} if interrupted)"
             )
-            for video in video_files:
-                video_utils.rotate_video(video, angle, output)
-                progress.update(task, advance=1)
 
-        logger.info(f"Rotation complete. Processed {len(video_files)} videos.")
+        deduper = None
+        if dedup_mode != "off":
+            deduper = dedup.Deduplicator(
+                dedup_mode,
+                dedup_link,
+                output,
+                directory,
+                on_done=work.complete if work is not None else None,
+            )
+            video_files = deduper.unique(video_files, angle)
+
+        unchanged = processed = 0
+        left_alone: Counter = Counter()
+        scheduler = None
+        timed = bool(metrics_file)
+        with scan.BackgroundScan(
+            video_files, timings=timed
+        ) as scanner, Progress() as progress:
+            task = progress.add_task("[green]Rotating videos...", total=None)
+            engine_factory = partial(engines.create_engine, engine)
+            with contextlib.ExitStack() as stack:
+                if run_journal is not None:
+                    stack.enter_context(run_journal)
+                recorder = None
+                if metrics_file:
+                    stream = stack.enter_context(open(metrics_file, "w"))
+                    recorder = metrics.MetricsWriter(stream)
+                on_done = work.complete if work is not None else None
+                if schedule:
+                    scheduler = stack.enter_context(
+                        devices.DeviceScheduler(
+                            scanner,
+                            angle,
+                            pool.STREAM_CHUNK_FILES,
+                            order,
+                            hdd_jobs,
+                            ssd_jobs,
+                            engine,
+                        )
+                    )
+                if use_async:
+                    from . import aio
+
+                    rotator = aio.AsyncEngine(
+                        jobs,
+                        mode,
+                        output,
+                        directory,
+                        engine,
+                        run_journal,
+                        on_done=on_done,
+                        verify=verify,
+                    )
+                    if scheduler is not None:
+                        events = rotator.rotate_scheduled(scheduler)
+                    else:
+                        events = rotator.rotate(scanner, angle)
+                    finished = aio.rotate_blocking(events)
+                else:
+                    workers = stack.enter_context(
+                        pool.WorkerPool(
+                            jobs,
+                            engine_factory,
+                            output,
+                            directory,
+                            mode,
+                            journal=run_journal,
+                            on_done=on_done,
+                            verify=verify,
+                        )
+                    )
+                    batches = scanner.batches(pool.STREAM_CHUNK_FILES)
+                    if scheduler is not None:
+                        finished = workers.rotate_scheduled(scheduler)
+                    elif listing is not None:
+                        groups = group_chunks(batches, pool.STREAM_CHUNK_FILES, engine)
+                        finished = workers.rotate_groups(groups)
+                    else:
+                        finished = workers.rotate_chunks(batches, angle)
+                if deduper is not None:
+                    finished = deduper.fan_out(finished)
+                for results in itertools.chain(interrupted, finished):
+                    processed += len(results)
+                    if run_journal is not None:
+                        run_journal.done(results)
+                    failures.extend(r for r in results if not r.ok)
+                    unchanged += count_skipped(results, left_alone)
+                    if rotation_index is not None:
+                        rotation_index.record(results, target)
+                    if recorder is not None:
+                        recorder.write(results, scanner.timings)
+                    progress.update(task, advance=len(results))
+                    if scanner.done:
+                        # The scan has finished: the total is now known.
+                        progress.update(task, total=max(processed, scanner.count))
+                if recorder is not None:
+                    report_metrics(recorder.close(), metrics_file)
+                if scheduler is not None:
+                    report_devices(scheduler.devices.values())
+            progress.update(task, total=processed)
+
+        if work is not None:
+            processed -= settle_queue(work, failures)
+        skipped = rotation_index.skipped if rotation_index is not None else 0
+        if rotation_index is not None:
+            rotation_index.close()
+        if deduper is not None and deduper.duplicates:
+            logger.info(
+                f"Rotated {deduper.duplicates} duplicates via their first copy."
+            )
+            console.print(
+                f"{deduper.duplicates} duplicate videos were rotated once and "
+                f"fanned out."
+            )
+        if skipped:
+            logger.info(f"Skipped {skipped} videos already rotated by earlier runs.")
+            console.print(f"Skipped {skipped} videos already rotated.")
+        elif not processed and listing is not None:
+            report_invalid(listing)
+            console.print("The manifest lists no videos. Exiting.")
+            raise typer.Exit(code=1)
+        elif not processed and work is None:
+            # Queue workers may simply find every file already claimed.
+            no_videos_found(directory)
+        rotated = processed - len(failures) - unchanged - sum(left_alone.values())
+        logger.info(
+            f"Rotation complete. Processed {processed} videos, "
+            f"{len(failures)} failed."
+        )
         console.print(
-            f"[bold green]Rotation complete![/bold green] Processed {len(video_files)} videos."
+            f"[bold green]Rotation complete![/bold green] Processed {rotated} videos."
         )
+        if unchanged:
+            console.print(f"{unchanged} videos were already at the target rotation.")
+        report_left_alone(left_alone)
+        if failures:
+            print_failures(failures)
+            if run_journal is not None and os.path.exists(run_journal.path):
+                console.print(f"Retry them with --resume {run_journal.run_id}.")
+        if listing is not None and listing.invalid:
+            report_invalid(listing)
+            raise typer.Exit(code=1)
 
     # Save the used values to config
-    set_config_value("default_directory", directory)
-    set_config_value("default_angle", angle)
+    settings.read_only = not save_config
+    settings.set("default_directory", directory)
+    settings.set("default_angle", angle)
     if output:
-        set_config_value("output_directory", output)
+        settings.set("output_directory", output)
+    settings.flush()
+
+    if failures:
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def watch(
+    directory: str = typer.Argument(..., help="Inbox directory to watch"),
+    angle: int = typer.Option(
+        int(defaults.get("default_angle", "90")),
+        help="Rotation angle (90, 180, or 270) every arriving video is set to",
+    ),
+    engine: str = typer.Option("auto", help="Rotation engine, as for a batch run"),
+    jobs: int = typer.Option(
+        pool.default_jobs(), "--jobs", "-j", min=1, help="Number of parallel workers"
+    ),
+    settle: float = typer.Option(
+        DEFAULT_SETTLE_SECONDS,
+        min=0,
+        help="Seconds a file's size and mtime must stay unchanged before it is "
+        "rotated",
+    ),
+    batch_window: float = typer.Option(
+        DEFAULT_BATCH_WINDOW,
+        min=0,
+        help="Seconds to collect settled files into one batch",
+    ),
+    max_batch: int = typer.Option(
+        DEFAULT_MAX_BATCH, min=1, help="Most files rotated by one engine call"
+    ),
+    polling: bool = typer.Option(
+        False, help="Poll the directory instead of using inotify"
+    ),
+    poll_interval: float = typer.Option(
+        1.0, min=0.01, help="Seconds between directory scans when polling"
+    ),
+    stats_file: Optional[str] = typer.Option(
+        None,
+        help="Keep queue depth, lag and arrival-to-rotated latency in this "
+        "JSON file, rewritten at every report",
+    ),
+    stats_interval: float = typer.Option(
+        10.0, min=0.1, help="Seconds between stats reports"
+    ),
+    log_level: str = typer.Option(
+        "info", help="Log verbosity: debug, info, warning or error"
+    ),
+):
+    """Rotate videos as they land in DIRECTORY, until interrupted."""
+    if log_level not in LEVELS:
+        console.print(
+            f"[bold red]Invalid log level. Please use one of: "
+            f"{', '.join(LEVELS)}.[/bold red]"
+        )
+        raise typer.Exit(code=1)
+    configure_logging(log_level)
+    if angle not in [90, 180, 270]:
+        console.print("[bold red]Invalid angle. Please use 90, 180, or 270.[/bold red]")
+        raise typer.Exit(code=1)
+    if engine not in engines.ENGINES:
+        console.print(
+            f"[bold red]Invalid engine. Please use one of: "
+            f"{', '.join(engines.ENGINES)}.[/bold red]"
+        )
+        raise typer.Exit(code=1)
+    if not os.path.isdir(directory):
+        console.print(f"[bold red]{directory} is not a directory.[/bold red]")
+        raise typer.Exit(code=1)
+    check_tools(engine, False)
+
+    inbox = InboxWatcher(
+        directory,
+        angle,
+        jobs,
+        engine=engine,
+        settle=settle,
+        batch_window=batch_window,
+        max_batch=max_batch,
+        polling=polling,
+        poll_interval=poll_interval,
+        stats_file=stats_file,
+        stats_interval=stats_interval,
+    )
+    logger.info(f"Watching {directory}; press Ctrl-C to stop.")
+    try:
+        stats = run_until_interrupted(inbox)
+    finally:
+        shutdown_logging()
+    console.print(
+        f"Rotated {stats.rotated} videos, {stats.skipped} skipped, "
+        f"{stats.failed} failed."
+    )
+    if stats.failed:
+        raise typer.Exit(code=1)
+
+
+@app.command("apply-sidecars")
+def apply_sidecars(
+    directory: str = typer.Argument(..., help="Directory of videos with sidecars"),
+    recursive: bool = typer.Option(False, help="Scan subdirectories too"),
+    engine: str = typer.Option("auto", help="Rotation engine, as for a batch run"),
+    jobs: int = typer.Option(
+        pool.default_jobs(), "--jobs", "-j", min=1, help="Number of parallel workers"
+    ),
+    mode: str = typer.Option(
+        "absolute",
+        help="absolute: set each video to its recorded rotation; relative: "
+        "add the recorded rotation (for containers that are re-encoded)",
+    ),
+    remove: bool = typer.Option(
+        False, help="Delete sidecars, or their entries, once applied"
+    ),
+    log_level: str = typer.Option(
+        "info", help="Log verbosity: debug, info, warning or error"
+    ),
+):
+    """Write the rotations recorded in XMP sidecars to the videos."""
+    if log_level not in LEVELS:
+        console.print(
+            f"[bold red]Invalid log level. Please use one of: "
+            f"{', '.join(LEVELS)}.[/bold red]"
+        )
+        raise typer.Exit(code=1)
+    configure_logging(log_level)
+    if engine not in engines.ENGINES or mode not in plan.MODES:
+        console.print(
+            f"[bold red]Invalid engine or mode. Please use --engine "
+            f"{'|'.join(engines.ENGINES)} and --mode {'|'.join(plan.MODES)}."
+            f"[/bold red]"
+        )
+        raise typer.Exit(code=1)
+    if not os.path.isdir(directory):
+        console.print(f"[bold red]{directory} is not a directory.[/bold red]")
+        raise typer.Exit(code=1)
+    check_tools(engine, False)
+
+    reader = sidecar.SidecarReader()
+    files = reader.pending(video_utils.iter_video_files(directory, recursive))
+    failures: List[engines.RotationResult] = []
+    processed = unchanged = 0
+    left_alone: Counter = Counter()
+    engine_factory = partial(engines.create_engine, engine)
+    try:
+        with scan.BackgroundScan(files) as scanner, pool.WorkerPool(
+            jobs, engine_factory, mode=mode
+        ) as workers:
+            batches = scanner.batches(pool.STREAM_CHUNK_FILES)
+            groups = group_chunks(batches, pool.STREAM_CHUNK_FILES, engine)
+            for results in workers.rotate_groups(groups):
+                processed += len(results)
+                failures.extend(r for r in results if not r.ok)
+                unchanged += count_skipped(results, left_alone)
+                if remove:
+                    reader.applied(results)
+        reader.close()
+    finally:
+        shutdown_logging()
+    if not processed:
+        console.print("No videos with sidecars found. Exiting.")
+        raise typer.Exit(code=1)
+    applied = processed - len(failures) - unchanged - sum(left_alone.values())
+    console.print(
+        f"Applied {applied} sidecars, "
+        f"{unchanged} videos were already at their rotation."
+    )
+    report_left_alone(left_alone)
+    if failures:
+        print_failures(failures)
+        raise typer.Exit(code=1)
+
+
+def run_until_interrupted(inbox):
+    """Run ``inbox`` in a thread; Ctrl-C lets the batches in flight finish."""
+    result = {}
+    runner = threading.Thread(
+        target=lambda: result.update(stats=inbox.run()), name="watch"
+    )
+    runner.start()
+    try:
+        while runner.is_alive():
+            runner.join(0.5)
+    except KeyboardInterrupt:
+        logger.info("Stopping: finishing the batches in flight.")
+        inbox.stop.set()
+        runner.join()
+    return result.get("stats", inbox.stats)
+
+
+def resume_files(
+    state: journal.RunState, video_files: Iterable[str], run_journal
+) -> Iterator[str]:
+    """Files a resumed run still has to start, rescanning only if needed."""
+    yield from state.unstarted()
+    if state.scan_complete:
+        return
+    known = set(state.scanned) | set(state.intents) | state.done
+    rescan = (path for path in video_files if path not in known)
+    yield from run_journal.scanned(rescan)
+
+
+def resume_manifest(
+    state: journal.RunState, entries: Iterable[str], run_journal
+) -> Iterator[str]:
+    """Manifest entries a resumed run still has to start.
+
+    The manifest is read again, as only its entries know their angles.
+    """
+    unstarted = set(state.unstarted())
+    known = set(state.scanned) | set(state.intents) | state.done
+    fresh = (path for path in entries if path in unstarted or path not in known)
+    yield from run_journal.scanned(fresh)
+
+
+def redo_interrupted(
+    state: journal.RunState,
+    jobs: int,
+    engine: str,
+    output: Optional[str],
+    directory: str,
+    run_journal,
+) -> Iterator[List[engines.RotationResult]]:
+    """Finish the writes a run announced but never confirmed.
+
+    Setting each file to its journaled target is idempotent, so these are
+    redone as absolute rotations. Re-encodes are not: they are reported for
+    a manual check instead.
+    """
+    groups: Dict[int, List[str]] = {}
+    for path, (target, pixels) in state.interrupted().items():
+        if pixels:
+            error = journal.INTERRUPTED_REENCODE
+            yield [engines.RotationResult(path, target, "reencode", error)]
+        else:
+            groups.setdefault(target, []).append(path)
+    if not groups:
+        return
+    logger.info(f"Redoing {sum(map(len, groups.values()))} interrupted writes.")
+    engine_factory = partial(engines.create_engine, engine)
+    with pool.WorkerPool(
+        jobs, engine_factory, output, directory, "absolute", journal=run_journal
+    ) as workers:
+        for target, files in groups.items():
+            chunks = engines.chunk_files(files, max_files=pool.STREAM_CHUNK_FILES)
+            yield from workers.rotate_chunks(chunks, target)
+
+
+def settle_queue(work, failures: List[engines.RotationResult]) -> int:
+    """Keep only the failures the queue dead-lettered; return how many retried.
+
+    A failed attempt that was retried is not a failure of the run. The
+    failures list is trimmed in place to one entry per dead-lettered file.
+    """
+    counts = work.counts()
+    dead = {path for path, _, _ in work.dead()}
+    work.close()
+    final = {r.path: r for r in failures if r.path in dead}
+    retried = len(failures) - len(final)
+    failures[:] = final.values()
+    console.print(
+        f"Queue: {counts['done']} done, {counts['dead']} dead-lettered, "
+        f"{counts['pending'] + counts['leased']} left to other workers."
+    )
+    return retried
+
+
+def report_import_time() -> None:
+    """Print how long startup took and which lazy modules got loaded."""
+    report = {
+        "startup_ms": round((time.perf_counter() - IMPORT_STARTED) * 1000, 1),
+        "modules": len(sys.modules),
+        "lazy_loaded": [name for name in LAZY_MODULES if name in sys.modules],
+    }
+    typer.echo(json.dumps(report))
+
+
+def report_metrics(summary: dict, path: Optional[str]) -> None:
+    """Log the aggregate latencies written at the end of the metrics file."""
+    for phase, stats in summary["latency"].items():
+        logger.info(
+            f"{phase[:-2]} latency: p50 {stats['p50'] * 1000:.1f} ms, "
+            f"p95 {stats['p95'] * 1000:.1f} ms, p99 {stats['p99'] * 1000:.1f} ms"
+        )
+    console.print(f"Metrics for {summary['files']} videos written to {path}.")
+
+
+def report_devices(stats: Iterable[devices.DeviceStats]) -> None:
+    """Print the files, bytes and throughput of every device of the run."""
+    table = Table(title="Per-device throughput")
+    for column in (
+        "Device",
+        "Mount",
+        "Type",
+        "Limit",
+        "Files",
+        "MB",
+        "MB/s",
+        "Files/s",
+    ):
+        table.add_column(column)
+    for device in stats:
+        limit = str(device.limit) if device.limit is not None else "-"
+        table.add_row(
+            device.name,
+            device.mount,
+            device.kind,
+            limit,
+            str(device.files),
+            f"{device.bytes / 1e6:.1f}",
+            f"{device.mb_per_s:.1f}",
+            f"{device.files_per_s:.1f}",
+        )
+        logger.info(
+            f"Device {device.name} ({device.kind}, {device.mount}): "
+            f"{device.files} files, {device.bytes / 1e6:.1f} MB in "
+            f"{device.busy_s:.2f}s, {device.mb_per_s:.1f} MB/s"
+        )
+    console.print(table)
+
+
+def check_tools(engine: str, preview: bool) -> None:
+    """Probe only the external tools this run is going to need."""
+    needed = set(tools.ENGINE_TOOLS.get(engine, ()))
+    if preview:
+        needed.add("ffmpeg")
+    if "ffmpeg" in needed:
+        video_utils.check_ffmpeg()
+    for tool in sorted(needed - {"ffmpeg"}):
+        if tools.probe(tool) is None:
+            logger.error(f"{tool} is not installed.")
+            console.print(
+                f"[bold red]{tool} is required for --engine {engine}.[/bold red]"
+            )
+            raise typer.Exit(code=1)
+
+
+def write_plan(
+    video_files,
+    angle: int,
+    mode: str,
+    jobs: int,
+    engine: str,
+    path: str,
+    per_file: bool = False,
+):
+    """Read current rotations and write the plan as JSON without rotating.
+
+    With ``per_file`` the files are manifest entries carrying their angles.
+    """
+    stream = sys.stdout if path == "-" else open(path, "w")
+    try:
+        writer = plan.PlanWriter(stream, None if per_file else angle, mode)
+        engine_factory = partial(engines.create_engine, engine)
+        with scan.BackgroundScan(video_files) as scanner, pool.WorkerPool(
+            jobs, engine_factory, mode=mode
+        ) as workers:
+            batches = scanner.batches(pool.STREAM_CHUNK_FILES)
+            if per_file:
+                groups = group_chunks(batches, pool.STREAM_CHUNK_FILES, engine)
+            else:
+                groups = ((batch, angle) for batch in batches)
+            for entries in workers.plan_groups(groups):
+                writer.write(entries)
+        writer.close()
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+    logger.info(
+        f"Planned {writer.files} videos: {writer.rotate} to rotate, "
+        f"{writer.files - writer.rotate - writer.unknown} already at target, "
+        f"{writer.unknown} with unknown rotation."
+    )
+    if stream is not sys.stdout:
+        console.print(
+            f"Plan written to {path}: {writer.rotate} of {writer.files} videos "
+            f"need rotating."
+        )
+
+
+def write_sidecars(
+    video_files,
+    angle: int,
+    mode: str,
+    jobs: int,
+    engine: str,
+    layout: str,
+    per_file: bool = False,
+) -> List[engines.RotationResult]:
+    """Record target rotations in XMP sidecars; return the files that failed."""
+    writer = sidecar.SidecarWriter(layout, jobs)
+    if mode == "absolute":
+        # The target is the angle itself: the videos are not even read.
+        for path in video_files:
+            writer.add(path, getattr(path, "angle", angle))
+    else:
+        engine_factory = partial(engines.create_engine, engine)
+        with scan.BackgroundScan(video_files) as scanner, pool.WorkerPool(
+            jobs, engine_factory, mode=mode
+        ) as workers:
+            batches = scanner.batches(pool.STREAM_CHUNK_FILES)
+            if per_file:
+                groups = group_chunks(batches, pool.STREAM_CHUNK_FILES, engine)
+            else:
+                groups = ((batch, angle) for batch in batches)
+            for entries in workers.plan_groups(groups):
+                for entry in entries:
+                    if entry.error or entry.target is None:
+                        writer.fail(entry.path, angle, entry.error or "")
+                    else:
+                        writer.add(entry.path, entry.target)
+    writer.close()
+    logger.info(f"Recorded {writer.files} rotations in {layout} sidecars.")
+    console.print(
+        f"[bold green]Sidecars written![/bold green] Recorded {writer.files} "
+        f"rotations."
+    )
+    return writer.failures
+
+
+def report_invalid(listing: Manifest) -> None:
+    console.print(
+        f"[bold red]Skipped {listing.invalid} invalid lines of manifest "
+        f"{listing.path}.[/bold red]"
+    )
+
+
+def no_videos_found(directory: str) -> None:
+    logger.warning(f"No video files found in directory: {directory}")
+    console.print("No video files found in the selected folder. Exiting.")
+    raise typer.Exit(code=1)
+
+
+def count_skipped(results: List[engines.RotationResult], left_alone: Counter) -> int:
+    """Count the files already at their target; tally the others by reason."""
+    unchanged = 0
+    for result in results:
+        if result.skip_reason:
+            left_alone[result.skip_reason] += 1
+        elif result.skipped:
+            unchanged += 1
+    return unchanged
+
+
+def report_left_alone(left_alone: Counter) -> None:
+    for reason, count in left_alone.items():
+        logger.info(f"Skipped {count} videos: {reason}.")
+        console.print(f"[yellow]Skipped {count} videos: {reason}.[/yellow]")
+
+
+def print_failures(failures) -> None:
+    """Print a summary table of files that could not be rotated."""
+    table = Table(title=f"{len(failures)} videos failed", title_style="bold red")
+    table.add_column("File")
+    table.add_column("Engine")
+    table.add_column("Error")
+    for failure in failures:
+        table.add_row(failure.path, failure.engine, failure.error)
+    console.print(table)
 
 
 if __name__ == "__main__":
@@ -1,39 +1,115 @@
 import configparser
+import contextlib
 import os
+import tempfile
+from typing import Dict, Iterator, Optional
 
 from .logger import logger
 
 CONFIG_FILE = os.path.expanduser("~/.rotate_that_batch.ini")
 
+DEFAULTS = {
+    "default_angle": "90",
+    "default_directory": ".",
+    "output_directory": "",
+}
 
-def load_config():
+
+def load_config(path: Optional[str] = None):
+    path = path or CONFIG_FILE
     config = configparser.ConfigParser()
-    config["DEFAULT"] = {
-        "default_angle": "90",
-        "default_directory": ".",
-        "output_directory": "",
-    }
-    if os.path.exists(CONFIG_FILE):
-        config.read(CONFIG_FILE)
-        logger.info(f"Loaded configuration from {CONFIG_FILE}")
+    config["DEFAULT"] = DEFAULTS
+    if os.path.exists(path):
+        config.read(path)
+        logger.info(f"Loaded configuration from {path}")
     else:
         logger.info(f"No configuration file found. Using default settings.")
     return config
 
 
-def save_config(config):
-    with open(CONFIG_FILE, "w") as configfile:
-        config.write(configfile)
-    logger.info(f"Saved configuration to {CONFIG_FILE}")
+def save_config(config, path: Optional[str] = None):
+    path = path or CONFIG_FILE
+    directory = os.path.dirname(path) or "."
+    fd, tmp = tempfile.mkstemp(prefix=".rotate_that_batch.", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as configfile:
+            config.write(configfile)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    logger.info(f"Saved configuration to {path}")
+
+
+@contextlib.contextmanager
+def _locked(path: str) -> Iterator[None]:
+    """Hold an exclusive lock on ``path``'s lock file (a no-op without fcntl)."""
+    try:
+        import fcntl
+    except ImportError:  # pragma: no cover - not on Windows
+        yield
+        return
+    with open(f"{path}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class ConfigStore:
+    """Configuration loaded once per process and written back once per run.
+
+    ``set`` only changes the in-memory copy and remembers which keys changed.
+    ``flush`` takes a file lock, re-reads the file, applies just those keys
+    and replaces the file atomically, so concurrent runs keep each other's
+    settings. A read-only store keeps changes in memory and never writes.
+    """
+
+    def __init__(self, path: Optional[str] = None, read_only: bool = False):
+        self._path = path
+        self.read_only = read_only
+        self.config = load_config(self.path)
+        self.dirty: Dict[str, str] = {}
+
+    @property
+    def path(self) -> str:
+        # Resolved late so the file can be redirected after import.
+        return self._path or CONFIG_FILE
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        return self.config["DEFAULT"].get(key, default)
+
+    def set(self, key: str, value) -> None:
+        value = str(value)
+        if self.config["DEFAULT"].get(key) == value and key not in self.dirty:
+            return
+        self.config["DEFAULT"][key] = value
+        if not self.read_only:
+            self.dirty[key] = value
+
+    def flush(self) -> bool:
+        """Write the changed keys to disk; return whether the file was written."""
+        if self.read_only or not self.dirty:
+            return False
+        with _locked(self.path):
+            config = load_config(self.path)
+            for key, value in self.dirty.items():
+                config["DEFAULT"][key] = value
+            save_config(config, self.path)
+        logger.info(
+            "Updated configuration: "
+            + ", ".join(f"{key} = {value}" for key, value in self.dirty.items())
+        )
+        self.dirty.clear()
+        return True
 
 
 def get_config_value(key, default=None):
-    config = load_config()
-    return config["DEFAULT"].get(key, default)
+    return ConfigStore(read_only=True).get(key, default)
 
 
 def set_config_value(key, value):
-    config = load_config()
-    config["DEFAULT"][key] = str(value)
-    save_config(config)
-    logger.info(f"Updated configuration: {key} = {value}")
+    store = ConfigStore()
+    store.set(key, value)
+    store.flush()
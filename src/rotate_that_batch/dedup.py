@@ -0,0 +1,225 @@
+"""Rotate duplicate files once and fan the result out to their other paths.
+
+Paths that share an inode (hard links, or symlinks to the same file) are
+the same file: rotating each of them would apply the rotation twice. With
+``content`` dedup and a link method, byte-identical copies are found too:
+files of the same size whose sampled hash matches are candidates, and only
+those whose full contents compare equal are treated as copies. The hash
+covers the first and last 64 KiB, where MP4/MOV metadata lives, and blocks
+spread evenly over the rest.
+
+Only the first path of each group goes to the engines. Once its result is
+in, every other path gets the same outcome. Hard links need no write,
+unless the engine replaced the file, in which case the link is restored.
+Copies are replaced by a clone or hard link of the rotated file, as asked.
+"""
+
+import filecmp
+import hashlib
+import os
+import struct
+import threading
+from typing import (
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from . import fastcopy, verification, video_utils
+from .logger import logger
+from .result import RotationResult
+
+DEDUP_MODES = ("off", "inode", "content")
+LINK_METHODS = ("copy", "reflink", "hardlink")
+# Bytes hashed in full at each end of a file, where MP4/MOV keep moov.
+EDGE_BYTES = 1 << 16
+
+
+def content_digest(path: str) -> str:
+    """Sampled hash of the whole of ``path``, its size included."""
+    with open(path, "rb") as f:
+        fd = f.fileno()
+        size = os.fstat(fd).st_size
+        digest = hashlib.blake2b(struct.pack(">Q", size), digest_size=16)
+        digest.update(os.pread(fd, EDGE_BYTES, 0))
+        if size > EDGE_BYTES:
+            digest.update(os.pread(fd, EDGE_BYTES, max(EDGE_BYTES, size - EDGE_BYTES)))
+        verification.sample(digest, fd, 0, size)
+    return digest.hexdigest()
+
+
+def link_file(src: str, dst: str, method: str = "copy") -> None:
+    """Replace ``dst`` with a hard link or clone of ``src``.
+
+    ``copy`` takes the cheapest clone available (a reflink where the file
+    system supports it), ``reflink`` insists on one.
+    """
+    if method not in LINK_METHODS:
+        raise ValueError(f"Unknown link method: {method}")
+    if method != "hardlink":
+        fastcopy.clone_file(src, dst, "reflink" if method == "reflink" else None)
+        return
+    tmp = f"{dst}.rtb-tmp"
+    try:
+        os.link(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class Deduplicator:
+    """Hold duplicates back from the engines and fan results out to them.
+
+    ``unique`` filters the scanned paths (it may run in the scanner thread);
+    ``fan_out`` wraps the stream of result batches and appends a result for
+    every duplicate whose first path has finished.
+    """
+
+    def __init__(
+        self,
+        mode: str = "inode",
+        link: Optional[str] = None,
+        output_dir: Optional[str] = None,
+        base_dir: Optional[str] = None,
+        on_done: Optional[Callable[[List[RotationResult]], None]] = None,
+    ):
+        if mode not in DEDUP_MODES:
+            raise ValueError(f"Unknown dedup mode: {mode}")
+        if link is not None and link not in LINK_METHODS:
+            raise ValueError(f"Unknown link method: {link}")
+        self.mode = mode
+        self.link = link
+        self.output_dir = output_dir
+        self.base_dir = base_dir
+        self.on_done = on_done
+        self.duplicates = 0
+        self._firsts: Dict[Hashable, str] = {}
+        self._pending: Set[str] = set()
+        self._waiting: Dict[str, List[Tuple[str, bool]]] = {}
+        self._done: Dict[str, RotationResult] = {}
+        self._ready: List[Tuple[str, bool, RotationResult]] = []
+        self._lock = threading.Lock()
+
+    def _keys(self, path: str, angle: int) -> List[Tuple[Hashable, bool]]:
+        st = os.stat(path)
+        keys: List[Tuple[Hashable, bool]] = [((angle, st.st_dev, st.st_ino), True)]
+        # Copies are only replaced when a link method was asked for.
+        if self.mode == "content" and self.link is not None:
+            keys.append(((angle, st.st_size, content_digest(path)), False))
+        return keys
+
+    def unique(self, files: Iterable[str], angle: int = 0) -> Iterator[str]:
+        """Yield the first path of every file, holding the duplicates back."""
+        for path in files:
+            if self.mode == "off":
+                yield path
+                continue
+            try:
+                keys = self._keys(path, getattr(path, "angle", angle))
+            except OSError:
+                yield path  # the engine reports the error
+                continue
+            first = None
+            for key, linked in keys:
+                first = self._firsts.get(key)
+                if first is not None:
+                    break
+            if first is not None and not linked and first != path:
+                if not self._same_content(first, path):
+                    logger.debug(f"{path} differs from {first}: rotating it alone.")
+                    first, keys = None, keys[:1]
+            if first is None or first == path:
+                # The same path again is a retry (e.g. from a work queue).
+                for key, _ in keys:
+                    self._firsts[key] = path
+                with self._lock:
+                    self._pending.add(path)
+                yield path
+                continue
+            logger.debug(f"{path} duplicates {first}: rotating it once.")
+            with self._lock:
+                self.duplicates += 1
+                done = self._done.get(first)
+                if done is not None:
+                    self._ready.append((path, linked, done))
+                else:
+                    self._waiting.setdefault(first, []).append((path, linked))
+
+    @staticmethod
+    def _same_content(first: str, path: str) -> bool:
+        # Runs before ``path`` is handed out. If ``first`` has been rotated
+        # meanwhile the files differ, and ``path`` is simply rotated alone.
+        try:
+            return filecmp.cmp(first, path, shallow=False)
+        except OSError:
+            return False
+
+    def _fan_out(
+        self, path: str, linked: bool, first: RotationResult
+    ) -> RotationResult:
+        result = RotationResult(
+            path,
+            first.angle,
+            first.engine,
+            skipped=first.skipped,
+            skip_reason=first.skip_reason,
+            fingerprint=first.fingerprint,
+        )
+        if not first.ok:
+            result.error = f"Duplicate of {first.path}, which failed: {first.error}"
+            return result
+        source = first.output or first.path
+        try:
+            if self.output_dir:
+                result.output = video_utils.output_path(
+                    path, self.output_dir, self.base_dir
+                )
+                os.makedirs(os.path.dirname(result.output), exist_ok=True)
+                link_file(source, result.output, self.link or "copy")
+            elif linked:
+                # Engines that write a new file and rename it over the old
+                # one break the link: restore it.
+                if not os.path.samefile(source, path):
+                    link_file(source, path, "hardlink")
+            elif self.link is not None and not first.skipped:
+                link_file(source, path, self.link)
+        except OSError as e:
+            logger.error(f"Failed to fan {source} out to {path}: {str(e)}")
+            result.error = str(e)
+        return result
+
+    def fan_out(
+        self, batches: Iterable[List[RotationResult]]
+    ) -> Iterator[List[RotationResult]]:
+        """Pass result batches through, extended by their duplicates' results."""
+        for results in batches:
+            with self._lock:
+                for result in results:
+                    if result.path not in self._pending:
+                        continue
+                    self._pending.discard(result.path)
+                    self._done[result.path] = result
+                    for path, linked in self._waiting.pop(result.path, ()):
+                        self._ready.append((path, linked, result))
+                ready, self._ready = self._ready, []
+            yield results + self._fan_out_all(ready)
+        with self._lock:
+            ready, self._ready = self._ready, []
+        if ready:
+            yield self._fan_out_all(ready)
+
+    def _fan_out_all(
+        self, ready: List[Tuple[str, bool, RotationResult]]
+    ) -> List[RotationResult]:
+        results = [self._fan_out(*entry) for entry in ready]
+        if results and self.on_done is not None:
+            self.on_done(results)
+        return results
@@ -0,0 +1,267 @@
+"""Per-device scheduling of rotation work.
+
+Files are grouped by the device they live on (``st_dev``) and every device
+gets its own cap on chunks in flight: low for spinning disks, whose
+throughput collapses once several streams make the heads seek, and none by
+default for SSDs. Within a device, files go out smallest first (for an
+early first result) or in inode order (close to the on-disk layout on most
+file systems, so fewer seeks). Ordering applies to a lookahead window, so
+the scan still streams.
+"""
+
+import heapq
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from . import engines
+from .logger import logger
+
+ORDERS = ("size", "inode")
+DEFAULT_HDD_JOBS = 2
+LOOKAHEAD_FILES = 16384
+# Files that cannot be stat'ed; they are not capped and fail in the engine.
+UNKNOWN_DEVICE = -1
+
+
+def is_rotational(device: int) -> Optional[bool]:
+    """Whether ``device`` is a spinning disk; None if the kernel won't say."""
+    base = os.path.realpath(f"/sys/dev/block/{os.major(device)}:{os.minor(device)}")
+    # Partitions have no queue of their own: ask the disk they belong to.
+    for directory in (base, os.path.dirname(base)):
+        try:
+            with open(os.path.join(directory, "queue", "rotational")) as f:
+                return f.read().strip() == "1"
+        except OSError:
+            continue
+    return None
+
+
+def mount_point(path: str, device: int) -> str:
+    """Topmost directory above ``path`` that is still on ``device``."""
+    current = os.path.dirname(os.path.abspath(path))
+    while True:
+        parent = os.path.dirname(current)
+        try:
+            if parent == current or os.stat(parent).st_dev != device:
+                return current
+        except OSError:
+            return current
+        current = parent
+
+
+@dataclass
+class DeviceStats:
+    """Limit and throughput of one device."""
+
+    device: int
+    kind: str
+    limit: Optional[int]
+    mount: str
+    files: int = 0
+    bytes: int = 0
+    busy_s: float = 0.0
+    inflight: int = 0
+    since: float = field(default=0.0, repr=False)
+
+    @property
+    def name(self) -> str:
+        if self.device == UNKNOWN_DEVICE:
+            return "unknown"
+        return f"{os.major(self.device)}:{os.minor(self.device)}"
+
+    @property
+    def mb_per_s(self) -> float:
+        return self.bytes / 1e6 / self.busy_s if self.busy_s else 0.0
+
+    @property
+    def files_per_s(self) -> float:
+        return self.files / self.busy_s if self.busy_s else 0.0
+
+
+@dataclass
+class Chunk:
+    """Files of one device, angle and engine handed to a worker together."""
+
+    paths: List[str]
+    angle: int
+    device: int
+    bytes: int
+
+
+class DeviceScheduler:
+    """Hand out chunks of ``files`` within per-device concurrency limits.
+
+    A feeder thread stats the files into per-device queues. ``take`` hands
+    out the chunks that fit the limits and ``release`` returns a finished
+    chunk's slot. Manifest entries keep their own angles.
+    """
+
+    def __init__(
+        self,
+        files: Iterable[str],
+        angle: int,
+        chunk_size: int,
+        order: str = "size",
+        hdd_jobs: int = DEFAULT_HDD_JOBS,
+        ssd_jobs: int = 0,
+        engine: str = "auto",
+        lookahead: int = LOOKAHEAD_FILES,
+    ):
+        if order not in ORDERS:
+            raise ValueError(f"Unknown order: {order}")
+        self.angle = angle
+        self.chunk_size = chunk_size
+        self.order = order
+        self.hdd_jobs = hdd_jobs
+        self.ssd_jobs = ssd_jobs
+        self.engine = engine
+        self.lookahead = lookahead
+        self.devices: Dict[int, DeviceStats] = {}
+        self.error: Optional[BaseException] = None
+        self.changes = 0
+        self._queues: Dict[int, Dict[Tuple[int, str], list]] = {}
+        self._buffered = 0
+        self._added = 0
+        self._fed = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._feed, args=(files,), name="scheduler", daemon=True
+        )
+        self._thread.start()
+
+    def __enter__(self) -> "DeviceScheduler":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def _stats(self, device: int, path: str) -> DeviceStats:
+        stats = self.devices.get(device)
+        if stats is None:
+            rotational = None if device == UNKNOWN_DEVICE else is_rotational(device)
+            kind = {True: "hdd", False: "ssd", None: "unknown"}[rotational]
+            limit = self.hdd_jobs if rotational else self.ssd_jobs or None
+            mount = "" if device == UNKNOWN_DEVICE else mount_point(path, device)
+            stats = DeviceStats(device, kind, limit, mount)
+            self.devices[device] = stats
+            logger.debug(f"Device {stats.name} ({kind}) at {mount}: limit {limit}")
+        return stats
+
+    def _feed(self, files: Iterable[str]) -> None:
+        try:
+            for path in files:
+                try:
+                    st: Optional[os.stat_result] = os.stat(path)
+                except OSError:
+                    st = None
+                with self._cond:
+                    while self._buffered >= self.lookahead and not self._closed:
+                        self._cond.wait()
+                    if self._closed:
+                        return
+                    self._add(path, st)
+        except BaseException as e:
+            logger.error(f"Scheduling failed: {str(e)}")
+            self.error = e
+        finally:
+            with self._cond:
+                self._fed = True
+                self._changed()
+
+    def _add(self, path: str, st: Optional[os.stat_result]) -> None:
+        device = st.st_dev if st is not None else UNKNOWN_DEVICE
+        self._stats(device, path)
+        size = st.st_size if st is not None else 0
+        rank = size if self.order == "size" or st is None else st.st_ino
+        angle = getattr(path, "angle", self.angle)
+        group = (angle, engines.route_name(path, self.engine))
+        queue = self._queues.setdefault(device, {}).setdefault(group, [])
+        # The running count keeps ties in arrival order.
+        heapq.heappush(queue, (rank, self._added, path, size))
+        self._added += 1
+        self._buffered += 1
+        self._changed()
+
+    def _changed(self) -> None:
+        self.changes += 1
+        self._cond.notify_all()
+
+    def _pop_chunk(self, device: int) -> Optional[Chunk]:
+        groups = self._queues.get(device)
+        if not groups:
+            return None
+        group = min(groups, key=lambda g: groups[g][0])
+        queue = groups[group]
+        paths: List[str] = []
+        total = 0
+        while queue and len(paths) < self.chunk_size:
+            _, _, path, size = heapq.heappop(queue)
+            paths.append(path)
+            total += size
+        if not queue:
+            del groups[group]
+        self._buffered -= len(paths)
+        return Chunk(paths, group[0], device, total)
+
+    def take(self, room: int) -> List[Chunk]:
+        """Up to ``room`` chunks that fit their device's limit right now."""
+        chunks: List[Chunk] = []
+        with self._cond:
+            progress = True
+            while progress and len(chunks) < room:
+                progress = False
+                # One chunk per device per round, so devices share the room.
+                for device, stats in self.devices.items():
+                    if len(chunks) >= room:
+                        break
+                    if stats.limit is not None and stats.inflight >= stats.limit:
+                        continue
+                    chunk = self._pop_chunk(device)
+                    if chunk is None:
+                        continue
+                    if not stats.inflight:
+                        stats.since = time.perf_counter()
+                    stats.inflight += 1
+                    chunks.append(chunk)
+                    progress = True
+            if chunks:
+                self._changed()  # room for the feeder again
+        return chunks
+
+    def release(self, chunk: Chunk) -> None:
+        """Count a finished chunk and free its device slot."""
+        with self._cond:
+            stats = self.devices[chunk.device]
+            stats.files += len(chunk.paths)
+            stats.bytes += chunk.bytes
+            stats.inflight -= 1
+            if not stats.inflight:
+                stats.busy_s += time.perf_counter() - stats.since
+            self._changed()
+
+    def notify(self, *_) -> None:
+        """Wake up ``wait``; used as a future's done callback."""
+        with self._cond:
+            self._changed()
+
+    def wait(self, seen: int) -> None:
+        """Block until something changed since ``changes`` was ``seen``."""
+        with self._cond:
+            while self.changes == seen:
+                self._cond.wait()
+
+    @property
+    def exhausted(self) -> bool:
+        """Whether every file has been fed and handed out."""
+        with self._cond:
+            return self._fed and not self._buffered
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._changed()
+        self._thread.join()
@@ -0,0 +1,385 @@
+import json
+import os
+import re
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Protocol,
+    Tuple,
+)
+
+from . import mp4, transcode
+from .logger import logger
+from .result import RotationResult
+
+# ExifTool reads its arguments from stdin in -stay_open mode, but we still keep
+# every execute call well under the platform argv limit so a chunk is always a
+# command line ExifTool (and the kernel, if it ever re-execs) will accept.
+try:
+    ARG_MAX = os.sysconf("SC_ARG_MAX")
+except (AttributeError, ValueError, OSError):  # pragma: no cover
+    ARG_MAX = 32768
+DEFAULT_CHUNK_FILES = 256
+DEFAULT_CHUNK_BYTES = min(ARG_MAX // 4, 128 * 1024)
+
+# Engine each container is routed to by the auto engine; ExifTool otherwise.
+ROUTES = {
+    **{ext: "native" for ext in mp4.NATIVE_EXTENSIONS},
+    **{ext: "remux" for ext in transcode.REMUX_EXTENSIONS},
+    **{ext: "reencode" for ext in transcode.REENCODE_EXTENSIONS},
+}
+
+RESULT_MARKER = "=rtb={index}=${{status}}="
+RESULT_MARKER_RE = re.compile(r"=rtb=(\d+)=(\d+)=")
+
+
+class Engine(Protocol):
+    """What the worker pool and planner need from a rotation engine."""
+
+    name: str
+
+    def start(self) -> None:
+        ...
+
+    def close(self) -> None:
+        ...
+
+    def read_rotations(self, files: Iterable[str]) -> Dict[str, Optional[int]]:
+        ...
+
+    def rewrites_pixels(self, path: str) -> bool:
+        ...
+
+    def rotate_batch(self, files: Iterable[str], angle: int) -> List[RotationResult]:
+        ...
+
+
+def chunk_files(
+    files: Iterable[str],
+    max_files: int = DEFAULT_CHUNK_FILES,
+    max_bytes: int = DEFAULT_CHUNK_BYTES,
+    per_file_overhead: int = 0,
+) -> Iterator[List[str]]:
+    """Split files into chunks bounded by file count and argument bytes."""
+    chunk: List[str] = []
+    size = 0
+    for path in files:
+        cost = len(os.fsencode(path)) + 1 + per_file_overhead
+        if chunk and (len(chunk) >= max_files or size + cost > max_bytes):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(path)
+        size += cost
+    if chunk:
+        yield chunk
+
+
+def route_name(path: str, engine: str = "auto") -> str:
+    """Name of the engine that rotates ``path`` when running ``engine``."""
+    if engine != "auto":
+        return engine
+    return ROUTES.get(os.path.splitext(path)[1].lower(), "exiftool")
+
+
+def rotation_tag(record: Dict[str, Any]) -> Optional[int]:
+    """Rotation from one ExifTool ``-json`` record, with or without ``-G``."""
+    # ExifToolHelper runs with -G, so tags come back as "QuickTime:Rotation".
+    for key, value in record.items():
+        if key == "Rotation" or key.endswith(":Rotation"):
+            return int(value) % 360
+    return None
+
+
+class ExifToolEngine:
+    """Rotation engine backed by a single long-lived ``-stay_open`` ExifTool."""
+
+    name = "exiftool"
+
+    def __init__(
+        self,
+        max_files: int = DEFAULT_CHUNK_FILES,
+        max_bytes: int = DEFAULT_CHUNK_BYTES,
+    ):
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self._et: Optional[Any] = None
+
+    def __enter__(self) -> "ExifToolEngine":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def start(self) -> None:
+        """Start the ExifTool process if it is not already running."""
+        if self._et is None:
+            # Imported here: most runs never start ExifTool at all.
+            import exiftool  # type: ignore
+
+            self._et = exiftool.ExifToolHelper(check_execute=False)
+            logger.debug("Started persistent ExifTool process.")
+
+    def close(self) -> None:
+        """Terminate the ExifTool process."""
+        if self._et is not None:
+            self._et.terminate()
+            self._et = None
+
+    @staticmethod
+    def write_args(angle: int) -> List[str]:
+        return [f"-Rotation={angle}", "-overwrite_original"]
+
+    @classmethod
+    def chunk_params(cls, chunk: List[str], angle: int) -> List[str]:
+        """ExifTool arguments that rotate ``chunk`` and report every file."""
+        # Every file gets its own ExifTool command (joined with -execute) that
+        # ends by echoing a marker and its exit status to stderr, so a single
+        # unreadable file only fails its own entry instead of the whole chunk.
+        params: List[str] = []
+        for index, path in enumerate(chunk):
+            if index:
+                params.append("-execute")
+            params.extend(cls.write_args(angle))
+            params.extend(["-echo4", RESULT_MARKER.format(index=index), path])
+        return params
+
+    def rotate_iter(
+        self, files: Iterable[str], angle: int
+    ) -> Iterator[List[RotationResult]]:
+        """Rotate files chunk by chunk, yielding the results of each chunk."""
+        overhead = sum(len(a) + 1 for a in self.write_args(angle)) + 32
+        for chunk in chunk_files(files, self.max_files, self.max_bytes, overhead):
+            # A failed chunk closes ExifTool; the next one starts a fresh process.
+            self.start()
+            yield self._execute_chunk(chunk, angle)
+
+    def rotate_batch(self, files: Iterable[str], angle: int) -> List[RotationResult]:
+        """Rotate files and return one result per file."""
+        results: List[RotationResult] = []
+        for chunk_results in self.rotate_iter(files, angle):
+            results.extend(chunk_results)
+        return results
+
+    def read_rotations(self, files: Iterable[str]) -> Dict[str, Optional[int]]:
+        """Read the current rotation of files with one ``-json`` call per chunk."""
+        rotations: Dict[str, Optional[int]] = {}
+        for chunk in chunk_files(files, self.max_files, self.max_bytes):
+            self.start()
+            assert self._et is not None
+            try:
+                output = self._et.execute("-json", "-n", "-Rotation", *chunk)
+                records = json.loads(output) if output.strip() else []
+            except Exception as e:
+                logger.error(f"ExifTool failed while reading rotations: {str(e)}")
+                self.close()
+                continue
+            for record in records:
+                rotations[record["SourceFile"]] = rotation_tag(record)
+        return rotations
+
+    def rewrites_pixels(self, path: str) -> bool:
+        return False
+
+    def _execute_chunk(self, chunk: List[str], angle: int) -> List[RotationResult]:
+        assert self._et is not None
+        try:
+            self._et.execute(*self.chunk_params(chunk, angle))
+        except Exception as e:
+            logger.error(f"ExifTool failed while processing a chunk: {str(e)}")
+            self.close()
+            return [RotationResult(p, angle, self.name, str(e)) for p in chunk]
+
+        return self._parse_results(chunk, angle, self._et.last_stderr or "")
+
+    def _parse_results(
+        self, chunk: List[str], angle: int, stderr: str
+    ) -> List[RotationResult]:
+        results: List[RotationResult] = []
+        start = 0
+        seen: Dict[int, Tuple[Optional[int], str]] = {}
+        for match in RESULT_MARKER_RE.finditer(stderr):
+            message = stderr[start : match.start()].strip()
+            seen[int(match.group(1))] = (int(match.group(2)), message)
+            start = match.end()
+
+        for index, path in enumerate(chunk):
+            status, message = seen.get(index, (None, "No result reported by ExifTool"))
+            if status == 0:
+                logger.debug(f"Successfully rotated video: {path} by {angle} degrees.")
+                results.append(RotationResult(path, angle, self.name))
+            else:
+                error = message or f"ExifTool exited with status {status}"
+                logger.error(f"Failed to rotate video: {path}. Error: {error}")
+                results.append(RotationResult(path, angle, self.name, error))
+        return results
+
+
+class NativeEngine:
+    """Rotation engine that patches MP4/MOV ``tkhd`` matrices in place."""
+
+    name = "native"
+
+    def start(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def rotate_file(self, path: str, angle: int) -> RotationResult:
+        """Rotate one file, raising ``mp4.UnsupportedContainer`` if unsupported."""
+        written = mp4.set_rotation(path, angle)
+        logger.debug(f"Successfully rotated video: {path} by {angle} degrees.")
+        return RotationResult(
+            path, angle, self.name, metrics={"bytes_written": written}
+        )
+
+    def read_rotations(self, files: Iterable[str]) -> Dict[str, Optional[int]]:
+        rotations: Dict[str, Optional[int]] = {}
+        for path in files:
+            try:
+                rotations[path] = mp4.read_rotation(path)
+            except (mp4.UnsupportedContainer, OSError) as e:
+                logger.debug(f"Cannot read rotation of {path}: {str(e)}")
+        return rotations
+
+    def rewrites_pixels(self, path: str) -> bool:
+        return False
+
+    def rotate_batch(self, files: Iterable[str], angle: int) -> List[RotationResult]:
+        results = []
+        for path in files:
+            try:
+                results.append(self.rotate_file(path, angle))
+            except (mp4.UnsupportedContainer, OSError) as e:
+                logger.error(f"Failed to rotate video: {path}. Error: {str(e)}")
+                results.append(RotationResult(path, angle, self.name, str(e)))
+        return results
+
+
+class AutoEngine:
+    """Pick the cheapest engine per container.
+
+    MP4/MOV matrices are patched natively (falling back to ExifTool if the
+    file cannot be parsed), Matroska is remuxed with a new display matrix,
+    containers without rotation metadata are re-encoded, and everything else
+    goes through ExifTool. Helper engines,
+    and their processes, are only started once a file needs them.
+    ``runner`` runs the ffmpeg commands instead of ``transcode.run_ffmpeg``.
+    """
+
+    name = "auto"
+
+    def __init__(self, runner: Optional[transcode.Runner] = None) -> None:
+        self.native = NativeEngine()
+        self.exiftool = ExifToolEngine()
+        self.reencode = transcode.ReencodeEngine(runner=runner)
+        self.routes: Dict[str, Engine] = {
+            ext: self.native for ext in mp4.NATIVE_EXTENSIONS
+        }
+        self.remux = transcode.RemuxEngine(runner=runner)
+        self.routes.update(
+            {ext: self.reencode for ext in transcode.REENCODE_EXTENSIONS}
+        )
+        self.routes.update({ext: self.remux for ext in transcode.REMUX_EXTENSIONS})
+
+    def start(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.exiftool.close()
+
+    def route(self, path: str) -> Engine:
+        """The engine that handles ``path``."""
+        return self.routes.get(os.path.splitext(path)[1].lower(), self.exiftool)
+
+    def _group(self, files: Iterable[str]) -> Dict[Engine, List[str]]:
+        groups: Dict[Engine, List[str]] = {}
+        for path in files:
+            groups.setdefault(self.route(path), []).append(path)
+        return groups
+
+    def rewrites_pixels(self, path: str) -> bool:
+        return self.route(path).rewrites_pixels(path)
+
+    def read_rotations(self, files: Iterable[str]) -> Dict[str, Optional[int]]:
+        rotations: Dict[str, Optional[int]] = {}
+        fallback = []
+        for engine, paths in self._group(files).items():
+            if engine is not self.native:
+                if engine is self.exiftool:
+                    fallback.extend(paths)
+                else:
+                    rotations.update(engine.read_rotations(paths))
+                continue
+            for path in paths:
+                try:
+                    rotations[path] = mp4.read_rotation(path)
+                except mp4.UnsupportedContainer:
+                    fallback.append(path)
+                except OSError as e:
+                    logger.debug(f"Cannot read rotation of {path}: {str(e)}")
+        if fallback:
+            rotations.update(self.exiftool.read_rotations(fallback))
+        return rotations
+
+    def rotate_batch(self, files: Iterable[str], angle: int) -> List[RotationResult]:
+        results = []
+        fallback = []
+        for engine, paths in self._group(files).items():
+            if engine is self.exiftool:
+                fallback.extend(paths)
+            elif engine is not self.native:
+                results.extend(engine.rotate_batch(paths, angle))
+            else:
+                for path in paths:
+                    try:
+                        results.append(self.native.rotate_file(path, angle))
+                    except mp4.UnsupportedContainer as e:
+                        logger.debug(
+                            f"Native engine cannot handle {path} ({e}), using ExifTool."
+                        )
+                        fallback.append(path)
+                    except OSError as e:
+                        logger.error(f"Failed to rotate video: {path}. Error: {str(e)}")
+                        results.append(
+                            RotationResult(path, angle, self.native.name, str(e))
+                        )
+        if fallback:
+            results.extend(self.exiftool.rotate_batch(fallback, angle))
+        return results
+
+
+ENGINES: Dict[str, Callable[..., Engine]] = {
+    "auto": AutoEngine,
+    "native": NativeEngine,
+    "exiftool": ExifToolEngine,
+    "reencode": transcode.ReencodeEngine,
+    "remux": transcode.RemuxEngine,
+}
+
+
+# Engines that call ffmpeg, and so take a ``runner``.
+FFMPEG_ENGINES = ("auto", "reencode", "remux")
+
+
+def create_engine(
+    name: str = "auto", runner: Optional[transcode.Runner] = None
+) -> Engine:
+    """Instantiate a rotation engine by name.
+
+    ``runner`` replaces ``transcode.run_ffmpeg`` in the engines that call
+    ffmpeg, e.g. to run it from an event loop.
+    """
+    try:
+        factory = ENGINES[name]
+    except KeyError:
+        raise ValueError(f"Unknown engine: {name}")
+    if runner is not None and name in FFMPEG_ENGINES:
+        return factory(runner=runner)
+    return factory()
@@ -0,0 +1,120 @@
+import errno
+import os
+import shutil
+from typing import Optional
+
+from .logger import logger
+
+# ioctl(2) request number for FICLONE (_IOW(0x94, 9, int)) on Linux.
+FICLONE = 0x40049409
+_COPY_CHUNK = 1 << 30
+
+# errnos meaning "this mechanism is not available here, try the next one".
+_UNSUPPORTED = {
+    errno.EBADF,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.EXDEV,
+    errno.EPERM,
+}
+
+
+def _reflink(src_fd: int, dst_fd: int, size: int) -> bool:
+    try:
+        import fcntl
+    except ImportError:  # pragma: no cover - not on Windows
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except OSError as e:
+        if e.errno in _UNSUPPORTED:
+            return False
+        raise
+
+
+def _copy_file_range(src_fd: int, dst_fd: int, size: int) -> bool:
+    copy_file_range = getattr(os, "copy_file_range", None)
+    if copy_file_range is None:
+        return False
+    offset = 0
+    while offset < size:
+        try:
+            copied = copy_file_range(src_fd, dst_fd, min(_COPY_CHUNK, size - offset))
+        except OSError as e:
+            if offset == 0 and e.errno in _UNSUPPORTED:
+                return False
+            raise
+        if copied == 0:
+            break
+        offset += copied
+    return True
+
+
+def _sendfile(src_fd: int, dst_fd: int, size: int) -> bool:
+    sendfile = getattr(os, "sendfile", None)
+    if sendfile is None:
+        return False
+    offset = 0
+    while offset < size:
+        try:
+            sent = sendfile(dst_fd, src_fd, offset, min(_COPY_CHUNK, size - offset))
+        except OSError as e:
+            if offset == 0 and e.errno in _UNSUPPORTED:
+                return False
+            raise
+        if sent == 0:
+            break
+        offset += sent
+    return True
+
+
+def _read_write(src_fd: int, dst_fd: int, size: int) -> bool:
+    with open(src_fd, "rb", closefd=False) as fsrc:
+        with open(dst_fd, "wb", closefd=False) as fdst:
+            shutil.copyfileobj(fsrc, fdst, 1 << 20)
+    return True
+
+
+# Cheapest first: a reflink shares extents and copies nothing, the next two
+# copy inside the kernel, and plain read/write is the portable last resort.
+METHODS = (
+    ("reflink", _reflink),
+    ("copy_file_range", _copy_file_range),
+    ("sendfile", _sendfile),
+    ("copy", _read_write),
+)
+
+
+def clone_file(src: str, dst: str, method: Optional[str] = None) -> str:
+    """Clone ``src`` to ``dst`` with the cheapest available mechanism.
+
+    The clone is written to a temporary name next to ``dst`` and renamed into
+    place, so a failed copy never leaves a truncated output. Returns the name
+    of the mechanism that was used.
+    """
+    tmp = f"{dst}.rtb-tmp"
+    with open(src, "rb") as fsrc:
+        size = os.fstat(fsrc.fileno()).st_size
+        try:
+            with open(tmp, "wb") as fdst:
+                for name, copy in METHODS:
+                    if method and name != method:
+                        continue
+                    if copy(fsrc.fileno(), fdst.fileno(), size):
+                        break
+                    # A partially failed attempt must not leave data behind.
+                    fdst.truncate(0)
+                    fsrc.seek(0)
+                else:
+                    raise OSError(errno.ENOTSUP, f"Copy method unavailable: {method}")
+            shutil.copystat(src, tmp)
+            os.replace(tmp, dst)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+    logger.debug(f"Cloned {src} to {dst} using {name}.")
+    return name
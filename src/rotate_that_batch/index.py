@@ -0,0 +1,131 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable, Iterator, Optional
+
+from .engines import RotationResult
+from .logger import logger
+
+INDEX_FILE = os.path.expanduser("~/.rotate_that_batch.sqlite")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT NOT NULL,
+    target TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    angle INTEGER NOT NULL,
+    engine TEXT NOT NULL,
+    rotated_at REAL NOT NULL,
+    PRIMARY KEY (path, target)
+) WITHOUT ROWID
+"""
+
+
+class RotationIndex:
+    """On-disk record of which files were rotated, and to what.
+
+    Entries are keyed by absolute path and target (the output directory, or
+    ``""`` for in-place runs) and store the size, mtime and inode seen right
+    after the write. A file whose stat still matches, for the same angle, is
+    skipped on the next run with nothing more than a stat call.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or INDEX_FILE
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(_SCHEMA)
+        self._db.commit()
+
+    def __enter__(self) -> "RotationIndex":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def is_current(
+        self,
+        path: str,
+        angle: int,
+        target: str = "",
+        st: Optional[os.stat_result] = None,
+    ) -> bool:
+        """Whether ``path`` was already rotated to ``angle`` and is unchanged."""
+        try:
+            st = st or os.stat(path)
+        except OSError:
+            return False
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size, mtime_ns, inode, angle FROM files "
+                "WHERE path = ? AND target = ?",
+                (os.path.abspath(path), target),
+            ).fetchone()
+        return row == (st.st_size, st.st_mtime_ns, st.st_ino, angle)
+
+    def pending(
+        self, files: Iterable[str], angle: int, target: str = ""
+    ) -> Iterator[str]:
+        """Yield only the files that still need rotating, counting the rest."""
+        for path in files:
+            # Manifest entries carry their own angle.
+            if self.is_current(path, getattr(path, "angle", angle), target):
+                self.skipped += 1
+                continue
+            yield path
+
+    def record(self, results: Iterable[RotationResult], target: str = "") -> None:
+        """Store the post-write state of every successfully rotated file."""
+        rows = []
+        now = time.time()
+        for result in results:
+            if not result.ok or result.skip_reason:
+                continue
+            try:
+                st = os.stat(result.path)
+            except OSError:
+                continue
+            rows.append(
+                (
+                    os.path.abspath(result.path),
+                    target,
+                    st.st_size,
+                    st.st_mtime_ns,
+                    st.st_ino,
+                    result.angle,
+                    result.engine,
+                    now,
+                )
+            )
+        if not rows:
+            return
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self._db.commit()
+
+    def clear(self, directory: Optional[str] = None) -> int:
+        """Forget entries under ``directory`` (or all of them); return the count."""
+        with self._lock:
+            if directory is None:
+                cursor = self._db.execute("DELETE FROM files")
+            else:
+                prefix = os.path.join(os.path.abspath(directory), "")
+                cursor = self._db.execute(
+                    "DELETE FROM files WHERE path >= ? AND path < ?",
+                    (prefix, prefix + "\U0010ffff"),
+                )
+            self._db.commit()
+        logger.info(f"Removed {cursor.rowcount} entries from rotation index.")
+        return cursor.rowcount
@@ -0,0 +1,227 @@
+"""Append-only, crash-safe journal of one rotation run.
+
+Every run writes a JSON-lines file named after its run id. It holds the
+run's settings, each file the scan found, the target a file was about to
+be written to (its *intent*) and the outcome of every file. ``--resume``
+reads it back and continues where the run stopped, retrying the files
+that failed. A run that finishes without failures removes its journal.
+
+Intents are fsynced before the write they announce, once per chunk, so a
+file that may have been written is always known together with its target.
+Redoing it as an absolute rotation to that target is idempotent.
+Everything else is fsynced in batches; losing the tail of the journal only
+means redoing a few idempotent writes.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .logger import logger
+from .result import RotationResult
+
+JOURNAL_DIR = os.path.join(
+    os.environ.get("XDG_STATE_HOME") or os.path.expanduser("~/.local/state"),
+    "rotate_that_batch",
+    "runs",
+)
+
+# Records buffered between fsyncs, and the longest a record may wait.
+SYNC_RECORDS = 256
+SYNC_SECONDS = 1.0
+
+INTERRUPTED_REENCODE = (
+    "The run stopped while re-encoding this file; it may or may not have "
+    "been rotated, check it manually"
+)
+
+
+class JournalError(Exception):
+    """Raised when a run journal is missing or cannot be resumed."""
+
+
+@dataclass
+class RunState:
+    """What a journal says about its run."""
+
+    run_id: str
+    settings: Dict
+    scanned: List[str] = field(default_factory=list)
+    scan_complete: bool = False
+    intents: Dict[str, Tuple[int, bool]] = field(default_factory=dict)
+    done: Set[str] = field(default_factory=set)
+    failed: Set[str] = field(default_factory=set)
+    finished: bool = False
+
+    def interrupted(self) -> Dict[str, Tuple[int, bool]]:
+        """Files that may have been written: their target and pixel flag."""
+        return {
+            p: i
+            for p, i in self.intents.items()
+            if p not in self.done and p not in self.failed
+        }
+
+    def unstarted(self) -> List[str]:
+        """Scanned files to rotate from scratch: never announced, or failed."""
+        return [
+            p
+            for p in self.scanned
+            if p not in self.done and (p not in self.intents or p in self.failed)
+        ]
+
+
+def journal_path(run_id: str) -> str:
+    return os.path.join(JOURNAL_DIR, f"{run_id}.jsonl")
+
+
+def new_run_id() -> str:
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+def load(run_id: str) -> RunState:
+    """Replay the journal of ``run_id``; a torn last line is ignored."""
+    path = journal_path(run_id)
+    try:
+        f = open(path)
+    except OSError as e:
+        raise JournalError(
+            f"No journal for run {run_id} (runs that finish without failures "
+            f"remove theirs): {str(e)}"
+        )
+    state: Optional[RunState] = None
+    seen: Set[str] = set()
+    with f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.warning(f"Ignoring a torn record in {path}.")
+                break
+            op = record.get("op")
+            if op == "run":
+                state = RunState(run_id, record["settings"])
+                continue
+            if state is None:
+                raise JournalError(f"Journal {path} has no run header")
+            if op == "scan":
+                for scanned in record["paths"]:
+                    if scanned not in seen:
+                        seen.add(scanned)
+                        state.scanned.append(scanned)
+            elif op == "scanned":
+                state.scan_complete = True
+            elif op == "intent":
+                for source, target, pixels in record["files"]:
+                    state.intents[source] = (target, pixels)
+            elif op == "done":
+                state.done.update(record["paths"])
+                state.failed.difference_update(record["paths"])
+            elif op == "failed":
+                state.failed.update(record["paths"])
+            # A resumed run appends after the end of the one it retries.
+            state.finished = op == "end"
+    if state is None:
+        raise JournalError(f"Journal {path} is empty")
+    return state
+
+
+class RunJournal:
+    """Writer for one run's journal; safe to share between threads.
+
+    ``failed`` are the files earlier attempts of the run failed on: the
+    journal is only removed at the end once none of them is left.
+    """
+
+    def __init__(self, run_id: str, failed: Iterable[str] = ()):
+        self.run_id = run_id
+        self.path = journal_path(run_id)
+        os.makedirs(JOURNAL_DIR, exist_ok=True)
+        self._file: IO[str] = open(self.path, "a")
+        self._failed = set(failed)
+        self._buffer: List[str] = []
+        self._synced = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, settings: Dict) -> "RunJournal":
+        journal = cls(new_run_id())
+        journal._append({"op": "run", "settings": settings}, sync=True)
+        return journal
+
+    def __enter__(self) -> "RunJournal":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close(finished=exc_type is None)
+
+    def _append(self, record: Dict, sync: bool = False) -> None:
+        with self._lock:
+            if self._file.closed:
+                # A scan still winding down after the run was aborted.
+                return
+            self._buffer.append(json.dumps(record) + "\n")
+            due = len(self._buffer) >= SYNC_RECORDS
+            if sync or due or time.monotonic() - self._synced >= SYNC_SECONDS:
+                self._sync()
+
+    def _sync(self) -> None:
+        self._file.write("".join(self._buffer))
+        self._buffer.clear()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._synced = time.monotonic()
+
+    def scanned(self, files: Iterable[str], complete: bool = True) -> Iterator[str]:
+        """Pass ``files`` through, recording each; mark the scan complete."""
+        batch: List[str] = []
+        for path in files:
+            batch.append(path)
+            if len(batch) >= SYNC_RECORDS:
+                self._append({"op": "scan", "paths": batch})
+                batch = []
+            yield path
+        if batch:
+            self._append({"op": "scan", "paths": batch})
+        if complete:
+            self._append({"op": "scanned"}, sync=True)
+
+    def intend(self, files: Iterable[Tuple[str, int, bool]]) -> None:
+        """Durably announce ``(source, target, rewrites_pixels)`` writes."""
+        files = list(files)
+        if files:
+            self._append({"op": "intent", "files": files}, sync=True)
+
+    def done(self, results: Iterable[RotationResult]) -> None:
+        """Record outcomes: failed files are retried by ``--resume``."""
+        done: List[str] = []
+        failed: List[str] = []
+        for result in results:
+            # An interrupted re-encode needs a manual check, not a retry.
+            if result.ok or result.error == INTERRUPTED_REENCODE:
+                done.append(result.path)
+            else:
+                failed.append(result.path)
+        with self._lock:
+            self._failed.difference_update(done)
+            self._failed.update(failed)
+        if done:
+            self._append({"op": "done", "paths": done})
+        if failed:
+            self._append({"op": "failed", "paths": failed})
+
+    def close(self, finished: bool = True) -> None:
+        """Close the journal; a finished run without failures removes it."""
+        if finished:
+            self._append({"op": "end"})
+        with self._lock:
+            if self._file.closed:
+                return
+            self._sync()
+            self._file.close()
+            if finished and not self._failed:
+                os.remove(self.path)
+                logger.debug(f"Removed the journal of finished run {self.run_id}.")
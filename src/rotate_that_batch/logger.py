@@ -1,19 +1,79 @@
+import json
 import logging
-import sys
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import List, Optional
 
 from rich.logging import RichHandler
 
+LEVELS = ("debug", "info", "warning", "error")
+
 
 def setup_logger():
-    logging.basicConfig(
-        level="NOTSET",
-        format="%(message)s",
-        datefmt="[%X]",
-        handlers=[RichHandler(rich_tracebacks=True)],
-    )
-
-    logger = logging.getLogger("rich")
+    """The package logger, silent until ``configure_logging`` gives it sinks.
+
+    Like any library logger it only has a ``NullHandler``, so importing the
+    package leaves the host program's logging and terminal alone.
+    """
+    logger = logging.getLogger("rotate_that_batch")
+    logger.addHandler(logging.NullHandler())
     return logger
 
 
 logger = setup_logger()
+
+_listener: Optional[QueueListener] = None
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Format each record as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": record.created,
+            "level": record.levelname.lower(),
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def configure_logging(
+    level: str = "info", json_file: Optional[str] = None, queued: bool = True
+) -> None:
+    """Set the verbosity and sinks of ``logger``.
+
+    With ``queued`` the calling threads only put records on a queue; a
+    listener thread formats them and renders them to the terminal and the
+    optional JSON-lines file, so slow terminals never stall the workers.
+    """
+    global _listener
+    shutdown_logging()
+    handlers: List[logging.Handler] = [RichHandler(rich_tracebacks=not queued)]
+    if json_file:
+        sink = logging.FileHandler(json_file)
+        sink.setFormatter(JsonLinesFormatter())
+        handlers.append(sink)
+    if queued:
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        _listener = QueueListener(records, *handlers)
+        _listener.start()
+        handlers = [QueueHandler(records)]
+    logger.handlers = handlers
+    logger.setLevel(level.upper())
+    logger.propagate = False
+
+
+def shutdown_logging() -> None:
+    """Drain the queue listener, if any, and close the JSON-lines sink."""
+    global _listener
+    handlers = list(logger.handlers)
+    if _listener is not None:
+        _listener.stop()
+        handlers = list(_listener.handlers)
+        _listener = None
+    for handler in handlers:
+        if isinstance(handler, logging.FileHandler):
+            handler.close()
@@ -1,7 +1,14 @@
+import asyncio
+import os
+from typing import Optional
+
 from textual.app import App, ComposeResult
 from textual.containers import Container, Horizontal
-from textual.widget import Widget
-from textual.widgets import Button, Input, Select, Static
+from textual.widgets import Button, DataTable, Input, ProgressBar, Select, Static
+
+from . import aio, pool, preview, video_utils
+
+SHEETS_DIR = os.path.join(os.path.dirname(preview.CACHE_DIR), "sheets")
 
 
 class RotateThatBatchApp(App):
@@ -19,21 +26,89 @@ class RotateThatBatchApp(App):
             Static(id="status_text"),
             Button("Preview", id="preview"),
             Button("Rotate", id="rotate"),
+            Button("Cancel", id="cancel"),
+            ProgressBar(id="progress"),
+            Static(id="throughput"),
+            DataTable(id="failures"),
         )
 
+    def on_mount(self) -> None:
+        self.query_one("#failures", DataTable).add_columns("File", "Engine", "Error")
+
     def on_button_pressed(self, event: Button.Pressed) -> None:
         if event.button.id == "preview":
             self.preview_rotation()
         elif event.button.id == "rotate":
             self.rotate_videos()
+        elif event.button.id == "cancel":
+            self.cancel_rotation()
+
+    def _settings(self):
+        directory = self.query_one("#input", Input).value or "."
+        output = self.query_one("#output", Input).value or None
+        angle = self.query_one("#angle", Select).value or 90
+        return directory, output, int(angle)
+
+    def _status(self, text: str) -> None:
+        self.query_one("#status_text", Static).update(text)
 
     def preview_rotation(self) -> None:
-        status_text = self.query_one("#status_text", Static)
-        status_text.update("Previewing rotation...")
+        self._status("Previewing rotation...")
+        directory, _, angle = self._settings()
+        self.run_worker(self._preview(directory, angle), group="work", exclusive=True)
 
     def rotate_videos(self) -> None:
-        status_text = self.query_one("#status_text", Static)
-        status_text.update("Rotating videos...")
+        self._status("Rotating videos...")
+        directory, output, angle = self._settings()
+        self.run_worker(
+            self._rotate(directory, output, angle), group="work", exclusive=True
+        )
+
+    def cancel_rotation(self) -> None:
+        if self.workers.cancel_group(self, "work"):
+            self._status("Cancelled.")
+
+    async def _preview(self, directory: str, angle: int) -> None:
+        files = await asyncio.to_thread(video_utils.get_video_files, directory)
+        if not files:
+            self._status(f"No video files found in {directory}.")
+            return
+        sheets = await asyncio.to_thread(
+            preview.build_contact_sheets,
+            files,
+            angle,
+            SHEETS_DIR,
+            pool.default_jobs(),
+        )
+        self._status(f"Preview: {len(sheets)} contact sheets in {SHEETS_DIR}.")
+
+    async def _rotate(self, directory: str, output: Optional[str], angle: int) -> None:
+        progress = self.query_one("#progress", ProgressBar)
+        throughput = self.query_one("#throughput", Static)
+        failures = self.query_one("#failures", DataTable)
+        failures.clear()
+
+        files = await asyncio.to_thread(video_utils.get_video_files, directory)
+        if not files:
+            self._status(f"No video files found in {directory}.")
+            return
+        progress.update(total=len(files), progress=0)
+        engine = aio.AsyncEngine(pool.default_jobs(), "absolute", output, directory)
+        event = None
+        async for event in engine.rotate(files, angle):
+            progress.advance(1)
+            eta = f"{event.eta:.0f}s" if event.eta is not None else "-"
+            throughput.update(
+                f"{event.completed}/{event.total} files, "
+                f"{event.rate:.1f} files/s, ETA {eta}"
+            )
+            if not event.result.ok:
+                result = event.result
+                failures.add_row(result.path, result.engine, result.error)
+        failed = event.failed if event else 0
+        self._status(
+            f"Rotation complete! {len(files) - failed} videos, {failed} failed."
+        )
 
 
 if __name__ == "__main__":
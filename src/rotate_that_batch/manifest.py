@@ -0,0 +1,135 @@
+"""Per-file rotation manifests: CSV or JSON lines of path and angle.
+
+A classifier that picks an angle for every file can hand the whole list to
+one run instead of starting the CLI once per file. Manifests are streamed,
+so one may be piped in while it is still being written. Entries are then
+regrouped by angle and engine, so every chunk is still one batched write.
+"""
+
+import contextlib
+import csv
+import itertools
+import json
+import sys
+from typing import IO, ContextManager, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from . import engines
+from .logger import logger
+
+ANGLES = (90, 180, 270)
+
+
+class ManifestPath(str):
+    """A path from a manifest, carrying the angle it is rotated by."""
+
+    angle: int
+
+    def __new__(cls, path: str, angle: int) -> "ManifestPath":
+        entry = super().__new__(cls, path)
+        entry.angle = angle
+        return entry
+
+
+class Manifest:
+    """Stream the entries of a manifest file, or of stdin for ``-``.
+
+    CSV rows hold a path and an angle, optionally under a ``path,angle``
+    header; JSON lines hold ``{"path": ..., "angle": ...}`` objects. The
+    format is told from the first non-blank line. Invalid lines are logged,
+    counted in ``invalid`` and skipped.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.invalid = 0
+
+    def __iter__(self) -> Iterator[ManifestPath]:
+        opened: ContextManager[IO[str]] = (
+            contextlib.nullcontext(sys.stdin)
+            if self.path == "-"
+            else open(self.path, newline="")
+        )
+        with opened as stream:
+            lines = iter(stream)
+            blank = 0
+            for first in lines:
+                if first.strip():
+                    break
+                blank += 1
+            else:
+                return
+            rows = itertools.chain([first], lines)
+            if first.lstrip().startswith("{"):
+                yield from self._json(rows, blank)
+            else:
+                yield from self._csv(rows, blank)
+
+    def _entry(self, line: int, path, angle) -> Optional[ManifestPath]:
+        try:
+            angle = int(str(angle).strip())
+        except ValueError:
+            angle = None
+        if not isinstance(path, str) or not path.strip():
+            error = "missing path"
+        elif angle not in ANGLES:
+            error = f"angle must be one of {', '.join(map(str, ANGLES))}"
+        else:
+            return ManifestPath(path.strip(), angle)
+        logger.error(f"Skipping line {line} of manifest {self.path}: {error}")
+        self.invalid += 1
+        return None
+
+    def _json(self, lines: Iterable[str], offset: int) -> Iterator[ManifestPath]:
+        for number, line in enumerate(lines, offset + 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                path, angle = record.get("path"), record.get("angle")
+            except (ValueError, AttributeError):
+                path = angle = None
+            entry = self._entry(number, path, angle)
+            if entry is not None:
+                yield entry
+
+    def _csv(self, lines: Iterable[str], offset: int) -> Iterator[ManifestPath]:
+        reader = csv.reader(lines)
+        columns = (0, 1)
+        for row in reader:
+            if not row or not any(cell.strip() for cell in row):
+                continue
+            if reader.line_num == 1:
+                header = [cell.strip().lower() for cell in row]
+                if "path" in header and "angle" in header:
+                    columns = (header.index("path"), header.index("angle"))
+                    continue
+            cells = [row[i] if i < len(row) else None for i in columns]
+            entry = self._entry(reader.line_num + offset, *cells)
+            if entry is not None:
+                yield entry
+
+
+def group_chunks(
+    batches: Iterable[List[str]], max_files: int, engine: str = "auto"
+) -> Iterator[Tuple[List[str], int]]:
+    """Regroup streamed manifest paths into chunks of one angle and engine.
+
+    At most one partial chunk per angle and engine is held back. Partial
+    chunks are flushed whenever the input runs dry (a batch shorter than
+    ``max_files``), so a slowly written manifest is not held back either.
+    """
+    groups: Dict[Tuple[int, str], List[str]] = {}
+    for batch in batches:
+        for path in batch:
+            angle = getattr(path, "angle")
+            key = (angle, engines.route_name(path, engine))
+            group = groups.setdefault(key, [])
+            group.append(path)
+            if len(group) >= max_files:
+                yield groups.pop(key), angle
+        if len(batch) < max_files:
+            for (angle, _), files in groups.items():
+                yield files, angle
+            groups.clear()
+    for (angle, _), files in groups.items():
+        yield files, angle
@@ -0,0 +1,85 @@
+import json
+import math
+from typing import IO, Dict, Iterable, List, Optional, Sequence
+
+from .result import RotationResult
+
+# Per-file phase timings, in seconds, as stored in RotationResult.metrics.
+PHASES = ("scan_s", "plan_s", "write_s", "verify_s")
+BYTE_COUNTERS = ("bytes_read", "bytes_written")
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(ordered: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted sequence."""
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class MetricsWriter:
+    """Write one JSON line per rotated file and a latency summary at the end.
+
+    Each line holds the file's engine, outcome, phase timings and byte
+    counts. The closing ``summary`` line aggregates the totals and the
+    p50/p95/p99 latency of every phase.
+    """
+
+    def __init__(self, stream: IO[str]):
+        self.stream = stream
+        self.files = 0
+        self.failed = 0
+        self.latencies: Dict[str, List[float]] = {phase: [] for phase in PHASES}
+        self.bytes = {counter: 0 for counter in BYTE_COUNTERS}
+        self.engines: Dict[str, int] = {}
+
+    def write(
+        self, results: Iterable[RotationResult], scan_times: Optional[Dict] = None
+    ) -> None:
+        for result in results:
+            if scan_times is not None and result.path in scan_times:
+                result.metrics["scan_s"] = scan_times.pop(result.path)
+            self.files += 1
+            self.failed += not result.ok
+            self.engines[result.engine] = self.engines.get(result.engine, 0) + 1
+            entry = {
+                "path": result.path,
+                "engine": result.engine,
+                "ok": result.ok,
+                "skipped": result.skipped,
+            }
+            if result.error:
+                entry["error"] = result.error
+            if result.fingerprint:
+                entry["fingerprint"] = result.fingerprint
+            for key, value in result.metrics.items():
+                entry[key] = value
+                if key in self.latencies:
+                    self.latencies[key].append(value)
+                elif key in self.bytes:
+                    self.bytes[key] += int(value)
+            self.stream.write(json.dumps(entry) + "\n")
+
+    def summary(self) -> Dict:
+        latencies = {}
+        for phase, values in self.latencies.items():
+            if not values:
+                continue
+            ordered = sorted(values)
+            latencies[phase] = {
+                f"p{pct}": percentile(ordered, pct) for pct in PERCENTILES
+            }
+            latencies[phase]["total"] = sum(ordered)
+        return {
+            "files": self.files,
+            "failed": self.failed,
+            "engines": self.engines,
+            **self.bytes,
+            "latency": latencies,
+        }
+
+    def close(self) -> Dict:
+        summary = self.summary()
+        self.stream.write(json.dumps({"summary": summary}) + "\n")
+        return summary
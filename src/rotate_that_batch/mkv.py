@@ -0,0 +1,299 @@
+"""Minimal Matroska (EBML) reader for rotation read-back and verification.
+
+Only the elements needed to describe the tracks and find their first frames
+are parsed: the track list, each video track's ``ProjectionPoseRoll`` and
+the blocks at the start of the first clusters. The file is memory-mapped,
+so skipping over clusters only touches the pages holding element headers.
+"""
+
+import mmap
+import struct
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+EBML = 0x1A45DFA3
+DOC_TYPE = 0x4282
+SEGMENT = 0x18538067
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+TRACK_TYPE = 0x83
+CODEC_ID = 0x86
+CONTENT_ENCODINGS = 0x6D80
+VIDEO = 0xE0
+PIXEL_WIDTH = 0xB0
+PIXEL_HEIGHT = 0xBA
+PROJECTION = 0x7670
+PROJECTION_POSE_ROLL = 0x7675
+AUDIO = 0xE1
+SAMPLING_FREQUENCY = 0xB5
+CHANNELS = 0x9F
+CLUSTER = 0x1F43B675
+SIMPLE_BLOCK = 0xA3
+BLOCK_GROUP = 0xA0
+BLOCK = 0xA1
+
+# Children of a Segment, which end a Cluster of unknown size.
+_SEGMENT_CHILDREN = {
+    0x114D9B74,  # SeekHead
+    0x1549A966,  # Info
+    TRACKS,
+    CLUSTER,
+    0x1C53BB6B,  # Cues
+    0x1941A469,  # Attachments
+    0x1043A770,  # Chapters
+    0x1254C367,  # Tags
+}
+_DOC_TYPES = (b"matroska", b"webm")
+_VIDEO_TRACK = 1
+# Clusters searched for the first frames of every video track.
+MAX_CLUSTERS = 64
+
+
+class UnsupportedContainer(Exception):
+    """Raised when a file is not a Matroska file this reader understands."""
+
+
+@dataclass
+class Element:
+    id: int
+    offset: int
+    header_size: int
+    size: Optional[int]  # None: unknown size
+    end: int
+
+    @property
+    def payload(self) -> int:
+        return self.offset + self.header_size
+
+
+@dataclass
+class Track:
+    number: int
+    type: int
+    codec: str
+    # Codec parameters that a stream copy keeps as they are.
+    params: Tuple = ()
+    # Frames are stored compressed (e.g. header stripping): a remux may
+    # store them differently.
+    encoded: bool = False
+    roll: Optional[float] = None
+    frames: List[Tuple[int, int]] = field(default_factory=list)
+
+
+def _vint(buf, offset: int, end: int, marker: bool) -> Tuple[int, int]:
+    if offset >= end:
+        raise UnsupportedContainer("Truncated element header")
+    first = buf[offset]
+    length = 1
+    while length <= 8 and not first & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8 or offset + length > end:
+        raise UnsupportedContainer("Invalid variable-size integer")
+    value = first if marker else first & (0xFF >> length)
+    for byte in buf[offset + 1 : offset + length]:
+        value = value << 8 | byte
+    return value, length
+
+
+def _header(buf, offset: int, end: int) -> Tuple[int, Optional[int], int]:
+    element_id, id_length = _vint(buf, offset, end, marker=True)
+    size, size_length = _vint(buf, offset + id_length, end, marker=False)
+    if size == (1 << (7 * size_length)) - 1:
+        return element_id, None, id_length + size_length  # all ones: unknown
+    return element_id, size, id_length + size_length
+
+
+def _cluster_end(buf, offset: int, end: int) -> int:
+    # A Cluster of unknown size ends where the next Segment child starts.
+    while offset < end:
+        element_id, size, header_size = _header(buf, offset, end)
+        if element_id in _SEGMENT_CHILDREN:
+            return offset
+        if size is None:
+            raise UnsupportedContainer(f"Unknown size for element {element_id:#x}")
+        offset += header_size + size
+    return end
+
+
+def iter_elements(buf, start: int, end: int) -> Iterator[Element]:
+    """Yield the elements stored back to back in ``buf[start:end]``.
+
+    Live muxers leave the size of Segments and Clusters unknown: a Segment
+    then runs to the end of its parent, a Cluster up to the next element
+    of the Segment.
+    """
+    offset = start
+    while offset < end:
+        element_id, size, header_size = _header(buf, offset, end)
+        if size is not None:
+            element_end = offset + header_size + size
+            if element_end > end:
+                raise UnsupportedContainer(f"Invalid size for element {element_id:#x}")
+        elif element_id == SEGMENT:
+            element_end = end
+        elif element_id == CLUSTER:
+            element_end = _cluster_end(buf, offset + header_size, end)
+        else:
+            raise UnsupportedContainer(f"Unknown size for element {element_id:#x}")
+        yield Element(element_id, offset, header_size, size, element_end)
+        offset = element_end
+
+
+def _uint(buf, element: Element) -> int:
+    return int.from_bytes(buf[element.payload : element.end], "big")
+
+
+def _float(buf, element: Element) -> float:
+    data = bytes(buf[element.payload : element.end])
+    if len(data) == 4:
+        return struct.unpack(">f", data)[0]
+    if len(data) == 8:
+        return struct.unpack(">d", data)[0]
+    return 0.0
+
+
+def _children(buf, parent: Element) -> Dict[int, Element]:
+    return {child.id: child for child in iter_elements(buf, parent.payload, parent.end)}
+
+
+def find_segment(buf) -> Element:
+    """Check the EBML header and return the first Segment."""
+    elements = iter_elements(buf, 0, len(buf))
+    header = next(elements, None)
+    if header is None or header.id != EBML:
+        raise UnsupportedContainer("Not an EBML file")
+    doc_type = _children(buf, header).get(DOC_TYPE)
+    if (
+        doc_type is None
+        or bytes(buf[doc_type.payload : doc_type.end]) not in _DOC_TYPES
+    ):
+        raise UnsupportedContainer("Not a Matroska file")
+    for element in elements:
+        if element.id == SEGMENT:
+            return element
+    raise UnsupportedContainer("No Segment found")
+
+
+def _track(buf, entry: Element) -> Optional[Track]:
+    fields = _children(buf, entry)
+    if TRACK_NUMBER not in fields or TRACK_TYPE not in fields:
+        return None
+    codec = fields.get(CODEC_ID)
+    track = Track(
+        _uint(buf, fields[TRACK_NUMBER]),
+        _uint(buf, fields[TRACK_TYPE]),
+        bytes(buf[codec.payload : codec.end]).decode("ascii", "replace")
+        if codec
+        else "",
+        encoded=CONTENT_ENCODINGS in fields,
+    )
+    if VIDEO in fields:
+        video = _children(buf, fields[VIDEO])
+        track.params = tuple(
+            _uint(buf, video[key]) if key in video else None
+            for key in (PIXEL_WIDTH, PIXEL_HEIGHT)
+        )
+        if PROJECTION in video:
+            roll = _children(buf, video[PROJECTION]).get(PROJECTION_POSE_ROLL)
+            track.roll = _float(buf, roll) if roll is not None else None
+    elif AUDIO in fields:
+        audio = _children(buf, fields[AUDIO])
+        track.params = (
+            _float(buf, audio[SAMPLING_FREQUENCY])
+            if SAMPLING_FREQUENCY in audio
+            else None,
+            _uint(buf, audio[CHANNELS]) if CHANNELS in audio else None,
+        )
+    return track
+
+
+def _blocks(buf, cluster: Element) -> Iterator[Element]:
+    for child in iter_elements(buf, cluster.payload, cluster.end):
+        if child.id == SIMPLE_BLOCK:
+            yield child
+        elif child.id == BLOCK_GROUP:
+            for block in iter_elements(buf, child.payload, child.end):
+                if block.id == BLOCK:
+                    yield block
+
+
+def read_tracks(buf, frames: int = 0) -> List[Track]:
+    """Describe every track, with the ranges of the first ``frames`` video frames.
+
+    Laced blocks and tracks with content encodings have no frames listed.
+    """
+    segment = find_segment(buf)
+    tracks: Dict[int, Track] = {}
+    clusters = 0
+    for element in iter_elements(buf, segment.payload, segment.end):
+        if element.id == TRACKS:
+            for entry in iter_elements(buf, element.payload, element.end):
+                track = _track(buf, entry) if entry.id == TRACK_ENTRY else None
+                if track is not None:
+                    tracks[track.number] = track
+        elif element.id == CLUSTER and tracks:
+            wanted = [
+                t
+                for t in tracks.values()
+                if t.type == _VIDEO_TRACK and not t.encoded and len(t.frames) < frames
+            ]
+            if not wanted or clusters >= MAX_CLUSTERS:
+                break
+            clusters += 1
+            for block in _blocks(buf, element):
+                number, length = _vint(buf, block.payload, block.end, marker=False)
+                header = length + 3  # track number, timecode, flags
+                track = tracks.get(number)
+                if track not in wanted or header > block.end - block.payload:
+                    continue
+                if (
+                    buf[block.payload + header - 1] & 0x06
+                    or len(track.frames) >= frames
+                ):
+                    continue  # laced, or enough of this track
+                track.frames.append((block.payload + header, block.end))
+    if not tracks:
+        raise UnsupportedContainer("No tracks found")
+    return list(tracks.values())
+
+
+def _open_map(path: str):
+    f = open(path, "rb")
+    try:
+        return f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError as e:  # empty file
+        f.close()
+        raise UnsupportedContainer(str(e))
+    except BaseException:
+        f.close()
+        raise
+
+
+def read_rotation(path: str) -> int:
+    """Clockwise display rotation of the first video track."""
+    f, buf = _open_map(path)
+    with f, buf:
+        for track in read_tracks(buf):
+            if track.type == _VIDEO_TRACK:
+                # ProjectionPoseRoll turns counter-clockwise, as in ffmpeg.
+                return round(-(track.roll or 0.0)) % 360
+    raise UnsupportedContainer("No video track found")
+
+
+def stream_signature(path: str, frames: int, frame_bytes: int) -> List[bytes]:
+    """Byte strings that a stream copy keeps: codecs and the first video frames.
+
+    A remux rewrites every cluster and header, so the file's bytes cannot
+    be compared. What it must keep is the tracks' codecs and parameters
+    and the frame data, of which the start of the first ``frames`` frames
+    of every video track is taken, at most ``frame_bytes`` each.
+    """
+    f, buf = _open_map(path)
+    with f, buf:
+        signature = []
+        for track in read_tracks(buf, frames):
+            signature.append(repr((track.type, track.codec, track.params)).encode())
+            for start, end in track.frames:
+                signature.append(bytes(buf[start : min(end, start + frame_bytes)]))
+        return signature
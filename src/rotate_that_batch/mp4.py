@@ -0,0 +1,194 @@
+"""Minimal ISO base media (MP4/MOV) box walker for in-place rotation edits.
+
+Only the handful of boxes needed to find a video track's ``tkhd`` matrix are
+parsed. The file is memory-mapped, so walking past a multi-gigabyte ``mdat``
+costs nothing and only the pages holding box headers are ever read.
+"""
+
+import math
+import mmap
+import struct
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+
+NATIVE_EXTENSIONS = (".mp4", ".mov", ".m4v")
+
+MATRIX_SIZE = 36
+_TOP_LEVEL = {b"ftyp", b"moov", b"mdat", b"wide", b"free", b"skip", b"pnot"}
+_FIXED_16_16 = 1 << 16
+_FIXED_2_30 = 1 << 30
+
+
+class UnsupportedContainer(Exception):
+    """Raised when a file is not an MP4/MOV the native engine can patch."""
+
+
+@dataclass
+class Box:
+    type: bytes
+    offset: int
+    header_size: int
+    size: int
+
+    @property
+    def payload(self) -> int:
+        return self.offset + self.header_size
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+
+@dataclass
+class VideoTrack:
+    tkhd: Box
+    matrix_offset: int
+
+
+def iter_boxes(buf, start: int, end: int) -> Iterator[Box]:
+    """Yield the boxes stored back to back in ``buf[start:end]``."""
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", buf, offset)
+        header_size = 8
+        if size == 1:
+            if offset + 16 > end:
+                raise UnsupportedContainer("Truncated 64-bit box header")
+            (size,) = struct.unpack_from(">Q", buf, offset + 8)
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise UnsupportedContainer(f"Invalid size for box {box_type!r}")
+        yield Box(box_type, offset, header_size, size)
+        offset += size
+
+
+def _child(buf, parent: Box, box_type: bytes) -> Optional[Box]:
+    for box in iter_boxes(buf, parent.payload, parent.end):
+        if box.type == box_type:
+            return box
+    return None
+
+
+def _handler_type(buf, trak: Box) -> Optional[bytes]:
+    mdia = _child(buf, trak, b"mdia")
+    hdlr = _child(buf, mdia, b"hdlr") if mdia else None
+    if hdlr is None or hdlr.size < hdlr.header_size + 12:
+        return None
+    # version/flags (4) + pre_defined (4) + handler_type (4)
+    return bytes(buf[hdlr.payload + 8 : hdlr.payload + 12])
+
+
+def _matrix_offset(buf, tkhd: Box) -> int:
+    version = buf[tkhd.payload]
+    # version/flags, then times + track_ID + reserved + duration (20 or 32
+    # bytes), then reserved (8), layer, alternate_group, volume, reserved (8).
+    offset = tkhd.payload + 4 + (32 if version == 1 else 20) + 16
+    if offset + MATRIX_SIZE > tkhd.end:
+        raise UnsupportedContainer("Truncated tkhd box")
+    return offset
+
+
+def find_moov(buf) -> Box:
+    """Locate the top-level ``moov`` box, wherever it sits in the file."""
+    size = len(buf)
+    if size < 8 or bytes(buf[4:8]) not in _TOP_LEVEL:
+        raise UnsupportedContainer("Not an ISO base media file")
+    for box in iter_boxes(buf, 0, size):
+        if box.type == b"moov":
+            return box
+    raise UnsupportedContainer("No moov box found")
+
+
+def media_data(buf) -> Optional[Box]:
+    """The first top-level ``mdat`` box, if any."""
+    find_moov(buf)  # validates the file type
+    for box in iter_boxes(buf, 0, len(buf)):
+        if box.type == b"mdat":
+            return box
+    return None
+
+
+def video_tracks(buf) -> List[VideoTrack]:
+    """Return every video track's ``tkhd`` and the offset of its matrix."""
+    moov = find_moov(buf)
+    tracks = []
+    for trak in iter_boxes(buf, moov.payload, moov.end):
+        if trak.type != b"trak" or _handler_type(buf, trak) != b"vide":
+            continue
+        tkhd = _child(buf, trak, b"tkhd")
+        if tkhd is not None:
+            tracks.append(VideoTrack(tkhd, _matrix_offset(buf, tkhd)))
+    if not tracks:
+        raise UnsupportedContainer("No video track found")
+    return tracks
+
+
+def matrix_rotation(matrix: bytes) -> int:
+    """Clockwise rotation in degrees encoded by a ``tkhd`` matrix."""
+    a, b = struct.unpack_from(">2i", matrix, 0)
+    return round(math.degrees(math.atan2(b, a))) % 360
+
+
+def rotation_matrix(angle: int, current: bytes) -> bytes:
+    """Build a matrix rotating by ``angle`` while keeping the current scale."""
+    a, b = struct.unpack_from(">2i", current, 0)
+    scale = math.hypot(a, b) or _FIXED_16_16
+    radians = math.radians(angle)
+    cos = int(round(math.cos(radians) * scale))
+    sin = int(round(math.sin(radians) * scale))
+    return struct.pack(">9i", cos, sin, 0, -sin, cos, 0, 0, 0, _FIXED_2_30)
+
+
+def _open_map(path: str, write: bool):
+    f = open(path, "r+b" if write else "rb")
+    try:
+        access = mmap.ACCESS_WRITE if write else mmap.ACCESS_READ
+        return f, mmap.mmap(f.fileno(), 0, access=access)
+    except ValueError as e:  # empty file
+        f.close()
+        raise UnsupportedContainer(str(e))
+    except BaseException:
+        f.close()
+        raise
+
+
+def read_rotation(path: str) -> int:
+    """Read the rotation of the first video track."""
+    return read_rotations(path)[0]
+
+
+def read_rotations(path: str) -> List[int]:
+    """Read the rotation of every video track."""
+    f, buf = _open_map(path, write=False)
+    with f, buf:
+        return [
+            matrix_rotation(buf[t.matrix_offset : t.matrix_offset + MATRIX_SIZE])
+            for t in video_tracks(buf)
+        ]
+
+
+def media_range(path: str) -> Optional[Tuple[int, int]]:
+    """Start and end offsets of the ``mdat`` payload, or None if there is none."""
+    f, buf = _open_map(path, write=False)
+    with f, buf:
+        mdat = media_data(buf)
+        return (mdat.payload, mdat.end) if mdat is not None else None
+
+
+def set_rotation(path: str, angle: int) -> int:
+    """Patch every video track's matrix in place; return the bytes written."""
+    f, buf = _open_map(path, write=True)
+    with f, buf:
+        written = 0
+        for track in video_tracks(buf):
+            start = track.matrix_offset
+            current = buf[start : start + MATRIX_SIZE]
+            matrix = rotation_matrix(angle, current)
+            if matrix != current:
+                buf[start : start + MATRIX_SIZE] = matrix
+                page = start - start % mmap.ALLOCATIONGRANULARITY
+                buf.flush(page, start - page + MATRIX_SIZE)
+                written += MATRIX_SIZE
+        return written
@@ -0,0 +1,108 @@
+import json
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from typing import IO, Dict, Iterable, List, Optional
+
+MODES = ("absolute", "relative")
+PIXELS_ABSOLUTE_SKIP = (
+    "no rotation metadata to set (AVI/FLV/WMV); re-encode with --mode relative"
+)
+
+
+@dataclass
+class PlanEntry:
+    """Current and target rotation of one file.
+
+    ``error`` is set when no target can be planned, e.g. a relative rotation
+    of a file whose current rotation could not be read. ``skip`` is why a
+    file is deliberately left alone.
+    """
+
+    path: str
+    current: Optional[int]
+    target: Optional[int]
+    error: Optional[str] = None
+    skip: Optional[str] = None
+
+    @property
+    def needed(self) -> bool:
+        return self.error is None and self.skip is None and self.current != self.target
+
+
+def target_angle(current: Optional[int], angle: int, mode: str) -> Optional[int]:
+    """Rotation a file should end up with, or None if it cannot be known."""
+    if mode == "absolute":
+        return angle % 360
+    if mode == "relative":
+        return None if current is None else (current + angle) % 360
+    raise ValueError(f"Unknown rotation mode: {mode}")
+
+
+def plan_entry(
+    path: str,
+    current: Optional[int],
+    angle: int,
+    mode: str,
+    rewrites_pixels: bool = False,
+) -> PlanEntry:
+    if rewrites_pixels and mode == "absolute":
+        # Re-encoded files keep no trace of earlier rotations: setting an
+        # absolute angle would rotate their pixels again on every run.
+        return PlanEntry(path, current, None, skip=PIXELS_ABSOLUTE_SKIP)
+    target = target_angle(current, angle, mode)
+    if target is None:
+        return PlanEntry(path, current, None, "Current rotation is unknown")
+    return PlanEntry(path, current, target)
+
+
+def plan_batch(engine, files: List[str], angle: int, mode: str) -> List[PlanEntry]:
+    """Read the current rotation of ``files`` in one go and plan each target."""
+    current = engine.read_rotations(files)
+    return [
+        plan_entry(path, current.get(path), angle, mode, engine.rewrites_pixels(path))
+        for path in files
+    ]
+
+
+def group_by_target(entries: Iterable[PlanEntry]) -> Dict[int, List[str]]:
+    """Group the files that need a write by their target rotation."""
+    groups: Dict[int, List[str]] = defaultdict(list)
+    for entry in entries:
+        if entry.needed and entry.target is not None:
+            groups[entry.target].append(entry.path)
+    return groups
+
+
+class PlanWriter:
+    """Stream a plan out as one JSON document without holding it in memory."""
+
+    def __init__(self, stream: IO[str], angle: Optional[int], mode: str):
+        self.stream = stream
+        self.files = 0
+        self.rotate = 0
+        self.unknown = 0
+        self.stream.write(
+            f'{{"angle": {json.dumps(angle)}, "mode": {json.dumps(mode)}, "entries": ['
+        )
+
+    def write(self, entries: Iterable[PlanEntry]) -> None:
+        for entry in entries:
+            record = asdict(entry)
+            if entry.error:
+                record["action"] = "unknown"
+            else:
+                record["action"] = "rotate" if entry.needed else "skip"
+            self.stream.write(("," if self.files else "") + "\n  " + json.dumps(record))
+            self.files += 1
+            self.rotate += entry.needed
+            self.unknown += entry.error is not None
+
+    def close(self) -> None:
+        summary = {
+            "files": self.files,
+            "rotate": self.rotate,
+            "skip": self.files - self.rotate - self.unknown,
+            "unknown": self.unknown,
+        }
+        self.stream.write(f'\n], "summary": {json.dumps(summary)}}}\n')
+        self.stream.flush()
@@ -0,0 +1,310 @@
+import math
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from . import devices, engines, plan, transcode, verification, video_utils
+from .engines import RotationResult
+from .logger import logger
+
+# Chunk size when the total is unknown (streaming scans): small enough that
+# work spreads over all workers even for small directories.
+STREAM_CHUNK_FILES = 32
+
+
+def default_jobs() -> int:
+    """Default worker count: one per CPU."""
+    return os.cpu_count() or 1
+
+
+def chunk_size_for(total: Optional[int], jobs: int) -> int:
+    """Pick a chunk size that keeps every worker busy without tiny batches."""
+    if not total:
+        return engines.DEFAULT_CHUNK_FILES
+    return max(1, min(engines.DEFAULT_CHUNK_FILES, math.ceil(total / (jobs * 4))))
+
+
+class WorkerPool:
+    """Thread pool where every worker owns one long-lived rotation engine.
+
+    Engines wrap external processes (ExifTool, ffmpeg), so threads are enough
+    to keep all CPUs busy; the GIL is only held while parsing their output.
+    """
+
+    def __init__(
+        self,
+        jobs: int,
+        engine_factory: Optional[Callable] = None,
+        output_dir: Optional[str] = None,
+        base_dir: Optional[str] = None,
+        mode: Optional[str] = None,
+        budget: Optional[transcode.CoreBudget] = None,
+        journal=None,
+        on_done: Optional[Callable[[List[RotationResult]], None]] = None,
+        verify: bool = False,
+    ):
+        self.jobs = max(1, jobs)
+        self.mode = mode
+        self.verify = verify
+        self.journal = journal
+        self.on_done = on_done
+        # Every worker may be re-encoding at once: size core shares for that.
+        self.budget = budget or transcode.core_budget()
+        self.budget.expect(self.jobs)
+        self.output_dir = output_dir
+        self.base_dir = base_dir
+        self.engine_factory = engine_factory or (lambda: engines.create_engine())
+        self._local = threading.local()
+        self._engines: List = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.jobs, thread_name_prefix="rotate-worker"
+        )
+
+    def __enter__(self) -> "WorkerPool":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def _engine(self):
+        engine = getattr(self._local, "engine", None)
+        if engine is None:
+            engine = self.engine_factory()
+            self._local.engine = engine
+            with self._lock:
+                self._engines.append(engine)
+        return engine
+
+    def _run_chunk(self, chunk: List[str], angle: int) -> List[RotationResult]:
+        engine = self._engine()
+        if self.mode is None:
+            return self._rotate(engine, chunk, angle)
+
+        # Plan first: read the current rotations of the whole chunk, drop the
+        # files already at their target and write the rest grouped by target.
+        name = getattr(engine, "name", "unknown")
+        start = time.perf_counter()
+        try:
+            entries = plan.plan_batch(engine, chunk, angle, self.mode)
+        except Exception as e:
+            logger.error(f"Worker failed while planning {len(chunk)} files: {str(e)}")
+            return [RotationResult(path, angle, name, str(e)) for path in chunk]
+        plan_s = (time.perf_counter() - start) / len(chunk)
+        if self.journal is not None:
+            self.journal.intend(
+                (entry.path, entry.target, engine.rewrites_pixels(entry.path))
+                for entry in entries
+                if entry.needed
+            )
+        before = {}
+        if self.verify:
+            before = verification.fingerprints(e.path for e in entries if e.needed)
+        results = []
+        for entry in entries:
+            if entry.error:
+                logger.error(f"Cannot plan rotation of {entry.path}: {entry.error}")
+                results.append(RotationResult(entry.path, angle, name, entry.error))
+            elif entry.skip:
+                results.append(self._skip(entry.path, angle, name, entry.skip))
+            elif not entry.needed and entry.target is not None:
+                results.append(self._skip(entry.path, entry.target, name))
+        for target, files in plan.group_by_target(entries).items():
+            written = self._rotate(engine, files, target)
+            if self.verify:
+                verification.verify_results(engine, written, before)
+            results.extend(written)
+        for result in results:
+            result.metrics["plan_s"] = plan_s
+        return results
+
+    def _run_and_report(self, chunk: List[str], angle: int) -> List[RotationResult]:
+        # Reported from the worker thread, before the consumer sees them.
+        results = self._run_chunk(chunk, angle)
+        if self.on_done is not None:
+            self.on_done(results)
+        return results
+
+    def _plan_chunk(self, chunk: List[str], angle: int) -> List[plan.PlanEntry]:
+        return plan.plan_batch(self._engine(), chunk, angle, self.mode or "absolute")
+
+    def _skip(
+        self, path: str, angle: int, name: str, reason: Optional[str] = None
+    ) -> RotationResult:
+        logger.debug(
+            f"Skipping {path}: {reason or f'already rotated to {angle} degrees'}."
+        )
+        result = RotationResult(path, angle, name, skipped=True, skip_reason=reason)
+        if self.output_dir:
+            # Output directories still receive every file, rotated or not.
+            try:
+                result.output = video_utils.prepare_output(
+                    path, self.output_dir, self.base_dir
+                )
+            except OSError as e:
+                result.error = str(e)
+        return result
+
+    def _rotate(self, engine, files: List[str], angle: int) -> List[RotationResult]:
+        start = time.perf_counter()
+        if self.output_dir:
+            results = self._rotate_to_output(engine, files, angle)
+        else:
+            try:
+                results = engine.rotate_batch(files, angle)
+            except Exception as e:
+                name = getattr(engine, "name", "unknown")
+                logger.error(
+                    f"Worker failed while rotating {len(files)} files: {str(e)}"
+                )
+                results = [RotationResult(path, angle, name, str(e)) for path in files]
+        # Batch engines share the elapsed time; ffmpeg runs time themselves.
+        share = (time.perf_counter() - start) / max(1, len(files))
+        for result in results:
+            result.metrics.setdefault("write_s", result.metrics.get("seconds", share))
+        return results
+
+    def _rotate_to_output(
+        self, engine, files: List[str], angle: int
+    ) -> List[RotationResult]:
+        # Clone each source into the output directory first, then let the
+        # engine rotate the clones in place; the sources are never written.
+        name = getattr(engine, "name", "unknown")
+        sources = {}
+        results = []
+        for path in files:
+            try:
+                output = video_utils.prepare_output(
+                    path, self.output_dir, self.base_dir
+                )
+                sources[output] = path
+            except OSError as e:
+                logger.error(f"Failed to copy {path} to output: {str(e)}")
+                results.append(RotationResult(path, angle, name, str(e)))
+        try:
+            rotated = engine.rotate_batch(list(sources), angle) if sources else []
+        except Exception as e:
+            logger.error(f"Worker failed while rotating {len(files)} files: {str(e)}")
+            rotated = [RotationResult(path, angle, name, str(e)) for path in sources]
+        for result in rotated:
+            result.output = result.path
+            result.path = sources[result.path]
+            if not result.ok and os.path.exists(result.output):
+                os.remove(result.output)
+            results.append(result)
+        return results
+
+    def _map(self, func: Callable, groups: Iterable[Tuple[List[str], int]]) -> Iterator:
+        # At most two chunks per worker are in flight, so an unbounded
+        # iterable of chunks is consumed lazily rather than queued up front.
+        pending: set = set()
+        for chunk, angle in groups:
+            pending.add(self._executor.submit(func, chunk, angle))
+            if len(pending) >= self.jobs * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            # Out of input: as workers go idle, the encodes still running
+            # may use the cores they free up.
+            self.budget.expect(min(len(pending), self.jobs))
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+    def rotate(
+        self, files: Iterable[str], angle: int, chunk_size: int
+    ) -> Iterator[List[RotationResult]]:
+        """Fan chunks of files out to the workers, yielding results as they land."""
+        chunks = engines.chunk_files(files, max_files=chunk_size)
+        return self.rotate_chunks(chunks, angle)
+
+    def rotate_chunks(
+        self, chunks: Iterable[List[str]], angle: int
+    ) -> Iterator[List[RotationResult]]:
+        """Rotate pre-built chunks of files, yielding results as they land."""
+        return self.rotate_groups((chunk, angle) for chunk in chunks)
+
+    def rotate_groups(
+        self, groups: Iterable[Tuple[List[str], int]]
+    ) -> Iterator[List[RotationResult]]:
+        """Rotate ``(chunk, angle)`` pairs, each chunk by its own angle."""
+        return self._map(self._run_and_report, groups)
+
+    def submit(self, chunk: List[str], angle: int) -> Future:
+        """Queue one chunk for a worker; the future resolves to its results."""
+        return self._executor.submit(self._run_and_report, chunk, angle)
+
+    def rotate_scheduled(
+        self, scheduler: devices.DeviceScheduler
+    ) -> Iterator[List[RotationResult]]:
+        """Rotate the chunks ``scheduler`` hands out.
+
+        Chunks are only submitted while their device is under its limit, so
+        a saturated disk never holds up workers that could serve another.
+        """
+        pending: Dict[Future, devices.Chunk] = {}
+        while True:
+            seen = scheduler.changes
+            for chunk in scheduler.take(self.jobs * 2 - len(pending)):
+                future = self._executor.submit(
+                    self._run_and_report, chunk.paths, chunk.angle
+                )
+                future.add_done_callback(scheduler.notify)
+                pending[future] = chunk
+            done = [future for future in pending if future.done()]
+            for future in done:
+                scheduler.release(pending.pop(future))
+                yield future.result()
+            if done:
+                continue
+            if not pending and scheduler.exhausted:
+                break
+            scheduler.wait(seen)
+        if scheduler.error is not None:
+            raise scheduler.error
+
+    def plan_chunks(
+        self, chunks: Iterable[List[str]], angle: int
+    ) -> Iterator[List[plan.PlanEntry]]:
+        """Plan pre-built chunks of files without writing anything."""
+        return self.plan_groups((chunk, angle) for chunk in chunks)
+
+    def plan_groups(
+        self, groups: Iterable[Tuple[List[str], int]]
+    ) -> Iterator[List[plan.PlanEntry]]:
+        """Plan ``(chunk, angle)`` pairs without writing anything."""
+        return self._map(self._plan_chunk, groups)
+
+    def close(self, cancel: bool = False) -> None:
+        """Shut down the workers and the engines they own.
+
+        Running chunks always finish; ``cancel`` drops the queued ones.
+        """
+        self._executor.shutdown(wait=True, cancel_futures=cancel)
+        self.budget.expect(1)
+        with self._lock:
+            for engine in self._engines:
+                try:
+                    engine.close()
+                except Exception as e:
+                    logger.warning(f"Failed to close rotation engine: {str(e)}")
+            self._engines.clear()
+
+
+def rotate_parallel(
+    files: Iterable[str],
+    angle: int,
+    jobs: int,
+    engine_factory: Optional[Callable] = None,
+    chunk_size: Optional[int] = None,
+    output_dir: Optional[str] = None,
+) -> Iterator[List[RotationResult]]:
+    """Rotate files across ``jobs`` workers, yielding each finished chunk."""
+    if chunk_size is None:
+        total = len(files) if isinstance(files, list) else None
+        chunk_size = chunk_size_for(total, jobs)
+    with WorkerPool(jobs, engine_factory, output_dir) as pool:
+        yield from pool.rotate(files, angle, chunk_size)
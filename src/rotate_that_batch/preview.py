@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .logger import logger
+
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "rotate_that_batch",
+    "thumbnails",
+)
+THUMBNAIL_SIZE = 240
+SHEET_COLUMNS = 4
+SHEET_ROWS = 6
+DEFAULT_SEEK = 1.0
+
+
+def transpose_filter(angle: int) -> Optional[str]:
+    """Lossless 90-degree-step rotation filter for ``angle`` (clockwise)."""
+    angle %= 360
+    if angle == 90:
+        return "transpose=clock"
+    if angle == 180:
+        return "hflip,vflip"
+    if angle == 270:
+        return "transpose=cclock"
+    if angle == 0:
+        return None
+    raise ValueError(f"Unsupported preview angle: {angle}")
+
+
+def _cache_key(path: str, angle: Optional[int], size: int, seek: float) -> str:
+    st = os.stat(path)
+    identity = (
+        f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}:{st.st_ino}:"
+        f"{angle}:{size}:{seek}"
+    )
+    return hashlib.sha1(identity.encode()).hexdigest()
+
+
+def _extract_frame(
+    path: str, output: str, angle: Optional[int], size: int, seek: float
+) -> None:
+    filters = []
+    if angle is not None:
+        # "After" frames: ignore the current rotation and apply the target.
+        rotation = transpose_filter(angle)
+        if rotation:
+            filters.append(rotation)
+    # Pad to a square so before/after tiles of any orientation line up.
+    filters.append(
+        f"scale={size}:{size}:force_original_aspect_ratio=decrease,"
+        f"pad={size}:{size}:(ow-iw)/2:(oh-ih)/2"
+    )
+    command = ["ffmpeg", "-v", "error", "-y"]
+    if angle is not None:
+        command.append("-noautorotate")
+    # -ss before -i seeks on the demuxer (keyframe index) instead of decoding
+    # every frame from the start of the file.
+    command += ["-ss", str(seek), "-i", path, "-frames:v", "1"]
+    command += ["-vf", ",".join(filters), "-q:v", "4", output]
+    subprocess.run(command, check=True, capture_output=True)
+
+
+def thumbnail(
+    path: str,
+    angle: Optional[int] = None,
+    size: int = THUMBNAIL_SIZE,
+    seek: float = DEFAULT_SEEK,
+    cache_dir: Optional[str] = None,
+) -> str:
+    """Return a cached thumbnail of ``path``.
+
+    With ``angle`` of None the frame is shown as players display it today;
+    otherwise it is shown as it will look once its rotation is ``angle``.
+    Thumbnails are keyed by file identity (path, size, mtime, inode), so
+    unchanged files are served from the cache on later previews.
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    cached = os.path.join(cache_dir, _cache_key(path, angle, size, seek) + ".jpg")
+    if os.path.exists(cached):
+        return cached
+
+    fd, tmp = tempfile.mkstemp(suffix=".jpg", dir=cache_dir)
+    os.close(fd)
+    try:
+        # Clips shorter than the seek point yield nothing: retry at the start.
+        for position in (seek, 0) if seek else (0,):
+            try:
+                _extract_frame(path, tmp, angle, size, position)
+            except subprocess.CalledProcessError:
+                if not position:
+                    raise
+                continue
+            if os.path.getsize(tmp):
+                break
+        else:
+            raise RuntimeError(f"ffmpeg produced no frame for {path}")
+        os.replace(tmp, cached)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return cached
+
+
+def _thumbnail_pair(
+    path: str, angle: int, size: int, seek: float, cache_dir: Optional[str]
+) -> Optional[Tuple[str, str]]:
+    try:
+        before = thumbnail(path, None, size, seek, cache_dir)
+        after = thumbnail(path, angle, size, seek, cache_dir)
+        return before, after
+    except subprocess.CalledProcessError as e:
+        stderr = e.stderr.decode(errors="replace") if e.stderr else ""
+        logger.error(f"Failed to generate preview for {path}. Error: {stderr}")
+    except Exception as e:
+        logger.error(f"An error occurred while previewing {path}: {str(e)}")
+    return None
+
+
+def _concat_line(path: str) -> str:
+    return "file '" + path.replace("'", "'\\''") + "'\n"
+
+
+def _tile(images: List[str], output: str, columns: int, rows: int) -> None:
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as listing:
+        listing.writelines(_concat_line(image) for image in images)
+    try:
+        command = ["ffmpeg", "-v", "error", "-y"]
+        command += ["-f", "concat", "-safe", "0", "-i", listing.name]
+        command += ["-vf", f"tile={columns}x{rows}:padding=4:margin=4"]
+        command += ["-frames:v", "1", "-q:v", "3", output]
+        subprocess.run(command, check=True, capture_output=True)
+    finally:
+        os.remove(listing.name)
+
+
+def build_contact_sheets(
+    video_files: Sequence[str],
+    angle: int,
+    output_dir: str,
+    jobs: int = 1,
+    size: int = THUMBNAIL_SIZE,
+    seek: float = DEFAULT_SEEK,
+    columns: int = SHEET_COLUMNS,
+    rows: int = SHEET_ROWS,
+    cache_dir: Optional[str] = None,
+) -> List[str]:
+    """Render before/after contact sheets for ``video_files`` into ``output_dir``.
+
+    Thumbnails are extracted in parallel (``jobs`` ffmpeg processes at once).
+    Every sheet holds ``columns`` videos per row, each as a before/after pair,
+    and ``contact_sheets.json`` maps every sheet to the videos on it, in order.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    logger.info(f"Building contact sheets for {len(video_files)} videos.")
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        pairs = list(
+            executor.map(
+                lambda path: _thumbnail_pair(path, angle, size, seek, cache_dir),
+                video_files,
+            )
+        )
+    previews = [(path, pair) for path, pair in zip(video_files, pairs) if pair]
+
+    per_sheet = columns * rows
+    sheets: List[str] = []
+    manifest: Dict[str, List[str]] = {}
+    for start in range(0, len(previews), per_sheet):
+        page = previews[start : start + per_sheet]
+        sheet = os.path.join(output_dir, f"sheet_{len(sheets) + 1:03d}.jpg")
+        images = [image for _, pair in page for image in pair]
+        page_rows = -(-len(page) // columns)
+        _tile(images, sheet, columns * 2, page_rows)
+        sheets.append(sheet)
+        manifest[os.path.basename(sheet)] = [path for path, _ in page]
+
+    with open(os.path.join(output_dir, "contact_sheets.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    logger.info(f"Wrote {len(sheets)} contact sheets to {output_dir}.")
+    return sheets
@@ -0,0 +1,25 @@
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+
+@dataclass
+class RotationResult:
+    """Outcome of rotating a single file.
+
+    ``skip_reason`` is set for skipped files that are not already at their
+    target, but were left alone on purpose.
+    """
+
+    path: str
+    angle: int
+    engine: str
+    error: Optional[str] = None
+    output: Optional[str] = None
+    skipped: bool = False
+    skip_reason: Optional[str] = None
+    fingerprint: Optional[str] = None
+    metrics: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
@@ -0,0 +1,107 @@
+import queue
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from .logger import logger
+
+DEFAULT_QUEUE_SIZE = 4096
+
+_DONE = object()
+
+
+class BackgroundScan:
+    """Run a file scan in a producer thread, feeding a bounded queue.
+
+    Consumers can start on the first file while the scan continues. The
+    queue bound keeps memory flat however large the tree is: when workers
+    fall behind, the scanner simply blocks.
+
+    With ``timings`` the seconds spent finding each file are kept in
+    ``timings`` until the consumer pops them.
+    """
+
+    def __init__(
+        self,
+        files: Iterable[str],
+        maxsize: int = DEFAULT_QUEUE_SIZE,
+        timings: bool = False,
+    ):
+        self.count = 0
+        self.timings: Optional[Dict[str, float]] = {} if timings else None
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._files = files
+        self._queue: queue.Queue = queue.Queue(maxsize)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="scanner", daemon=True)
+        self._thread.start()
+
+    def __enter__(self) -> "BackgroundScan":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self) -> None:
+        try:
+            files = iter(self._files)
+            while True:
+                start = time.perf_counter()
+                path = next(files, None)
+                if path is None:
+                    break
+                if self.timings is not None:
+                    self.timings[path] = time.perf_counter() - start
+                if not self._put(path):
+                    return
+                self.count += 1
+        except BaseException as e:
+            logger.error(f"Scan failed: {str(e)}")
+            self.error = e
+        finally:
+            self.done = True
+            self._put(_DONE)
+
+    def batches(self, max_files: int) -> Iterator[List[str]]:
+        """Yield lists of up to ``max_files`` paths.
+
+        A batch is handed out as soon as at least one path is available
+        rather than waiting for it to fill up.
+        """
+        finished = False
+        while not finished:
+            item = self._queue.get()
+            if item is _DONE:
+                break
+            batch = [item]
+            while len(batch) < max_files:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _DONE:
+                    finished = True
+                    break
+                batch.append(item)
+            yield batch
+        if self.error is not None:
+            raise self.error
+
+    def __iter__(self) -> Iterator[str]:
+        for batch in self.batches(1):
+            yield from batch
+
+    def close(self) -> None:
+        """Stop the scanner thread if the consumer gives up early."""
+        self._stop.set()
+        self._thread.join()
@@ -0,0 +1,39 @@
+"""Deterministic sharding, and the defaults of the shared work queue.
+
+Kept apart from ``workqueue`` so that plain runs, and the CLI's option
+defaults, do not import SQLite.
+"""
+
+import os
+import zlib
+from typing import Iterable, Iterator, Tuple
+
+DEFAULT_LEASE_SECONDS = 600.0
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+def parse_shard(text: str) -> Tuple[int, int]:
+    """Parse ``i/n`` (1-based) into ``(i, n)``."""
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard {text!r}: use i/n, for example 1/4")
+    if not 1 <= index <= count:
+        raise ValueError(f"Invalid shard {text!r}: i must be between 1 and n")
+    return index, count
+
+
+def in_shard(path: str, directory: str, index: int, count: int) -> bool:
+    """Whether ``path`` belongs to shard ``index`` of ``count``.
+
+    The hash covers the path relative to ``directory``, so every host agrees
+    on the split whatever its mount point.
+    """
+    relative = os.path.relpath(path, directory).encode()
+    return zlib.crc32(relative) % count == index - 1
+
+
+def shard_files(
+    files: Iterable[str], directory: str, index: int, count: int
+) -> Iterator[str]:
+    return (path for path in files if in_shard(path, directory, index, count))
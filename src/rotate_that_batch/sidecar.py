@@ -0,0 +1,314 @@
+"""XMP sidecars: record rotations next to the videos instead of writing them.
+
+On read-only or write-once storage the media cannot be rewritten, and even
+where it can, a sidecar costs one small write instead of a pass over the
+file. The target rotation is stored as ``tiff:Orientation``, either in a
+``<video>.xmp`` sidecar per file or in one ``rotations.xmp`` per directory
+listing every file of it. ``apply-sidecars`` later writes them to the
+videos with any engine.
+"""
+
+import os
+import threading
+import xml.etree.ElementTree as ET
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from xml.sax.saxutils import escape
+
+from .logger import logger
+from .manifest import ManifestPath
+from .result import RotationResult
+
+SIDECAR_MODES = ("off", "file", "directory")
+DIRECTORY_SIDECAR = "rotations.xmp"
+# Per-file sidecars handed to a writer thread at once.
+WRITE_BATCH = 256
+
+X = "adobe:ns:meta/"
+RDF = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+TIFF = "http://ns.adobe.com/tiff/1.0/"
+RTB = "urn:rotate-that-batch:1.0"
+for _prefix, _uri in (("x", X), ("rdf", RDF), ("tiff", TIFF), ("rtb", RTB)):
+    ET.register_namespace(_prefix, _uri)
+
+# EXIF orientations of the four rotations (mirrored ones are not used).
+ORIENTATIONS = {0: 1, 90: 6, 180: 3, 270: 8}
+ANGLES = {orientation: angle for angle, orientation in ORIENTATIONS.items()}
+
+_PACKET = (
+    '<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>\n'
+    "{}\n"
+    '<?xpacket end="w"?>\n'
+)
+_FILE = _PACKET.format(
+    f'<x:xmpmeta xmlns:x="{X}">\n'
+    f' <rdf:RDF xmlns:rdf="{RDF}">\n'
+    f'  <rdf:Description rdf:about="" xmlns:tiff="{TIFF}" '
+    'tiff:Orientation="{}"/>\n'
+    " </rdf:RDF>\n"
+    "</x:xmpmeta>"
+)
+_ENTRY = (
+    '    <rdf:li rdf:parseType="Resource"><rtb:Name>{}</rtb:Name>'
+    "<tiff:Orientation>{}</tiff:Orientation></rdf:li>\n"
+)
+
+
+class SidecarError(Exception):
+    """A sidecar exists but cannot be read or updated."""
+
+
+def sidecar_path(video: str) -> str:
+    return f"{video}.xmp"
+
+
+def _parse(path: str) -> ET.Element:
+    try:
+        return ET.parse(path).getroot()
+    except ET.ParseError as e:
+        raise SidecarError(f"Cannot parse sidecar {path}: {str(e)}")
+
+
+def _angle(element: ET.Element) -> Optional[int]:
+    """Rotation of an element holding ``tiff:Orientation``, as either form."""
+    value = element.get(f"{{{TIFF}}}Orientation")
+    if value is None:
+        child = element.find(f"{{{TIFF}}}Orientation")
+        value = child.text if child is not None else None
+    try:
+        return ANGLES.get(int((value or "").strip()))
+    except ValueError:
+        return None
+
+
+def read_file_sidecar(video: str) -> Optional[int]:
+    """Rotation recorded in the sidecar of ``video``; None if there is none."""
+    path = sidecar_path(video)
+    if not os.path.exists(path):
+        return None
+    for description in _parse(path).iter(f"{{{RDF}}}Description"):
+        angle = _angle(description)
+        if angle is not None:
+            return angle
+    return None
+
+
+def _replace(path: str, text: str) -> None:
+    # Written under a temporary name first, so readers and a crash never
+    # see a partial sidecar.
+    tmp = f"{path}.rtb-tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def write_file_sidecar(video: str, angle: int) -> None:
+    """Record ``angle`` in the sidecar of ``video``, replacing it atomically.
+
+    An existing sidecar keeps its other metadata: only its orientation is
+    replaced.
+    """
+    path = sidecar_path(video)
+    if not os.path.exists(path):
+        _replace(path, _FILE.format(ORIENTATIONS[angle]))
+        return
+    root = _parse(path)
+    description = root.find(f".//{{{RDF}}}Description")
+    if description is None:
+        raise SidecarError(f"Sidecar {path} has no rdf:Description")
+    for child in description.findall(f"{{{TIFF}}}Orientation"):
+        description.remove(child)
+    description.set(f"{{{TIFF}}}Orientation", str(ORIENTATIONS[angle]))
+    _replace(path, _PACKET.format(ET.tostring(root, encoding="unicode")))
+
+
+def read_directory_sidecar(directory: str) -> Dict[str, int]:
+    """File names and rotations listed in the sidecar of ``directory``."""
+    path = os.path.join(directory, DIRECTORY_SIDECAR)
+    if not os.path.exists(path):
+        return {}
+    entries = {}
+    for item in _parse(path).iter(f"{{{RDF}}}li"):
+        name = item.findtext(f"{{{RTB}}}Name")
+        angle = _angle(item)
+        if name and angle is not None:
+            entries[name] = angle
+    return entries
+
+
+def write_directory_sidecar(directory: str, entries: Dict[str, int]) -> None:
+    """Replace the sidecar of ``directory``; remove it if ``entries`` is empty."""
+    path = os.path.join(directory, DIRECTORY_SIDECAR)
+    if not entries:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    items = "".join(
+        _ENTRY.format(escape(name), ORIENTATIONS[angle])
+        for name, angle in sorted(entries.items())
+    )
+    body = (
+        f'<x:xmpmeta xmlns:x="{X}">\n'
+        f' <rdf:RDF xmlns:rdf="{RDF}">\n'
+        f'  <rdf:Description rdf:about="" xmlns:rtb="{RTB}" xmlns:tiff="{TIFF}">\n'
+        "   <rtb:Files><rdf:Bag>\n"
+        f"{items}"
+        "   </rdf:Bag></rtb:Files>\n"
+        "  </rdf:Description>\n"
+        " </rdf:RDF>\n"
+        "</x:xmpmeta>"
+    )
+    _replace(path, _PACKET.format(body))
+
+
+class SidecarWriter:
+    """Record target rotations in per-file or per-directory sidecars.
+
+    Per-file sidecars are written in batches of ``WRITE_BATCH`` by ``jobs``
+    threads, since creating many small files mostly waits on the file
+    system. Directory sidecars are collected and written once per directory
+    by ``close``, merged into the ones already there, so a directory of any
+    size costs one write.
+    """
+
+    def __init__(self, layout: str, jobs: int = 1):
+        if layout not in SIDECAR_MODES[1:]:
+            raise ValueError(f"Unknown sidecar layout: {layout}")
+        self.layout = layout
+        self.jobs = max(1, jobs)
+        self.files = 0
+        self.failures: List[RotationResult] = []
+        self._directories: Dict[str, Dict[str, int]] = {}
+        self._batch: List[Tuple[str, int]] = []
+        self._pending: Set[Future] = set()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _fail(self, path: str, angle: int, error: str) -> None:
+        logger.error(f"Failed to record rotation of {path}: {error}")
+        self.failures.append(RotationResult(path, angle, "sidecar", error))
+
+    @staticmethod
+    def _write_batch(
+        batch: List[Tuple[str, int]]
+    ) -> Tuple[int, List[Tuple[str, int, str]]]:
+        failed = []
+        for path, angle in batch:
+            try:
+                write_file_sidecar(path, angle)
+            except (OSError, SidecarError) as e:
+                failed.append((path, angle, str(e)))
+        return len(batch) - len(failed), failed
+
+    def _collect(self, done: Iterable[Future]) -> None:
+        for future in done:
+            written, failed = future.result()
+            self.files += written
+            for path, angle, error in failed:
+                self._fail(path, angle, error)
+            self._pending.discard(future)
+
+    def _flush(self) -> None:
+        if not self._batch:
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.jobs, thread_name_prefix="sidecar-writer"
+            )
+        if len(self._pending) >= self.jobs * 2:
+            done, _ = wait(self._pending, return_when=FIRST_COMPLETED)
+            self._collect(done)
+        self._pending.add(self._executor.submit(self._write_batch, self._batch))
+        self._batch = []
+
+    def add(self, path: str, angle: int) -> None:
+        angle %= 360
+        if self.layout == "directory":
+            directory, name = os.path.split(os.path.abspath(path))
+            self._directories.setdefault(directory, {})[name] = angle
+            return
+        self._batch.append((path, angle))
+        if len(self._batch) >= WRITE_BATCH:
+            self._flush()
+
+    def fail(self, path: str, angle: int, error: str) -> None:
+        """Report a file whose target could not be planned."""
+        self._fail(path, angle, error)
+
+    def close(self) -> None:
+        self._flush()
+        self._collect(list(self._pending))
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        for directory, entries in self._directories.items():
+            try:
+                merged = read_directory_sidecar(directory)
+                merged.update(entries)
+                write_directory_sidecar(directory, merged)
+                self.files += len(entries)
+            except (OSError, SidecarError) as e:
+                for name, angle in entries.items():
+                    self._fail(os.path.join(directory, name), angle, str(e))
+        self._directories.clear()
+
+
+class SidecarReader:
+    """Find the recorded rotations of videos and retire applied sidecars.
+
+    A file's own sidecar wins over its directory's. ``pending`` may run in
+    the scanner thread while ``applied`` is called with results.
+    """
+
+    def __init__(self) -> None:
+        self._directories: Dict[str, Dict[str, int]] = {}
+        self._applied: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def angle(self, path: str) -> Optional[int]:
+        angle = read_file_sidecar(path)
+        if angle is not None:
+            return angle
+        directory, name = os.path.split(os.path.abspath(path))
+        with self._lock:
+            entries = self._directories.get(directory)
+            if entries is None:
+                entries = read_directory_sidecar(directory)
+                self._directories[directory] = entries
+        return entries.get(name)
+
+    def pending(self, files: Iterable[str]) -> Iterator[ManifestPath]:
+        """The files that have a sidecar, carrying its rotation."""
+        for path in files:
+            try:
+                angle = self.angle(path)
+            except (OSError, SidecarError) as e:
+                logger.error(str(e))
+                continue
+            if angle is not None:
+                yield ManifestPath(path, angle)
+
+    def applied(self, results: Iterable[RotationResult]) -> None:
+        """Remove the sidecars of successfully rotated files."""
+        for result in results:
+            if not result.ok:
+                continue
+            if os.path.exists(sidecar_path(result.path)):
+                os.remove(sidecar_path(result.path))
+            directory, name = os.path.split(os.path.abspath(result.path))
+            with self._lock:
+                self._applied.setdefault(directory, set()).add(name)
+
+    def close(self) -> None:
+        """Rewrite the directory sidecars without their applied entries."""
+        with self._lock:
+            for directory, names in self._applied.items():
+                entries = self._directories.get(directory) or {}
+                if names & entries.keys():
+                    remaining = {n: a for n, a in entries.items() if n not in names}
+                    write_directory_sidecar(directory, remaining)
+            self._applied.clear()
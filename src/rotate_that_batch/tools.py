@@ -0,0 +1,86 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from typing import Dict, Optional
+
+from .logger import logger
+
+CACHE_FILE = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "rotate_that_batch",
+    "tools.json",
+)
+
+VERSION_ARGS = {
+    "ffmpeg": ["-version"],
+    "ffprobe": ["-version"],
+    "exiftool": ["-ver"],
+}
+
+# Tools each engine may run; auto only needs them once a file is routed there.
+ENGINE_TOOLS = {
+    "auto": (),
+    "native": (),
+    "exiftool": ("exiftool",),
+    "remux": ("ffmpeg", "ffprobe"),
+    "reencode": ("ffmpeg",),
+}
+
+
+def _load() -> Dict[str, Dict[str, str]]:
+    try:
+        with open(CACHE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save(cache: Dict[str, Dict[str, str]]) -> None:
+    directory = os.path.dirname(CACHE_FILE)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(suffix=".json", dir=directory)
+        with os.fdopen(fd, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp, CACHE_FILE)
+    except OSError as e:
+        logger.debug(f"Cannot write tool cache {CACHE_FILE}: {str(e)}")
+
+
+def probe(tool: str) -> Optional[str]:
+    """Version string of ``tool``, or None if it is missing or broken.
+
+    Results are cached on disk keyed by the resolved binary path, size and
+    mtime, so the tool is only spawned again after it is upgraded or moved.
+    """
+    path = shutil.which(tool)
+    if path is None:
+        return None
+    real = os.path.realpath(path)
+    try:
+        st = os.stat(real)
+    except OSError:
+        return None
+    key = f"{real}:{st.st_size}:{st.st_mtime_ns}"
+    cache = _load()
+    cached = cache.get(tool)
+    if cached and cached.get("key") == key:
+        return cached["version"]
+
+    try:
+        output = subprocess.run(
+            [path, *VERSION_ARGS.get(tool, ["--version"])],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=True,
+            text=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.debug(f"Probing {tool} failed: {str(e)}")
+        return None
+    version = output.strip().splitlines()[0] if output.strip() else "unknown"
+    cache[tool] = {"key": key, "version": version}
+    _save(cache)
+    return version
@@ -0,0 +1,321 @@
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+from . import mkv
+from .logger import logger
+from .preview import transpose_filter
+from .result import RotationResult
+
+# Containers that carry no rotation metadata: the pixels must be rotated.
+REENCODE_EXTENSIONS = (".avi", ".flv", ".wmv")
+# Containers with a display matrix ExifTool cannot write: ffmpeg remuxes them.
+REMUX_EXTENSIONS = (".mkv",)
+
+# Encoder settings per container, chosen so the output stays playable by
+# whatever produced the file in the first place.
+ENCODERS: Dict[str, List[str]] = {
+    ".avi": ["-c:v", "mpeg4", "-q:v", "2"],
+    ".flv": ["-c:v", "libx264", "-preset", "veryfast", "-crf", "18"],
+    ".wmv": ["-c:v", "wmv2", "-q:v", "2"],
+}
+DEFAULT_ENCODER = ["-c:v", "libx264", "-preset", "veryfast", "-crf", "18"]
+
+# Most encoders stop scaling well past this many threads; more concurrent
+# encodes are the better use of extra cores.
+MAX_ENCODE_THREADS = 16
+
+
+class CoreBudget:
+    """Share CPU cores between concurrent ffmpeg encodes.
+
+    The worker pool tells the budget how many encodes it expects to run at
+    once (``expect``); each encode is then granted an even share of the
+    cores, passed to ffmpeg as ``-threads``, and waits until that share is
+    free. With every worker encoding, each gets a few threads (the most total
+    throughput); as the batch drains the pool lowers its expectation, so the
+    last encodes get more threads and the tail finishes fast.
+    """
+
+    def __init__(
+        self, cores: Optional[int] = None, max_threads: int = MAX_ENCODE_THREADS
+    ):
+        self.cores = max(1, cores or os.cpu_count() or 1)
+        self.max_threads = max(1, max_threads)
+        self.free = self.cores
+        self.active = 0
+        self.expected = 1
+        self._cond = threading.Condition()
+
+    def expect(self, encodes: int) -> None:
+        """Set the number of encodes expected to run at the same time."""
+        with self._cond:
+            self.expected = max(1, encodes)
+            self._cond.notify_all()
+
+    def _share(self) -> int:
+        contenders = max(self.expected, self.active + 1)
+        return max(1, min(self.max_threads, self.cores // contenders))
+
+    def acquire(self) -> int:
+        """Block until a share of the cores is free and return its thread count."""
+        with self._cond:
+            while self.free < self._share():
+                self._cond.wait()
+            share = self._share()
+            self.free -= share
+            self.active += 1
+            return share
+
+    def release(self, threads: int) -> None:
+        with self._cond:
+            self.free += threads
+            self.active -= 1
+            self._cond.notify_all()
+
+
+_budget: Optional[CoreBudget] = None
+_budget_lock = threading.Lock()
+
+
+def core_budget() -> CoreBudget:
+    """The process-wide core budget shared by every worker's encodes."""
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = CoreBudget()
+        return _budget
+
+
+def temp_output(path: str) -> str:
+    """Temporary name next to ``path`` that keeps the container extension."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.rtb-tmp{ext}"
+
+
+# Global options that make ffmpeg report its progress as key=value lines.
+PROGRESS_ARGS = ["-progress", "pipe:1", "-nostats"]
+
+# Runs an ffmpeg command to completion and returns its stats.
+Runner = Callable[[List[str]], Dict[str, float]]
+
+
+def progress_stats(lines: Iterable[str], start: float) -> Dict[str, float]:
+    """Frames, speed and timing from ffmpeg's ``-progress`` output."""
+    stats: Dict[str, float] = {}
+    for line in lines:
+        key, _, value = line.strip().partition("=")
+        if key == "frame" and value.isdigit():
+            stats["frames"] = float(value)
+        elif key == "speed" and value.endswith("x"):
+            try:
+                stats["speed"] = float(value[:-1])
+            except ValueError:
+                pass
+    stats["seconds"] = time.monotonic() - start
+    if stats.get("frames") and stats["seconds"] > 0:
+        stats["fps"] = stats["frames"] / stats["seconds"]
+    return stats
+
+
+def run_ffmpeg(command: List[str]) -> Dict[str, float]:
+    """Run ffmpeg with ``-progress`` on stdout and return its final stats."""
+    start = time.monotonic()
+    process = subprocess.Popen(
+        command[:1] + PROGRESS_ARGS + command[1:],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    assert process.stdout is not None and process.stderr is not None
+    stats = progress_stats(process.stdout, start)
+    stderr = process.stderr.read()
+    if process.wait():
+        raise subprocess.CalledProcessError(process.returncode, command, stderr=stderr)
+    return stats
+
+
+def rewrite(
+    path: str, command: Callable[[str], List[str]], runner: Optional[Runner] = None
+) -> Dict[str, float]:
+    """Run ``command(output)`` into a temporary file that then replaces ``path``.
+
+    The source is only replaced once ffmpeg has succeeded, so an interrupted
+    or failed run leaves it untouched; the temporary file is always removed.
+    ``runner`` runs the command instead of ``run_ffmpeg``.
+    """
+    output = temp_output(path)
+    try:
+        stats = (runner or run_ffmpeg)(command(output))
+        shutil.copymode(path, output)
+        os.replace(output, path)
+    finally:
+        if os.path.exists(output):
+            os.remove(output)
+    return stats
+
+
+def _ffmpeg_error(e: subprocess.CalledProcessError) -> str:
+    return (e.stderr or "").strip() or f"ffmpeg exited with {e.returncode}"
+
+
+class ReencodeEngine:
+    """Rotate the pixels with ffmpeg for containers without rotation metadata.
+
+    Each file is re-encoded through ``transpose`` filters into a temporary
+    file next to it that atomically replaces the source once complete.
+    """
+
+    name = "reencode"
+
+    def __init__(
+        self, budget: Optional[CoreBudget] = None, runner: Optional[Runner] = None
+    ):
+        self.budget = budget or core_budget()
+        self.runner = runner
+
+    def start(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def read_rotations(self, files: Iterable[str]) -> Dict[str, Optional[int]]:
+        # These containers have no rotation field: players show the pixels
+        # as stored, so their displayed rotation is always 0.
+        return {path: 0 for path in files}
+
+    def rewrites_pixels(self, path: str) -> bool:
+        return True
+
+    @staticmethod
+    def command(path: str, output: str, angle: int, threads: int) -> List[str]:
+        ext = os.path.splitext(path)[1].lower()
+        command = ["ffmpeg", "-v", "error", "-y", "-i", path]
+        command += ["-vf", transpose_filter(angle) or "null"]
+        command += ENCODERS.get(ext, DEFAULT_ENCODER)
+        command += ["-threads", str(threads), "-c:a", "copy", output]
+        return command
+
+    def rotate_file(self, path: str, angle: int) -> RotationResult:
+        if not transpose_filter(angle):
+            return RotationResult(path, angle, self.name, skipped=True)
+        threads = self.budget.acquire()
+        try:
+            size = os.path.getsize(path)
+            stats = rewrite(
+                path,
+                lambda output: self.command(path, output, angle, threads),
+                self.runner,
+            )
+            stats["bytes_written"] = float(os.path.getsize(path))
+        except subprocess.CalledProcessError as e:
+            logger.error(
+                f"Failed to re-encode video: {path}. Error: {_ffmpeg_error(e)}"
+            )
+            return RotationResult(path, angle, self.name, _ffmpeg_error(e))
+        except OSError as e:
+            logger.error(f"Failed to re-encode video: {path}. Error: {str(e)}")
+            return RotationResult(path, angle, self.name, str(e))
+        finally:
+            self.budget.release(threads)
+        stats["threads"] = threads
+        stats["bytes_read"] = float(size)
+        logger.info(
+            f"Re-encoded {path} by {angle} degrees at {stats.get('fps', 0):.1f} fps "
+            f"({stats.get('speed', 0):.2f}x realtime, {threads} threads)."
+        )
+        return RotationResult(path, angle, self.name, metrics=stats)
+
+    def rotate_batch(self, files: Iterable[str], angle: int) -> List[RotationResult]:
+        return [self.rotate_file(path, angle) for path in files]
+
+
+def probe_rotation(path: str) -> Optional[int]:
+    """Clockwise display rotation of the first video stream, read by ffprobe."""
+    command = ["ffprobe", "-v", "error", "-select_streams", "v:0"]
+    command += ["-show_entries", "stream_side_data=rotation", "-of", "json", path]
+    try:
+        output = subprocess.run(command, check=True, capture_output=True).stdout
+        streams = json.loads(output or b"{}").get("streams") or []
+    except (OSError, ValueError, subprocess.CalledProcessError) as e:
+        logger.debug(f"Cannot probe rotation of {path}: {str(e)}")
+        return None
+    if not streams:
+        return None
+    for side_data in streams[0].get("side_data_list", []):
+        if "rotation" in side_data:
+            # ffprobe reports the display matrix counter-clockwise.
+            return int(-float(side_data["rotation"])) % 360
+    return 0
+
+
+class RemuxEngine:
+    """Set the display rotation of Matroska files with an ffmpeg stream copy.
+
+    Streams are copied untouched (``-c copy``), so a remux runs at disk
+    speed; the result replaces the source atomically through a temporary
+    file next to it.
+    """
+
+    name = "remux"
+
+    def __init__(self, runner: Optional[Runner] = None):
+        self.runner = runner
+
+    def start(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def read_rotations(self, files: Iterable[str]) -> Dict[str, Optional[int]]:
+        # Read in-process; ffprobe only runs for files the reader rejects.
+        rotations: Dict[str, Optional[int]] = {}
+        for path in files:
+            try:
+                rotation: Optional[int] = mkv.read_rotation(path)
+            except mkv.UnsupportedContainer as e:
+                logger.debug(f"Probing {path} with ffprobe: {str(e)}")
+                rotation = probe_rotation(path)
+            except OSError as e:
+                logger.debug(f"Cannot read rotation of {path}: {str(e)}")
+                continue
+            if rotation is not None:
+                rotations[path] = rotation
+        return rotations
+
+    def rewrites_pixels(self, path: str) -> bool:
+        return False
+
+    @staticmethod
+    def command(path: str, output: str, angle: int) -> List[str]:
+        # -display_rotation is counter-clockwise and applies to the input.
+        command = ["ffmpeg", "-v", "error", "-y"]
+        command += ["-display_rotation:v:0", str((360 - angle) % 360), "-i", path]
+        command += ["-map", "0", "-map_metadata", "0", "-c", "copy", output]
+        return command
+
+    def rotate_file(self, path: str, angle: int) -> RotationResult:
+        try:
+            size = os.path.getsize(path)
+            stats = rewrite(
+                path, lambda output: self.command(path, output, angle), self.runner
+            )
+        except subprocess.CalledProcessError as e:
+            logger.error(f"Failed to remux video: {path}. Error: {_ffmpeg_error(e)}")
+            return RotationResult(path, angle, self.name, _ffmpeg_error(e))
+        except OSError as e:
+            logger.error(f"Failed to remux video: {path}. Error: {str(e)}")
+            return RotationResult(path, angle, self.name, str(e))
+        stats["bytes_read"] = stats["bytes_written"] = float(size)
+        logger.debug(f"Remuxed {path} with a {angle} degree display rotation.")
+        return RotationResult(path, angle, self.name, metrics=stats)
+
+    def rotate_batch(self, files: Iterable[str], angle: int) -> List[RotationResult]:
+        return [self.rotate_file(path, angle) for path in files]
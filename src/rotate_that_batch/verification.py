@@ -0,0 +1,160 @@
+"""Cheap post-write checks that a rotation landed and the media survived it.
+
+MP4/MOV files are checked natively: only the box headers down to each video
+track's ``tkhd`` are read back, through the same memory-mapped walk as the
+write. Other containers are re-read through the worker's engine in one
+batched call, so ExifTool is not spawned again per file; the remux engine
+reads Matroska files in-process, without ffprobe. Re-encoded files keep no
+rotation metadata and are only fingerprinted.
+
+The fingerprint hashes the media data's length and a few small blocks
+spread evenly over it (the ``mdat`` payload for MP4/MOV, the whole file
+otherwise), so it reads tens of kilobytes whatever the file size. A
+metadata-only write must leave the ``mdat`` payload alone, so a fingerprint
+that differs from the one taken before the write means the media data was
+damaged. A Matroska remux rewrites every byte around the frames, so there
+the fingerprint covers what a stream copy keeps instead: the tracks' codecs
+and parameters and the start of the first frames of each video track.
+"""
+
+import hashlib
+import os
+import struct
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from . import mkv, mp4, transcode
+from .logger import logger
+from .result import RotationResult
+
+SAMPLES = 8
+SAMPLE_BYTES = 4096
+
+# A fingerprint and whether it covers the media alone (an mdat payload or
+# Matroska streams, comparable across metadata rewrites) or a whole file.
+Fingerprint = Tuple[str, bool]
+
+
+def _media_range(path: str, size: int) -> Tuple[int, int, bool]:
+    if path.lower().endswith(mp4.NATIVE_EXTENSIONS):
+        try:
+            found = mp4.media_range(path)
+        except mp4.UnsupportedContainer:
+            found = None
+        if found is not None:
+            return found[0], found[1], True
+    return 0, size, False
+
+
+def sample(digest, fd: int, start: int, length: int) -> None:
+    """Feed ``SAMPLES`` blocks spread evenly over a byte range to ``digest``."""
+    if length <= SAMPLES * SAMPLE_BYTES:
+        digest.update(os.pread(fd, length, start))
+        return
+    step = (length - SAMPLE_BYTES) // (SAMPLES - 1)
+    for i in range(SAMPLES):
+        digest.update(os.pread(fd, SAMPLE_BYTES, start + i * step))
+
+
+def _stream_digest(path: str) -> Optional[str]:
+    try:
+        signature = mkv.stream_signature(path, SAMPLES, SAMPLE_BYTES)
+    except mkv.UnsupportedContainer as e:
+        logger.debug(f"Fingerprinting all of {path}: {str(e)}")
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    for part in signature:
+        digest.update(struct.pack(">Q", len(part)))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def fingerprint(path: str) -> Fingerprint:
+    """Sampled hash of the media data of ``path``."""
+    if path.lower().endswith(transcode.REMUX_EXTENSIONS):
+        streams = _stream_digest(path)
+        if streams is not None:
+            return streams, True
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        start, end, is_media = _media_range(path, size)
+        length = end - start
+        digest = hashlib.blake2b(struct.pack(">Q", length), digest_size=16)
+        sample(digest, f.fileno(), start, length)
+    return digest.hexdigest(), is_media
+
+
+def fingerprints(paths: Iterable[str]) -> Dict[str, Fingerprint]:
+    """Fingerprint ``paths`` before they are written; unreadable ones are left out."""
+    taken = {}
+    for path in paths:
+        try:
+            taken[path] = fingerprint(path)
+        except OSError as e:
+            logger.debug(f"Cannot fingerprint {path}: {str(e)}")
+    return taken
+
+
+def _check_media(result: RotationResult, before: Optional[Fingerprint]) -> None:
+    path = result.output or result.path
+    try:
+        digest, is_media = fingerprint(path)
+    except OSError as e:
+        result.error = f"Verification failed: cannot read {path}: {str(e)}"
+        return
+    result.fingerprint = digest
+    if before is not None and before[1] and is_media and before[0] != digest:
+        result.error = "Verification failed: media data changed during the write"
+
+
+def _rotation_error(rotations: Iterable[Optional[int]], target: int) -> Optional[str]:
+    found = sorted({r % 360 for r in rotations if r is not None})
+    if found != [target % 360]:
+        shown = ", ".join(map(str, found)) or "unknown"
+        return f"Verification failed: rotation is {shown}, expected {target % 360}"
+    return None
+
+
+def verify_results(
+    engine, results: List[RotationResult], before: Dict[str, Fingerprint]
+) -> None:
+    """Check written results in place, failing those whose write did not land.
+
+    ``before`` holds the fingerprints taken before the write. Each checked
+    result gets its ``fingerprint`` and a ``verify_s`` metric.
+    """
+    start = time.perf_counter()
+    fallback: Dict[str, RotationResult] = {}
+    checked = []
+    for result in results:
+        if not result.ok or result.skipped:
+            continue
+        checked.append(result)
+        path = result.output or result.path
+        _check_media(result, before.get(result.path))
+        if not result.ok or engine.rewrites_pixels(path):
+            continue
+        if path.lower().endswith(mp4.NATIVE_EXTENSIONS):
+            try:
+                error = _rotation_error(mp4.read_rotations(path), result.angle)
+            except mp4.UnsupportedContainer:
+                fallback[path] = result
+                continue
+            except OSError as e:
+                error = f"Verification failed: {str(e)}"
+            result.error = error
+        else:
+            fallback[path] = result
+    if fallback:
+        try:
+            rotations = engine.read_rotations(list(fallback))
+        except Exception as e:
+            rotations = {}
+            logger.error(f"Cannot read back {len(fallback)} rotations: {str(e)}")
+        for path, result in fallback.items():
+            result.error = _rotation_error([rotations.get(path)], result.angle)
+    share = (time.perf_counter() - start) / max(1, len(checked))
+    for result in checked:
+        result.metrics["verify_s"] = share
+        if not result.ok:
+            logger.error(f"{result.error}: {result.output or result.path}")
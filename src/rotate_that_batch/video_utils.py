@@ -1,42 +1,37 @@
+import fnmatch
 import os
 import subprocess
 import sys
-from typing import List, Optional
+from typing import Iterator, List, Optional, Sequence
 
-import exiftool  # type: ignore
 import typer
 
+from .fastcopy import clone_file
 from .logger import logger
+from .preview import transpose_filter
+from .tools import probe
 
 
 def check_ffmpeg(install_prompt=input):
-    """Check if ffmpeg is installed."""
-    try:
-        subprocess.run(
-            ["ffmpeg", "-version"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            check=True,
-        )
+    """Check if ffmpeg is installed (the probe is cached between runs)."""
+    if probe("ffmpeg") is not None:
         logger.info("ffmpeg is installed and working correctly.")
-    except FileNotFoundError:
-        logger.warning("ffmpeg is not installed.")
-        print(
-            "ffmpeg is not installed. Would you like to install it using Homebrew? (y/n)"
-        )
-        if install_prompt().lower() == "y":
-            try:
-                subprocess.run(["brew", "install", "ffmpeg"], check=True)
-                logger.info("ffmpeg installed successfully.")
-                print("ffmpeg installed. Please rerun the script.")
-            except subprocess.CalledProcessError:
-                logger.error("Failed to install ffmpeg using Homebrew.")
-                print("Failed to install ffmpeg. Please install it manually.")
-            sys.exit()
-        else:
-            logger.info("User chose not to install ffmpeg. Exiting.")
-            print("ffmpeg is required to run this script. Exiting.")
-            sys.exit(1)
+        return
+    logger.warning("ffmpeg is not installed.")
+    print("ffmpeg is not installed. Would you like to install it using Homebrew? (y/n)")
+    if install_prompt().lower() == "y":
+        try:
+            subprocess.run(["brew", "install", "ffmpeg"], check=True)
+            logger.info("ffmpeg installed successfully.")
+            print("ffmpeg installed. Please rerun the script.")
+        except subprocess.CalledProcessError:
+            logger.error("Failed to install ffmpeg using Homebrew.")
+            print("Failed to install ffmpeg. Please install it manually.")
+        sys.exit()
+    else:
+        logger.info("User chose not to install ffmpeg. Exiting.")
+        print("ffmpeg is required to run this script. Exiting.")
+        sys.exit(1)
 
 
 def list_directories() -> List[str]:
@@ -58,30 +53,119 @@ def select_directory() -> str:
     return directories[folder_choice]
 
 
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".flv", ".wmv")
+SYMLINK_POLICIES = ("skip", "files", "follow")
+
+
+def _matches(name: str, relative: str, patterns: Sequence[str]) -> bool:
+    return any(
+        fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relative, pattern)
+        for pattern in patterns
+    )
+
+
+def iter_video_files(
+    directory: str,
+    recursive: bool = False,
+    include: Sequence[str] = (),
+    exclude: Sequence[str] = (),
+    symlinks: str = "files",
+    skip_dirs: Sequence[str] = (),
+) -> Iterator[str]:
+    """Yield video files under ``directory`` as they are found.
+
+    ``include``/``exclude`` are glob patterns matched against both the file
+    name and the path relative to ``directory``; excluded directories are
+    not descended into. ``symlinks`` is ``skip`` (ignore all symlinks),
+    ``files`` (follow links to files only) or ``follow`` (also descend into
+    linked directories, guarding against loops). Directories in ``skip_dirs``
+    (such as the output directory) are never descended into.
+    """
+    if symlinks not in SYMLINK_POLICIES:
+        raise ValueError(f"Unknown symlink policy: {symlinks}")
+    skipped = {os.path.realpath(d) for d in skip_dirs}
+    visited = set()
+    pending = [directory]
+    while pending:
+        current = pending.pop()
+        try:
+            if symlinks == "follow":
+                st = os.stat(current)
+                if (st.st_dev, st.st_ino) in visited:
+                    continue
+                visited.add((st.st_dev, st.st_ino))
+            entries = os.scandir(current)
+        except OSError as e:
+            logger.warning(f"Cannot scan directory {current}: {str(e)}")
+            continue
+        subdirs = []
+        with entries:
+            for entry in entries:
+                is_link = entry.is_symlink()
+                if is_link and symlinks == "skip":
+                    continue
+                relative = os.path.relpath(entry.path, directory).replace(os.sep, "/")
+                if exclude and _matches(entry.name, relative, exclude):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=symlinks == "follow"):
+                        if recursive and os.path.realpath(entry.path) not in skipped:
+                            subdirs.append(entry.path)
+                        continue
+                    if not entry.is_file():
+                        continue
+                except OSError:
+                    continue
+                if not entry.name.lower().endswith(VIDEO_EXTENSIONS):
+                    continue
+                if include and not _matches(entry.name, relative, include):
+                    continue
+                yield entry.path
+        # Depth-first, in directory order: only unvisited directories are held.
+        pending.extend(reversed(subdirs))
+
+
 def get_video_files(directory: str) -> List[str]:
     """Get all video files in the specified directory."""
-    video_extensions = (".mp4", ".avi", ".mov", ".mkv", ".flv", ".wmv")
-    video_files = [
-        os.path.join(directory, f)
-        for f in os.listdir(directory)
-        if f.lower().endswith(video_extensions)
-    ]
+    video_files = list(iter_video_files(directory))
     logger.info(f"Found {len(video_files)} video files in directory: {directory}")
     return video_files
 
 
+def output_path(
+    input_file: str, output_dir: str, base_dir: Optional[str] = None
+) -> str:
+    """Path a rotated copy of ``input_file`` is written to in ``output_dir``.
+
+    With ``base_dir``, the file's path relative to it is mirrored so files
+    from different subdirectories cannot collide.
+    """
+    if base_dir:
+        return os.path.join(output_dir, os.path.relpath(input_file, base_dir))
+    return os.path.join(output_dir, os.path.basename(input_file))
+
+
+def prepare_output(
+    input_file: str, output_dir: Optional[str] = None, base_dir: Optional[str] = None
+) -> str:
+    """Return the file to rotate, cloning it into ``output_dir`` if given."""
+    if not output_dir:
+        return input_file
+    output_file = output_path(input_file, output_dir, base_dir)
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    clone_file(input_file, output_file)
+    return output_file
+
+
 def rotate_video(input_file: str, angle: int, output_dir: Optional[str] = None) -> None:
     """Rotate a video file by the specified angle."""
-    if output_dir:
-        os.makedirs(output_dir, exist_ok=True)
-        output_file = os.path.join(output_dir, os.path.basename(input_file))
-    else:
-        output_file = input_file
-
     try:
+        import exiftool  # type: ignore
+
+        output_file = prepare_output(input_file, output_dir)
         with exiftool.ExifToolHelper() as et:
-            et.execute(f"-Rotation={angle}", "-overwrite_original", input_file)
-        logger.info(f"Successfully rotated video: {input_file} by {angle} degrees.")
+            et.execute(f"-Rotation={angle}", "-overwrite_original", output_file)
+        logger.debug(f"Successfully rotated video: {input_file} by {angle} degrees.")
     except Exception as e:
         logger.error(f"Failed to rotate video: {input_file}. Error: {str(e)}")
         raise
@@ -100,7 +184,7 @@ def preview_rotations(video_files: List[str], angle: int) -> None:
                     "-i",
                     video_file,
                     "-vf",
-                    f"rotate={angle}*PI/180",
+                    transpose_filter(angle) or "null",
                     "-frames:v",
                     "1",
                     temp_frame,
@@ -109,9 +193,9 @@ def preview_rotations(video_files: List[str], angle: int) -> None:
                 capture_output=True,
             )
 
-            # Display the preview (this will depend on your system, adjust as needed)
-            # For example, on macOS:
-            subprocess.run(["open", temp_frame], check=True)
+            # Display the preview with the platform's default image viewer
+            opener = "open" if sys.platform == "darwin" else "xdg-open"
+            subprocess.run([opener, temp_frame], check=True)
 
             logger.info(f"Generated preview for: {video_file}")
             input("Press Enter to continue to the next video...")
@@ -0,0 +1,361 @@
+"""Watch an inbox directory and rotate videos as soon as they finish landing.
+
+New files are reported by inotify on Linux (through ctypes, no extra
+dependency) or by polling the directory elsewhere. A file is held until its
+size and mtime stop changing for ``settle`` seconds; ready files are then
+micro-batched, so a burst of arrivals costs one ExifTool call, and handed
+to a long-lived worker pool whose engines stay warm between batches.
+"""
+
+import collections
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Deque, Dict, List, Optional, Tuple
+
+from . import engines, metrics, pool, video_utils
+from .logger import logger
+from .result import RotationResult
+
+# inotify(7) event masks and inotify_init1 flags.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+_EVENT = struct.Struct("iIII")
+_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+# How often the loop wakes up to check pending files and finished batches.
+TICK_SECONDS = 0.05
+DEFAULT_SETTLE_SECONDS = 0.5
+DEFAULT_BATCH_WINDOW = 0.25
+DEFAULT_MAX_BATCH = 64
+# Latencies kept for the rolling percentiles.
+LATENCY_WINDOW = 1000
+# Post-rotation stats remembered, to ignore the events of our own writes.
+REMEMBERED_WRITES = 10000
+
+
+def is_candidate(path: str) -> bool:
+    name = os.path.basename(path)
+    return (
+        name.lower().endswith(video_utils.VIDEO_EXTENSIONS)
+        and ".rtb-tmp" not in name
+        and not name.startswith(".")
+    )
+
+
+class InotifyWatcher:
+    """Report files created, closed after writing or moved into a directory."""
+
+    def __init__(self, directory: str):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.directory = directory
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        watch = libc.inotify_add_watch(self._fd, os.fsencode(directory), _WATCH_MASK)
+        if watch < 0:
+            os.close(self._fd)
+            raise OSError(ctypes.get_errno(), f"Cannot watch {directory}")
+
+    def poll(self, timeout: float) -> List[str]:
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self._fd, 1 << 16)
+        except BlockingIOError:
+            return []
+        paths = []
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            _, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if name:
+                paths.append(os.path.join(self.directory, os.fsdecode(name)))
+        return paths
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """Fallback watcher that rescans the directory every ``interval`` seconds."""
+
+    def __init__(self, directory: str, interval: float = 1.0):
+        self.directory = directory
+        self.interval = interval
+        self._seen: Dict[str, Tuple[int, int]] = {}
+        self._next = 0.0
+
+    def poll(self, timeout: float) -> List[str]:
+        now = time.monotonic()
+        if now < self._next:
+            time.sleep(min(timeout, self._next - now))
+            return []
+        self._next = now + self.interval
+        changed = []
+        current = {}
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    current[entry.path] = (st.st_size, st.st_mtime_ns)
+                    if self._seen.get(entry.path) != current[entry.path]:
+                        changed.append(entry.path)
+        except OSError as e:
+            logger.warning(f"Cannot scan {self.directory}: {str(e)}")
+        self._seen = current
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+def open_watcher(directory: str, polling: bool = False, interval: float = 1.0):
+    if not polling:
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError) as e:
+            logger.warning(f"inotify unavailable ({str(e)}), polling instead.")
+    return PollingWatcher(directory, interval)
+
+
+@dataclass
+class _Pending:
+    arrived: float
+    changed: float
+    size: int = -1
+    mtime_ns: int = -1
+
+
+class Debouncer:
+    """Hold files until their size and mtime stay put for ``settle`` seconds."""
+
+    def __init__(self, settle: float):
+        self.settle = settle
+        self.pending: Dict[str, _Pending] = {}
+
+    def touch(self, path: str, now: float) -> None:
+        entry = self.pending.get(path)
+        if entry is None:
+            self.pending[path] = _Pending(now, now)
+        else:
+            entry.changed = now
+
+    def ready(self, now: float) -> List[Tuple[str, float, os.stat_result]]:
+        """Pop the settled files with their arrival time and final stat."""
+        settled = []
+        for path, entry in list(self.pending.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self.pending[path]  # moved away or deleted before settling
+                continue
+            if (st.st_size, st.st_mtime_ns) != (entry.size, entry.mtime_ns):
+                entry.size, entry.mtime_ns = st.st_size, st.st_mtime_ns
+                entry.changed = now
+            elif now - entry.changed >= self.settle:
+                del self.pending[path]
+                settled.append((path, entry.arrived, st))
+        return settled
+
+
+@dataclass
+class WatchStats:
+    """Counters and rolling latencies of a watch session."""
+
+    arrived: int = 0
+    rotated: int = 0
+    skipped: int = 0
+    failed: int = 0
+    batches: int = 0
+    depth: int = 0
+    lag: float = 0.0
+    latencies: Deque[float] = field(
+        default_factory=lambda: collections.deque(maxlen=LATENCY_WINDOW)
+    )
+
+    def as_dict(self) -> Dict:
+        ordered = sorted(self.latencies)
+        return {
+            "arrived": self.arrived,
+            "rotated": self.rotated,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "queue_depth": self.depth,
+            "lag_s": self.lag,
+            "latency_p50_s": metrics.percentile(ordered, 50),
+            "latency_p95_s": metrics.percentile(ordered, 95),
+            "latency_p99_s": metrics.percentile(ordered, 99),
+        }
+
+
+def write_stats(path: str, stats: Dict) -> None:
+    """Replace ``path`` atomically, so readers never see a partial file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(suffix=".json", dir=directory)
+    with os.fdopen(fd, "w") as f:
+        json.dump(stats, f)
+    os.replace(tmp, path)
+
+
+class InboxWatcher:
+    """Rotate every video that lands in ``directory`` until stopped."""
+
+    def __init__(
+        self,
+        directory: str,
+        angle: int,
+        jobs: int,
+        engine: str = "auto",
+        settle: float = DEFAULT_SETTLE_SECONDS,
+        batch_window: float = DEFAULT_BATCH_WINDOW,
+        max_batch: int = DEFAULT_MAX_BATCH,
+        polling: bool = False,
+        poll_interval: float = 1.0,
+        stats_file: Optional[str] = None,
+        stats_interval: float = 10.0,
+    ):
+        self.directory = directory
+        self.angle = angle
+        self.jobs = max(1, jobs)
+        self.engine = engine
+        self.batch_window = batch_window
+        self.max_batch = max(1, max_batch)
+        self.polling = polling
+        self.poll_interval = poll_interval
+        self.stats_file = stats_file
+        self.stats_interval = stats_interval
+        self.stats = WatchStats()
+        self.stop = threading.Event()
+        self._debouncer = Debouncer(settle)
+        self._ready: Deque[Tuple[str, float, float]] = collections.deque()
+        self._inflight: List[Tuple[Future, Dict[str, float]]] = []
+        self._written: "collections.OrderedDict[str, Tuple[int, int]]" = (
+            collections.OrderedDict()
+        )
+
+    def _ours(self, path: str, st: os.stat_result) -> bool:
+        return self._written.get(path) == (st.st_size, st.st_mtime_ns)
+
+    def _remember(self, result: RotationResult) -> None:
+        try:
+            st = os.stat(result.path)
+        except OSError:
+            return
+        self._written[result.path] = (st.st_size, st.st_mtime_ns)
+        self._written.move_to_end(result.path)
+        while len(self._written) > REMEMBERED_WRITES:
+            self._written.popitem(last=False)
+
+    def _submit(self, workers: pool.WorkerPool, now: float) -> None:
+        # Flush a batch when it is full or its oldest file waited long enough.
+        while self._ready and len(self._inflight) < self.jobs * 2:
+            if len(self._ready) < self.max_batch:
+                if now - self._ready[0][2] < self.batch_window:
+                    return
+            count = min(self.max_batch, len(self._ready))
+            batch = [self._ready.popleft() for _ in range(count)]
+            arrivals = {path: arrived for path, arrived, _ in batch}
+            future = workers.submit(list(arrivals), self.angle)
+            self._inflight.append((future, arrivals))
+            self.stats.batches += 1
+
+    def _harvest(self) -> None:
+        now = time.monotonic()
+        running = []
+        for future, arrivals in self._inflight:
+            if not future.done():
+                running.append((future, arrivals))
+                continue
+            for result in future.result():
+                self.stats.latencies.append(now - arrivals[result.path])
+                if not result.ok:
+                    self.stats.failed += 1
+                elif result.skipped:
+                    # Already at the angle, or left alone on purpose (e.g.
+                    # containers that would need a re-encode).
+                    self.stats.skipped += 1
+                    if result.skip_reason:
+                        logger.info(f"Skipped {result.path}: {result.skip_reason}.")
+                else:
+                    self.stats.rotated += 1
+                    self._remember(result)
+        self._inflight = running
+
+    def _update_stats(self, now: float) -> None:
+        arrivals = [e.arrived for e in self._debouncer.pending.values()]
+        arrivals += [arrived for _, arrived, _ in self._ready]
+        for _, batch in self._inflight:
+            arrivals += batch.values()
+        self.stats.depth = len(arrivals)
+        self.stats.lag = now - min(arrivals) if arrivals else 0.0
+
+    def _report(self) -> None:
+        stats = self.stats.as_dict()
+        logger.info(
+            f"Watch: {stats['rotated']} rotated, {stats['skipped']} skipped, "
+            f"{stats['failed']} failed, "
+            f"queue depth {stats['queue_depth']}, lag {stats['lag_s']:.2f}s, "
+            f"p95 latency {stats['latency_p95_s']:.2f}s"
+        )
+        if self.stats_file:
+            write_stats(self.stats_file, stats)
+
+    def run(self) -> WatchStats:
+        """Watch until ``stop`` is set; return the final stats."""
+        factory = partial(engines.create_engine, self.engine)
+        watcher = open_watcher(self.directory, self.polling, self.poll_interval)
+        try:
+            with pool.WorkerPool(self.jobs, factory, mode="absolute") as workers:
+                # Files already waiting in the inbox are picked up first.
+                now = time.monotonic()
+                for path in video_utils.iter_video_files(self.directory):
+                    if not is_candidate(path):
+                        continue
+                    self._debouncer.touch(path, now)
+                    self.stats.arrived += 1
+                next_report = now + self.stats_interval
+                while not self.stop.is_set() or self._inflight:
+                    for path in watcher.poll(TICK_SECONDS):
+                        if is_candidate(path):
+                            if path not in self._debouncer.pending:
+                                self.stats.arrived += 1
+                            self._debouncer.touch(path, time.monotonic())
+                    now = time.monotonic()
+                    for path, arrived, st in self._debouncer.ready(now):
+                        if self._ours(path, st):
+                            self.stats.arrived -= 1
+                            continue
+                        self._ready.append((path, arrived, now))
+                    if self.stop.is_set():
+                        self._ready.clear()  # only finish what is running
+                    self._submit(workers, now)
+                    self._harvest()
+                    self._update_stats(now)
+                    if now >= next_report:
+                        self._report()
+                        next_report = now + self.stats_interval
+        finally:
+            watcher.close()
+        self._report()
+        return self.stats
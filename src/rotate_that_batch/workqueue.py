@@ -0,0 +1,241 @@
+"""Shared work queue for multi-process runs.
+
+``WorkQueue`` keeps one row per file in a SQLite database that every worker
+process opens, possibly from several hosts over a shared volume. Workers
+claim files under a lease; a lease that expires (its worker died) makes the
+file claimable again. Each claim counts as an attempt, and a file that
+fails or loses its lease ``max_attempts`` times is dead-lettered.
+
+One worker at a time holds the scan lease and feeds the queue from its
+directory scan, so the tree is only walked once. Paths are stored relative
+to the scanned directory, so hosts may mount the share at different paths.
+"""
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .logger import logger
+from .result import RotationResult
+from .sharding import DEFAULT_LEASE_SECONDS, DEFAULT_MAX_ATTEMPTS
+
+CLAIM_FILES = 32
+ADD_FILES = 512
+POLL_SECONDS = 1.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    path TEXT PRIMARY KEY,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    expires REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state);
+CREATE TABLE IF NOT EXISTS scan (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    owner TEXT,
+    expires REAL,
+    done INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkQueue:
+    """Lease-based file queue shared by worker processes through SQLite."""
+
+    def __init__(
+        self,
+        path: str,
+        directory: str,
+        owner: Optional[str] = None,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    ):
+        self.path = path
+        self.directory = directory
+        self.owner = owner or worker_id()
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max(1, max_attempts)
+        self._lock = threading.Lock()
+        # Manual transactions; rollback journal, as WAL needs shared memory
+        # that network file systems cannot provide.
+        self._db = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=DELETE")
+        self._db.executescript(_SCHEMA)
+        self._db.execute("INSERT OR IGNORE INTO scan (id, done) VALUES (0, 0)")
+
+    def __enter__(self) -> "WorkQueue":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _transaction(self, work):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(self._db)
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+            return result
+
+    def _relative(self, path: str) -> str:
+        return os.path.relpath(path, self.directory)
+
+    def add(self, files: Iterable[str]) -> None:
+        rows = [(self._relative(path),) for path in files]
+        if rows:
+            self._transaction(
+                lambda db: db.executemany(
+                    "INSERT OR IGNORE INTO tasks (path) VALUES (?)", rows
+                )
+            )
+
+    def _take_scan(self) -> bool:
+        """Take or renew the scan lease; False if the scan is done or taken."""
+
+        def take(db) -> bool:
+            now = time.time()
+            owner, expires, done = db.execute(
+                "SELECT owner, expires, done FROM scan WHERE id = 0"
+            ).fetchone()
+            if done or (owner not in (None, self.owner) and expires > now):
+                return False
+            db.execute(
+                "UPDATE scan SET owner = ?, expires = ? WHERE id = 0",
+                (self.owner, now + self.lease_seconds),
+            )
+            return True
+
+        return self._transaction(take)
+
+    def _finish_scan(self) -> None:
+        self._transaction(
+            lambda db: db.execute("UPDATE scan SET done = 1, owner = NULL WHERE id = 0")
+        )
+
+    def claim(self, limit: int = CLAIM_FILES) -> List[str]:
+        """Lease up to ``limit`` files and return their local paths."""
+
+        def claim(db) -> List[str]:
+            now = time.time()
+            db.execute(
+                "UPDATE tasks SET state = 'dead', owner = NULL, "
+                "error = 'Lease expired on the last attempt' "
+                "WHERE state = 'leased' AND expires < ? AND attempts >= ?",
+                (now, self.max_attempts),
+            )
+            paths = [
+                row[0]
+                for row in db.execute(
+                    "SELECT path FROM tasks WHERE state = 'pending' "
+                    "OR (state = 'leased' AND expires < ?) LIMIT ?",
+                    (now, limit),
+                )
+            ]
+            db.executemany(
+                "UPDATE tasks SET state = 'leased', owner = ?, expires = ?, "
+                "attempts = attempts + 1 WHERE path = ?",
+                [(self.owner, now + self.lease_seconds, path) for path in paths],
+            )
+            return paths
+
+        return [os.path.join(self.directory, path) for path in self._transaction(claim)]
+
+    def complete(self, results: Iterable[RotationResult]) -> None:
+        """Mark files done, or back to pending (or dead) if they failed."""
+        done, failed = [], []
+        for result in results:
+            if result.ok:
+                done.append((self._relative(result.path),))
+            else:
+                failed.append((result.error, self._relative(result.path)))
+
+        def complete(db) -> None:
+            db.executemany(
+                "UPDATE tasks SET state = 'done', owner = NULL, error = NULL "
+                "WHERE path = ?",
+                done,
+            )
+            db.executemany(
+                "UPDATE tasks SET owner = NULL, error = ?, state = CASE "
+                f"WHEN attempts >= {self.max_attempts} THEN 'dead' "
+                "ELSE 'pending' END WHERE path = ?",
+                failed,
+            )
+            # Still working: keep the remaining leases alive.
+            db.execute(
+                "UPDATE tasks SET expires = ? WHERE owner = ? AND state = 'leased'",
+                (time.time() + self.lease_seconds, self.owner),
+            )
+
+        self._transaction(complete)
+
+    def counts(self) -> Dict[str, int]:
+        """Number of files in each state."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT state, COUNT(*) FROM tasks GROUP BY state"
+            ).fetchall()
+        counts = {"pending": 0, "leased": 0, "done": 0, "dead": 0}
+        counts.update(rows)
+        return counts
+
+    def dead(self) -> List[Tuple[str, int, Optional[str]]]:
+        """Dead-lettered files with their attempt count and last error."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT path, attempts, error FROM tasks WHERE state = 'dead' "
+                "ORDER BY path"
+            ).fetchall()
+        return [(os.path.join(self.directory, p), a, e) for p, a, e in rows]
+
+    def _scan_done(self) -> bool:
+        with self._lock:
+            return bool(
+                self._db.execute("SELECT done FROM scan WHERE id = 0").fetchone()[0]
+            )
+
+    def files(self, scan: Iterable[str]) -> Iterator[str]:
+        """Yield files claimed from the queue until every file is settled.
+
+        While this worker holds the scan lease it also feeds ``scan`` into
+        the queue, a batch at a time between claims. Results must be passed
+        to ``complete`` as they land, so failed files can be retried here.
+        """
+        scan_iter = iter(scan)
+        while True:
+            # Taking the scan lease again renews it while this worker scans.
+            if not self._scan_done() and self._take_scan():
+                batch = list(islice(scan_iter, ADD_FILES))
+                self.add(batch)
+                if len(batch) < ADD_FILES:
+                    self._finish_scan()
+                    logger.info("Finished feeding the work queue.")
+            claimed = self.claim()
+            if claimed:
+                yield from claimed
+                continue
+            counts = self.counts()
+            if self._scan_done() and not counts["pending"] and not counts["leased"]:
+                return
+            # Wait for other workers' leases to settle or expire.
+            time.sleep(POLL_SECONDS)
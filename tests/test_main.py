@@ -1,14 +1,48 @@
 import asyncio
 import configparser
+import itertools
+import json
 import os
+import struct
+import subprocess
+import sys
 import tempfile
+import threading
+import time
 from asyncio import TimeoutError
 
 import pytest
 from textual.pilot import Pilot
 from typer.testing import CliRunner
 
-from rotate_that_batch import config, video_utils
+from benchmarks import bench, fixtures
+from rotate_that_batch import (
+    aio,
+    config,
+    dedup,
+    devices,
+    engines,
+    fastcopy,
+    index,
+    journal,
+    manifest,
+    metrics,
+    mkv,
+    mp4,
+    plan,
+    pool,
+    preview,
+    rotate_many,
+    scan,
+    sharding,
+    sidecar,
+    tools,
+    transcode,
+    verification,
+    video_utils,
+    watch,
+    workqueue,
+)
 from rotate_that_batch.cli import app
 from rotate_that_batch.logger import logger
 from rotate_that_batch.main import RotateThatBatchApp
@@ -16,26 +50,47 @@ from rotate_that_batch.main import RotateThatBatchApp
 runner = CliRunner()
 
 
-def test_main_with_directory(mocker):
+@pytest.fixture(autouse=True)
+def isolated_config(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "CONFIG_FILE", str(tmp_path / "config.ini"))
+    monkeypatch.setattr(index, "INDEX_FILE", str(tmp_path / "index.sqlite"))
+    monkeypatch.setattr(tools, "CACHE_FILE", str(tmp_path / "tools.json"))
+    monkeypatch.setattr(journal, "JOURNAL_DIR", str(tmp_path / "runs"))
+
+
+@pytest.fixture
+def mock_engine(mocker):
+    create_engine = mocker.patch("rotate_that_batch.engines.create_engine")
+    engine = create_engine.return_value
+    engine.rotate_batch.side_effect = lambda files, angle: [
+        engines.RotationResult(f, angle, "exiftool") for f in files
+    ]
+    engine.read_rotations.return_value = {}
+    engine.rewrites_pixels.return_value = False
+    return engine
+
+
+def test_main_with_directory(mocker, mock_engine):
     mock_check_ffmpeg = mocker.patch("rotate_that_batch.video_utils.check_ffmpeg")
     mock_get_video_files = mocker.patch(
-        "rotate_that_batch.video_utils.get_video_files",
+        "rotate_that_batch.video_utils.iter_video_files",
         return_value=["video1.mp4", "video2.mp4"],
     )
-    mock_rotate_video = mocker.patch("rotate_that_batch.video_utils.rotate_video")
 
     result = runner.invoke(app, ["--directory", "/test/dir", "--angle", "180"])
 
     assert result.exit_code == 0
     assert "Rotation complete!" in result.stdout
-    mock_check_ffmpeg.assert_called_once()
-    mock_get_video_files.assert_called_once_with("/test/dir")
-    assert mock_rotate_video.call_count == 2
+    mock_check_ffmpeg.assert_not_called()
+    assert mock_get_video_files.call_args.args == ("/test/dir",)
+    rotated = sum((c.args[0] for c in mock_engine.rotate_batch.call_args_list), [])
+    assert sorted(rotated) == ["video1.mp4", "video2.mp4"]
+    assert {c.args[1] for c in mock_engine.rotate_batch.call_args_list} == {180}
 
 
 def test_main_no_videos(mocker):
     mocker.patch("rotate_that_batch.video_utils.check_ffmpeg")
-    mocker.patch("rotate_that_batch.video_utils.get_video_files", return_value=[])
+    mocker.patch("rotate_that_batch.video_utils.iter_video_files", return_value=[])
 
     result = runner.invoke(app, ["--directory", "/empty/dir"])
 
@@ -43,19 +98,18 @@ def test_main_no_videos(mocker):
     assert "No video files found" in result.stdout
 
 
-def test_main_directory_selection(mocker):
+def test_main_directory_selection(mocker, mock_engine):
     mock_get_video_files = mocker.patch(
-        "rotate_that_batch.video_utils.get_video_files", return_value=["video1.mp4"]
+        "rotate_that_batch.video_utils.iter_video_files", return_value=["video1.mp4"]
     )
-    mock_rotate_video = mocker.patch("rotate_that_batch.video_utils.rotate_video")
     mock_check_ffmpeg = mocker.patch("rotate_that_batch.video_utils.check_ffmpeg")
 
     result = runner.invoke(app, ["--directory", "dir1"])
 
     assert result.exit_code == 0
-    mock_check_ffmpeg.assert_called_once()
-    mock_get_video_files.assert_called_once_with("dir1")
-    mock_rotate_video.assert_called()
+    mock_check_ffmpeg.assert_not_called()
+    assert mock_get_video_files.call_args.args == ("dir1",)
+    mock_engine.rotate_batch.assert_called()
     assert "Rotation complete!" in result.stdout
 
 
@@ -79,22 +133,87 @@ async def test_rotate_that_batch_app():
 
         # Click preview button
         await pilot.click("#preview")
+        await pilot.app.workers.wait_for_complete()
         status_text = pilot.app.query_one("#status_text")
-        assert status_text.renderable.plain == "Previewing rotation..."
+        assert status_text.renderable.plain.startswith("No video files found")
 
         # Click rotate button
         await pilot.click("#rotate")
-        assert status_text.renderable.plain == "Rotating videos..."
+        await pilot.app.workers.wait_for_complete()
+        assert status_text.renderable.plain.startswith("No video files found")
+
+
+@pytest.mark.asyncio
+async def test_app_rotates_in_background_with_progress(tmp_path):
+    for name in ["a.mp4", "b.mov"]:
+        _make_mp4(str(tmp_path / name))
+    (tmp_path / "broken.mp4").write_bytes(b"not an mp4")
+
+    app = RotateThatBatchApp()
+    async with app.run_test() as pilot:
+        pilot.app.query_one("#input").value = str(tmp_path)
+        pilot.app.query_one("#angle").value = 270
+        await pilot.click("#rotate")
+        await pilot.app.workers.wait_for_complete()
+
+        status = pilot.app.query_one("#status_text").renderable.plain
+        assert status == "Rotation complete! 2 videos, 1 failed."
+        assert pilot.app.query_one("#progress").progress == 3
+        assert "3/3 files" in str(pilot.app.query_one("#throughput").renderable)
+        assert pilot.app.query_one("#failures").row_count == 1
+    assert mp4.read_rotation(str(tmp_path / "a.mp4")) == 270
+    assert mp4.read_rotation(str(tmp_path / "b.mov")) == 270
 
 
-def test_list_directories():
+def test_list_directories(monkeypatch):
     with tempfile.TemporaryDirectory() as tmpdir:
         os.mkdir(os.path.join(tmpdir, "test_dir"))
-        os.chdir(tmpdir)
+        monkeypatch.chdir(tmpdir)
         dirs = video_utils.list_directories()
         assert "test_dir" in dirs
 
 
+def test_iter_video_files_recursive_with_globs_and_symlinks(tmp_path):
+    (tmp_path / "a" / "b").mkdir(parents=True)
+    (tmp_path / "skip").mkdir()
+    for name in ["top.mp4", "a/one.MOV", "a/b/two.mkv", "a/b/raw.txt", "skip/x.mp4"]:
+        (tmp_path / name).write_bytes(b"")
+    (tmp_path / "a" / "link.mp4").symlink_to(tmp_path / "top.mp4")
+    (tmp_path / "a" / "b" / "loop").symlink_to(tmp_path / "a")
+
+    def scan(**kwargs):
+        found = video_utils.iter_video_files(str(tmp_path), **kwargs)
+        return sorted(os.path.relpath(p, tmp_path) for p in found)
+
+    assert scan() == ["top.mp4"]
+    assert scan(recursive=True, exclude=["skip"]) == [
+        "a/b/two.mkv",
+        "a/link.mp4",
+        "a/one.MOV",
+        "top.mp4",
+    ]
+    assert scan(recursive=True, symlinks="skip", include=["*.mov"]) == []
+    assert scan(recursive=True, symlinks="skip", include=["one.*"]) == ["a/one.MOV"]
+    followed = scan(recursive=True, symlinks="follow", exclude=["skip"])
+    assert "a/one.MOV" in followed and "a/b/loop/one.MOV" not in followed
+
+
+def test_background_scan_streams_through_bounded_queue():
+    produced = []
+
+    def files():
+        for i in range(100):
+            produced.append(i)
+            yield f"clip{i}.mp4"
+
+    with scan.BackgroundScan(files(), maxsize=4) as scanner:
+        first = next(scanner.batches(8))
+        assert first and len(produced) < 100
+        rest = [p for batch in scanner.batches(8) for p in batch]
+    assert first + rest == [f"clip{i}.mp4" for i in range(100)]
+    assert scanner.done and scanner.count == 100
+
+
 def test_get_video_files():
     with tempfile.TemporaryDirectory() as tmpdir:
         open(os.path.join(tmpdir, "test.mp4"), "w").close()
@@ -111,28 +230,23 @@ def test_rotate_video(mocker):
     mock_exiftool.return_value.__enter__.return_value.execute.assert_called_once()
 
 
-def test_main_cli_with_directory(mocker):
+def test_main_cli_with_directory(mocker, mock_engine):
     mocker.patch("rotate_that_batch.video_utils.check_ffmpeg")
     mocker.patch(
-        "rotate_that_batch.video_utils.get_video_files",
+        "rotate_that_batch.video_utils.iter_video_files",
         return_value=["/path/to/video.mp4"],
     )
-    mock_rotate_video = mocker.patch("rotate_that_batch.video_utils.rotate_video")
 
     result = runner.invoke(app, ["--directory", "/test/dir", "--angle", "180"])
     assert result.exit_code == 0
     assert "Rotation complete!" in result.stdout
-    mock_rotate_video.assert_called_once()
+    mock_engine.rotate_batch.assert_called_once()
 
 
 # New tests
 
 
-def test_config_file_system(mocker):
-    mock_open = mocker.patch("builtins.open", mocker.mock_open())
-    mocker.patch("os.path.exists", return_value=True)
-    mocker.patch("configparser.ConfigParser.read")
-
+def test_config_file_system():
     # Test loading config
     loaded_config = config.load_config()
     assert isinstance(loaded_config, configparser.ConfigParser)
@@ -143,7 +257,38 @@ def test_config_file_system(mocker):
 
     # Test setting config value
     config.set_config_value("default_angle", "180")
-    mock_open.assert_called_with(config.CONFIG_FILE, "w")
+    assert config.get_config_value("default_angle") == "180"
+    leftovers = os.listdir(os.path.dirname(config.CONFIG_FILE))
+    assert not [name for name in leftovers if name.startswith(".rotate_that_batch.")]
+
+
+def test_config_store_flushes_only_dirty_keys(mocker):
+    first = config.ConfigStore()
+    second = config.ConfigStore()
+    first.set("default_angle", 180)
+    first.set("default_directory", "/videos")
+    second.set("output_directory", "/out")
+    save = mocker.spy(config, "save_config")
+
+    assert first.flush()
+    assert second.flush()
+    assert not first.flush()  # nothing changed since
+    assert save.call_count == 2
+
+    # Concurrent stores merge their own keys instead of clobbering each other.
+    stored = config.load_config()["DEFAULT"]
+    assert stored["default_angle"] == "180"
+    assert stored["default_directory"] == "/videos"
+    assert stored["output_directory"] == "/out"
+
+
+def test_config_store_read_only_never_writes():
+    store = config.ConfigStore(read_only=True)
+    store.set("default_angle", 270)
+
+    assert store.get("default_angle") == "270"
+    assert not store.flush()
+    assert not os.path.exists(config.CONFIG_FILE)
 
 
 def test_preview_functionality(mocker):
@@ -163,7 +308,7 @@ def test_main_with_preview(mocker):
     mocker.patch("rotate_that_batch.video_utils.check_ffmpeg")
     mock_preview = mocker.patch("rotate_that_batch.video_utils.preview_rotations")
     mocker.patch(
-        "rotate_that_batch.video_utils.get_video_files",
+        "rotate_that_batch.video_utils.iter_video_files",
         return_value=["/path/to/video.mp4"],
     )
 
@@ -175,20 +320,39 @@ def test_main_with_preview(mocker):
     mock_preview.assert_called_once()
 
 
-def test_main_with_output_directory(mocker):
+def test_main_with_output_directory(mocker, mock_engine, tmp_path):
     mocker.patch("rotate_that_batch.video_utils.check_ffmpeg")
-    mock_rotate_video = mocker.patch("rotate_that_batch.video_utils.rotate_video")
+    source = tmp_path / "video.mp4"
+    source.write_bytes(b"video data")
     mocker.patch(
-        "rotate_that_batch.video_utils.get_video_files",
-        return_value=["/path/to/video.mp4"],
+        "rotate_that_batch.video_utils.iter_video_files",
+        return_value=[str(source)],
     )
+    output_dir = tmp_path / "output"
 
     result = runner.invoke(
-        app, ["--directory", "/test/dir", "--angle", "180", "--output", "/output/dir"]
+        app,
+        ["--directory", str(tmp_path), "--angle", "180", "--output", str(output_dir)],
     )
     assert result.exit_code == 0
     assert "Rotation complete" in result.stdout
-    mock_rotate_video.assert_called_once_with("/path/to/video.mp4", 180, "/output/dir")
+    clone = str(output_dir / "video.mp4")
+    mock_engine.rotate_batch.assert_called_once_with([clone], 180)
+    assert (output_dir / "video.mp4").read_bytes() == b"video data"
+
+
+def test_recursive_scan_skips_output_directory(mocker, mock_engine, tmp_path):
+    mocker.patch("rotate_that_batch.video_utils.check_ffmpeg")
+    (tmp_path / "a.mp4").write_bytes(b"video data")
+    (tmp_path / "out").mkdir()
+    (tmp_path / "out" / "a.mp4").write_bytes(b"previous output")
+    args = ["--directory", str(tmp_path), "--recursive", "--no-index"]
+
+    result = runner.invoke(app, args + ["--output", str(tmp_path / "out")])
+
+    assert result.exit_code == 0
+    mock_engine.rotate_batch.assert_called_once_with([str(tmp_path / "out/a.mp4")], 90)
+    assert not (tmp_path / "out" / "out").exists()
 
 
 def test_main_with_invalid_angle(mocker):
@@ -197,6 +361,60 @@ def test_main_with_invalid_angle(mocker):
     assert "Invalid angle" in result.stdout
 
 
+def test_tool_probe_is_cached_by_binary_identity(tmp_path, monkeypatch, mocker):
+    _fake_tool(tmp_path, "ffmpeg", "print('ffmpeg version 6.1')\n")
+    monkeypatch.setenv("PATH", str(tmp_path))
+    run = mocker.spy(subprocess, "run")
+
+    assert tools.probe("ffmpeg") == "ffmpeg version 6.1"
+    assert tools.probe("ffmpeg") == "ffmpeg version 6.1"
+    assert run.call_count == 1
+
+    _fake_tool(tmp_path, "ffmpeg", "print('ffmpeg version 7.0 upgraded')\n")
+    assert tools.probe("ffmpeg") == "ffmpeg version 7.0 upgraded"
+    assert run.call_count == 2
+    assert tools.probe("exiftool") is None
+
+
+def test_main_probes_only_tools_the_engine_needs(mocker, mock_engine):
+    check_ffmpeg = mocker.patch("rotate_that_batch.video_utils.check_ffmpeg")
+    probe = mocker.patch("rotate_that_batch.tools.probe", return_value=None)
+    mocker.patch(
+        "rotate_that_batch.video_utils.iter_video_files", return_value=["a.mp4"]
+    )
+
+    assert runner.invoke(app, ["--engine", "native", "--no-index"]).exit_code == 0
+    check_ffmpeg.assert_not_called()
+    probe.assert_not_called()
+
+    result = runner.invoke(app, ["--engine", "exiftool", "--no-index"])
+    assert result.exit_code == 1
+    assert "exiftool is required" in result.stdout
+    probe.assert_called_once_with("exiftool")
+
+    runner.invoke(app, ["--engine", "remux", "--no-index"])
+    check_ffmpeg.assert_called_once()
+
+
+def test_main_import_time_reports_lazy_modules(tmp_path):
+    # A fresh interpreter: this test module has imported everything already.
+    command = [sys.executable, "-m", "rotate_that_batch.cli", "--import-time"]
+    env = dict(os.environ, HOME=str(tmp_path))
+    env["PYTHONPATH"] = os.pathsep.join(
+        [
+            os.path.join(os.path.dirname(__file__), "..", "src"),
+            env.get("PYTHONPATH", ""),
+        ]
+    )
+
+    result = subprocess.run(command, env=env, capture_output=True, text=True)
+
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    assert report["startup_ms"] > 0 and report["modules"] > 0
+    assert report["lazy_loaded"] == []
+
+
 def test_check_ffmpeg_not_installed(mocker):
     mocker.patch("subprocess.run", side_effect=FileNotFoundError)
     mock_exit = mocker.patch("sys.exit")
@@ -206,3 +424,1437 @@ def test_check_ffmpeg_not_installed(mocker):
 
     mock_input.assert_called_once()
     mock_exit.assert_called_once_with(1)
+
+
+def test_chunk_files_respects_limits():
+    files = [f"/videos/clip{i}.mp4" for i in range(10)]
+    assert [len(c) for c in engines.chunk_files(files, max_files=4)] == [4, 4, 2]
+    chunks = list(engines.chunk_files(files, max_files=100, max_bytes=45))
+    assert all(len(c) == 2 for c in chunks)
+    assert sum(chunks, []) == files
+
+
+def test_exiftool_engine_reports_per_file_results(mocker):
+    mock_exiftool = mocker.patch("exiftool.ExifToolHelper")
+    et = mock_exiftool.return_value
+    et.last_stderr = (
+        "=rtb=0=0=\nError: Not a valid MOV - /v/bad.mov\n=rtb=1=1=\n=rtb=2=0="
+    )
+
+    with engines.ExifToolEngine() as engine:
+        results = engine.rotate_batch(["/v/a.mp4", "/v/bad.mov", "/v/c.mp4"], 90)
+
+    mock_exiftool.assert_called_once()
+    et.execute.assert_called_once()
+    params = et.execute.call_args.args
+    assert params.count("-execute") == 2
+    assert [r.ok for r in results] == [True, False, True]
+    assert "Not a valid MOV" in results[1].error
+    et.terminate.assert_called_once()
+
+
+def test_exiftool_engine_restarts_after_failed_chunk(mocker):
+    mock_exiftool = mocker.patch("exiftool.ExifToolHelper")
+    et = mock_exiftool.return_value
+    et.execute.side_effect = [BrokenPipeError("exiftool died"), None]
+    et.last_stderr = "=rtb=0=0=\n=rtb=1=0="
+
+    engine = engines.ExifToolEngine(max_files=2)
+    results = engine.rotate_batch(["/v/a.mp4", "/v/b.mp4", "/v/c.mp4", "/v/d.mp4"], 90)
+    engine.close()
+
+    assert [r.ok for r in results] == [False, False, True, True]
+    assert mock_exiftool.call_count == 2
+
+
+def test_main_with_jobs_collects_failures(mocker, mock_engine):
+    mocker.patch("rotate_that_batch.video_utils.check_ffmpeg")
+    videos = [f"/path/to/video{i}.mp4" for i in range(20)]
+    mocker.patch("rotate_that_batch.video_utils.iter_video_files", return_value=videos)
+    mock_engine.rotate_batch.side_effect = lambda files, angle: [
+        engines.RotationResult(f, angle, "exiftool", "boom" if "video3." in f else None)
+        for f in files
+    ]
+
+    result = runner.invoke(app, ["--directory", "/test/dir", "--jobs", "4"])
+
+    assert result.exit_code == 1
+    assert "Processed 19 videos" in result.stdout
+    assert "1 videos failed" in result.stdout
+    rotated = sum(
+        (call.args[0] for call in mock_engine.rotate_batch.call_args_list), []
+    )
+    assert sorted(rotated) == sorted(videos)
+
+
+def test_worker_pool_gives_each_worker_its_own_engine(mocker):
+    created = []
+
+    def factory():
+        engine = mocker.Mock()
+        engine.rotate_batch.side_effect = lambda files, angle: [
+            engines.RotationResult(f, angle, "mock") for f in files
+        ]
+        created.append(engine)
+        return engine
+
+    files = [f"clip{i}.mp4" for i in range(50)]
+    results = sum(pool.rotate_parallel(files, 90, 3, factory, chunk_size=2), [])
+
+    assert sorted(r.path for r in results) == sorted(files)
+    assert 1 <= len(created) <= 3
+    for engine in created:
+        engine.close.assert_called_once()
+
+
+def _box(box_type, payload, large=False):
+    if large:
+        return struct.pack(">I4sQ", 1, box_type, len(payload) + 16) + payload
+    return struct.pack(">I4s", len(payload) + 8, box_type) + payload
+
+
+def _make_mp4(path, moov_at_end=False, tkhd_version=0, large_mdat=False):
+    times = b"\0" * (32 if tkhd_version == 1 else 20)
+    identity = struct.pack(">9i", 1 << 16, 0, 0, 0, 1 << 16, 0, 0, 0, 1 << 30)
+    tkhd = _box(
+        b"tkhd",
+        bytes([tkhd_version, 0, 0, 3]) + times + b"\0" * 16 + identity + b"\0" * 8,
+    )
+    hdlr = _box(b"hdlr", b"\0" * 8 + b"vide" + b"\0" * 13)
+    trak = _box(b"trak", tkhd + _box(b"mdia", hdlr))
+    moov = _box(b"moov", _box(b"mvhd", b"\0" * 100) + trak)
+    mdat = _box(b"mdat", b"\x42" * 4096, large=large_mdat)
+    ftyp = _box(b"ftyp", b"isom\0\0\0\0isom")
+    body = ftyp + (mdat + moov if moov_at_end else moov + mdat)
+    with open(path, "wb") as f:
+        f.write(body)
+    return body
+
+
+@pytest.mark.parametrize(
+    "moov_at_end, tkhd_version, large_mdat",
+    [(False, 0, False), (True, 0, True), (True, 1, False)],
+)
+def test_native_rotation_patches_matrix_in_place(
+    tmp_path, moov_at_end, tkhd_version, large_mdat
+):
+    path = str(tmp_path / "clip.mp4")
+    original = _make_mp4(path, moov_at_end, tkhd_version, large_mdat)
+    assert mp4.read_rotation(path) == 0
+
+    assert mp4.set_rotation(path, 90) == mp4.MATRIX_SIZE
+    assert mp4.read_rotation(path) == 90
+    with open(path, "rb") as f:
+        patched = f.read()
+    assert len(patched) == len(original)
+    changed = [i for i, (a, b) in enumerate(zip(original, patched)) if a != b]
+    assert changed[-1] - changed[0] < mp4.MATRIX_SIZE
+
+    assert mp4.set_rotation(path, 90) == 0
+    mp4.set_rotation(path, 270)
+    assert mp4.read_rotation(path) == 270
+
+
+def test_auto_engine_falls_back_to_exiftool(tmp_path, mocker):
+    native_file = str(tmp_path / "clip.mov")
+    _make_mp4(native_file)
+    other_file = str(tmp_path / "clip.3gp")
+    broken_file = str(tmp_path / "broken.mp4")
+    for path in (other_file, broken_file):
+        with open(path, "wb") as f:
+            f.write(b"not an mp4 at all")
+    fallback = mocker.patch.object(
+        engines.ExifToolEngine,
+        "rotate_batch",
+        side_effect=lambda files, angle: [
+            engines.RotationResult(f, angle, "exiftool") for f in files
+        ],
+    )
+
+    results = engines.AutoEngine().rotate_batch(
+        [native_file, other_file, broken_file], 180
+    )
+
+    fallback.assert_called_once()
+    assert sorted(fallback.call_args.args[0]) == sorted([other_file, broken_file])
+    assert {r.path: r.engine for r in results} == {
+        native_file: "native",
+        other_file: "exiftool",
+        broken_file: "exiftool",
+    }
+    assert mp4.read_rotation(native_file) == 180
+
+
+@pytest.mark.parametrize("method", [m for m, _ in fastcopy.METHODS])
+def test_clone_file_methods(tmp_path, method):
+    src = tmp_path / "src.mp4"
+    src.write_bytes(os.urandom(300_000))
+    dst = tmp_path / "dst.mp4"
+    try:
+        used = fastcopy.clone_file(str(src), str(dst), method=method)
+    except OSError:
+        pytest.skip(f"{method} is not supported on this filesystem")
+    assert used == method
+    assert dst.read_bytes() == src.read_bytes()
+    assert not os.path.exists(f"{dst}.rtb-tmp")
+
+
+def test_rotate_video_with_output_leaves_source_untouched(mocker, tmp_path):
+    mock_exiftool = mocker.patch("exiftool.ExifToolHelper")
+    source = tmp_path / "video1.mp4"
+    source.write_bytes(b"original")
+
+    video_utils.rotate_video(str(source), 90, str(tmp_path / "out"))
+
+    clone = str(tmp_path / "out" / "video1.mp4")
+    mock_exiftool.return_value.__enter__.return_value.execute.assert_called_once_with(
+        "-Rotation=90", "-overwrite_original", clone
+    )
+    assert source.read_bytes() == b"original"
+
+
+def test_rotation_index_skips_unchanged_files(tmp_path, mocker, mock_engine):
+    mocker.patch("rotate_that_batch.video_utils.check_ffmpeg")
+    videos = tmp_path / "videos"
+    videos.mkdir()
+    for name in ["a.mp4", "b.mp4"]:
+        (videos / name).write_bytes(b"data")
+    args = ["--directory", str(videos), "--angle", "90"]
+
+    assert runner.invoke(app, args).exit_code == 0
+    assert mock_engine.rotate_batch.call_count >= 1
+
+    mock_engine.rotate_batch.reset_mock()
+    result = runner.invoke(app, args)
+    assert result.exit_code == 0
+    assert "Skipped 2 videos" in result.stdout
+    mock_engine.rotate_batch.assert_not_called()
+
+    (videos / "b.mp4").write_bytes(b"changed")
+    runner.invoke(app, args + ["--angle", "180"])
+    rotated = sum((c.args[0] for c in mock_engine.rotate_batch.call_args_list), [])
+    assert sorted(os.path.basename(p) for p in rotated) == ["a.mp4", "b.mp4"]
+
+    mock_engine.rotate_batch.reset_mock()
+    runner.invoke(app, args + ["--angle", "180", "--rebuild-index"])
+    rotated = sum((c.args[0] for c in mock_engine.rotate_batch.call_args_list), [])
+    assert len(rotated) == 2
+
+
+def test_plan_absolute_and_relative_modes(tmp_path):
+    paths = []
+    for i, angle in enumerate([0, 90, 270]):
+        path = str(tmp_path / f"clip{i}.mp4")
+        _make_mp4(path)
+        mp4.set_rotation(path, angle)
+        paths.append(path)
+    engine = engines.NativeEngine()
+
+    absolute = plan.plan_batch(engine, paths, 90, "absolute")
+    assert [(e.current, e.target, e.needed) for e in absolute] == [
+        (0, 90, True),
+        (90, 90, False),
+        (270, 90, True),
+    ]
+    relative = plan.plan_batch(engine, paths, 90, "relative")
+    assert [e.target for e in relative] == [90, 180, 0]
+    assert plan.group_by_target(relative) == {
+        90: [paths[0]],
+        180: [paths[1]],
+        0: [paths[2]],
+    }
+
+
+def test_exiftool_rotations_are_read_from_grouped_tags(mocker):
+    mock_exiftool = mocker.patch("exiftool.ExifToolHelper")
+    mock_exiftool.return_value.execute.return_value = json.dumps(
+        [
+            {"SourceFile": "/v/a.mov", "QuickTime:Rotation": 90},
+            {"SourceFile": "/v/b.mkv"},
+        ]
+    )
+    engine = engines.ExifToolEngine()
+
+    current = engine.read_rotations(["/v/a.mov", "/v/b.mkv"])
+    entries = plan.plan_batch(engine, ["/v/a.mov", "/v/b.mkv"], 90, "relative")
+    engine.close()
+
+    assert current == {"/v/a.mov": 90, "/v/b.mkv": None}
+    assert [(e.target, e.needed) for e in entries] == [(180, True), (None, False)]
+    assert entries[1].error == "Current rotation is unknown"
+
+
+def test_main_plan_json_then_rotate_only_needed(tmp_path, mocker):
+    mocker.patch("rotate_that_batch.video_utils.check_ffmpeg")
+    videos = tmp_path / "videos"
+    videos.mkdir()
+    for name, angle in [("a.mp4", 90), ("b.mov", 0)]:
+        _make_mp4(str(videos / name))
+        mp4.set_rotation(str(videos / name), angle)
+    plan_file = tmp_path / "plan.json"
+    args = ["--directory", str(videos), "--angle", "90", "--engine", "native"]
+
+    result = runner.invoke(app, args + ["--plan-json", str(plan_file)])
+    assert result.exit_code == 0
+    document = json.loads(plan_file.read_text())
+    assert document["summary"] == {"files": 2, "rotate": 1, "skip": 1, "unknown": 0}
+    assert mp4.read_rotation(str(videos / "b.mov")) == 0
+
+    result = runner.invoke(app, args)
+    assert result.exit_code == 0
+    assert "Processed 1 videos" in result.stdout
+    assert "1 videos were already at the target rotation" in result.stdout
+    assert mp4.read_rotation(str(videos / "b.mov")) == 90
+
+    result = runner.invoke(app, args + ["--mode", "relative"])
+    assert mp4.read_rotation(str(videos / "a.mp4")) == 180
+
+
+def test_main_writes_metrics_and_json_log(tmp_path):
+    videos = tmp_path / "videos"
+    videos.mkdir()
+    for name in ["a.mp4", "b.mov", "c.mp4"]:
+        _make_mp4(str(videos / name))
+    metrics_file = tmp_path / "metrics.jsonl"
+    log_file = tmp_path / "log.jsonl"
+    args = ["--directory", str(videos), "--engine", "native", "--no-index"]
+    args += ["--metrics-file", str(metrics_file), "--log-json", str(log_file)]
+
+    result = runner.invoke(app, args + ["--log-level", "debug"])
+
+    assert result.exit_code == 0
+    *entries, summary = [json.loads(line) for line in metrics_file.open()]
+    assert sorted(os.path.basename(e["path"]) for e in entries) == [
+        "a.mp4",
+        "b.mov",
+        "c.mp4",
+    ]
+    for entry in entries:
+        assert entry["engine"] == "native" and entry["ok"]
+        assert entry["bytes_written"] == mp4.MATRIX_SIZE
+        assert {"scan_s", "plan_s", "write_s"} <= set(entry)
+    summary = summary["summary"]
+    assert summary["files"] == 3 and summary["failed"] == 0
+    assert summary["bytes_written"] == 3 * mp4.MATRIX_SIZE
+    latency = summary["latency"]["write_s"]
+    assert latency["p50"] <= latency["p95"] <= latency["p99"]
+
+    records = [json.loads(line) for line in log_file.open()]
+    assert {"time", "level", "thread", "message"} <= set(records[0])
+    assert any(r["level"] == "debug" for r in records)
+
+    runner.invoke(app, args + ["--log-level", "warning"])
+    appended = log_file.read_text().splitlines()[len(records) :]
+    assert not [line for line in appended if json.loads(line)["level"] == "info"]
+
+
+def test_main_resume_continues_an_interrupted_run(tmp_path):
+    videos = tmp_path / "videos"
+    videos.mkdir()
+    paths = {}
+    for name in "abcde":
+        paths[name] = str(videos / f"{name}.mp4")
+        _make_mp4(paths[name])
+    settings = {
+        "cwd": os.getcwd(),
+        "directory": str(videos),
+        "angle": 90,
+        "mode": "absolute",
+        "engine": "native",
+        "output": None,
+        "recursive": False,
+        "include": [],
+        "exclude": [],
+        "symlinks": "files",
+    }
+    # The run found a-d, wrote a, was writing b and re-encoding c, then died.
+    crashed = journal.RunJournal.create(settings)
+    list(crashed.scanned([paths[n] for n in "abcd"], complete=False))
+    crashed.intend([(paths["a"], 90, False), (paths["b"], 90, False)])
+    crashed.intend([(paths["c"], 90, True)])
+    crashed.done([engines.RotationResult(paths["a"], 90, "native")])
+    crashed.close(finished=False)
+
+    result = runner.invoke(app, ["--resume", crashed.run_id, "--no-index"])
+
+    assert result.exit_code == 1
+    assert "check it manually" in result.stdout
+    rotations = {name: mp4.read_rotation(path) for name, path in paths.items()}
+    assert rotations == {"a": 0, "b": 90, "c": 0, "d": 90, "e": 90}
+    # c needs a manual check, not a retry: the run finished without failures.
+    assert not os.path.exists(crashed.path)
+
+    result = runner.invoke(app, ["--resume", crashed.run_id])
+    assert result.exit_code == 1
+    assert "No journal" in result.stdout
+
+
+def test_main_resume_retries_the_failed_files_of_a_finished_run(tmp_path):
+    good, bad = str(tmp_path / "good.mp4"), str(tmp_path / "bad.mp4")
+    _make_mp4(good)
+    with open(bad, "wb") as f:
+        f.write(b"not a video")
+    args = ["--directory", str(tmp_path), "--engine", "native", "--no-index"]
+
+    result = runner.invoke(app, args)
+
+    assert result.exit_code == 1
+    [run_id] = [n[: -len(".jsonl")] for n in os.listdir(journal.JOURNAL_DIR)]
+    assert f"--resume {run_id}" in result.stdout
+    state = journal.load(run_id)
+    assert state.finished and state.failed == {bad}
+    assert state.unstarted() == [bad] and not state.interrupted()
+
+    _make_mp4(bad)
+    result = runner.invoke(app, ["--resume", run_id, "--no-index"])
+
+    assert result.exit_code == 0
+    assert "Processed 1 videos" in result.stdout
+    assert mp4.read_rotation(bad) == 90 and mp4.read_rotation(good) == 90
+    assert not os.listdir(journal.JOURNAL_DIR)
+
+
+def test_journal_ignores_a_torn_last_record(tmp_path):
+    run = journal.RunJournal.create({"directory": "."})
+    list(run.scanned(["a.mp4", "b.mp4"]))
+    run.close(finished=False)
+    with open(run.path, "a") as f:
+        f.write('{"op": "done", "pa')
+
+    state = journal.load(run.run_id)
+
+    assert state.scanned == ["a.mp4", "b.mp4"] and state.scan_complete
+    assert not state.done and not state.finished
+    assert state.unstarted() == ["a.mp4", "b.mp4"]
+    with pytest.raises(journal.JournalError):
+        journal.load("no-such-run")
+
+
+def test_metrics_percentiles_use_nearest_rank():
+    ordered = [float(i) for i in range(1, 101)]
+    assert metrics.percentile(ordered, 50) == 50.0
+    assert metrics.percentile(ordered, 99) == 99.0
+    assert metrics.percentile([3.0], 95) == 3.0
+    assert metrics.percentile([], 50) == 0.0
+
+
+def test_contact_sheets_use_fast_seek_transpose_and_cache(tmp_path, mocker):
+    def fake_ffmpeg(command, **kwargs):
+        with open(command[-1], "wb") as f:
+            f.write(b"jpeg")
+
+    mock_run = mocker.patch("subprocess.run", side_effect=fake_ffmpeg)
+    videos = []
+    for i in range(3):
+        video = tmp_path / f"clip{i}.mp4"
+        video.write_bytes(b"video")
+        videos.append(str(video))
+    cache_dir = str(tmp_path / "cache")
+    sheets_dir = str(tmp_path / "sheets")
+
+    sheets = preview.build_contact_sheets(
+        videos, 90, sheets_dir, jobs=3, columns=2, rows=1, cache_dir=cache_dir
+    )
+
+    assert len(sheets) == 2
+    extract_calls = [c.args[0] for c in mock_run.call_args_list if "-ss" in c.args[0]]
+    assert len(extract_calls) == 6
+    for command in extract_calls:
+        assert command.index("-ss") < command.index("-i")
+    assert any("transpose=clock" in " ".join(c) for c in extract_calls)
+    with open(os.path.join(sheets_dir, "contact_sheets.json")) as f:
+        assert json.load(f) == {
+            "sheet_001.jpg": videos[:2],
+            "sheet_002.jpg": videos[2:],
+        }
+
+    mock_run.reset_mock()
+    preview.build_contact_sheets(videos, 90, sheets_dir, cache_dir=cache_dir)
+    assert all("-ss" not in c.args[0] for c in mock_run.call_args_list)
+    assert preview.transpose_filter(270) == "transpose=cclock"
+
+
+def test_core_budget_splits_cores_between_encodes():
+    budget = transcode.CoreBudget(cores=8, max_threads=16)
+    assert budget.acquire() == 8
+    budget.release(8)
+
+    budget.expect(8)
+    grants = [budget.acquire() for _ in range(8)]
+    assert grants == [1] * 8
+    for threads in grants:
+        budget.release(threads)
+
+    budget.expect(2)
+    assert [budget.acquire(), budget.acquire()] == [4, 4]
+
+
+def test_worker_pool_shares_cores_between_concurrent_encodes(tmp_path, mocker):
+    def fake_ffmpeg(command):
+        time.sleep(0.05)
+        open(command[-1], "wb").close()
+        return {}
+
+    mocker.patch("rotate_that_batch.transcode.run_ffmpeg", side_effect=fake_ffmpeg)
+    files = []
+    for i in range(8):
+        (tmp_path / f"clip{i}.avi").write_bytes(b"avi data")
+        files.append(str(tmp_path / f"clip{i}.avi"))
+    budget = transcode.CoreBudget(cores=8)
+
+    with pool.WorkerPool(
+        4, lambda: transcode.ReencodeEngine(budget), budget=budget
+    ) as workers:
+        results = [r for chunk in workers.rotate(files, 90, 1) for r in chunk]
+
+    threads = sorted(r.metrics["threads"] for r in results)
+    assert all(r.ok for r in results)
+    assert threads[:4] == [2, 2, 2, 2]
+    assert budget.free == 8
+
+
+def test_auto_engine_reencodes_containers_without_rotation_metadata(tmp_path, mocker):
+    source = tmp_path / "clip.avi"
+    source.write_bytes(b"avi data")
+
+    def fake_ffmpeg(command):
+        with open(command[-1], "wb") as f:
+            f.write(b"rotated avi")
+        return {"frames": 250.0, "seconds": 2.0, "fps": 125.0, "speed": 5.0}
+
+    mock_run = mocker.patch(
+        "rotate_that_batch.transcode.run_ffmpeg", side_effect=fake_ffmpeg
+    )
+    exiftool_batch = mocker.patch.object(engines.ExifToolEngine, "rotate_batch")
+
+    engine = engines.AutoEngine()
+    engine.reencode.budget = transcode.CoreBudget(cores=4)
+    [result] = engine.rotate_batch([str(source)], 270)
+
+    assert result.ok and result.engine == "reencode"
+    assert result.metrics["fps"] == 125.0 and result.metrics["threads"] == 4
+    assert result.metrics["bytes_read"] == len(b"avi data")
+    assert result.metrics["bytes_written"] == len(b"rotated avi")
+    command = mock_run.call_args.args[0]
+    assert "transpose=cclock" in command
+    assert command[command.index("-threads") + 1] == "4"
+    assert source.read_bytes() == b"rotated avi"
+    assert not os.path.exists(transcode.temp_output(str(source)))
+    exiftool_batch.assert_not_called()
+    assert engine.read_rotations([str(source)]) == {str(source): 0}
+
+    absolute = plan.plan_batch(engine, [str(source)], 90, "absolute")
+    relative = plan.plan_batch(engine, [str(source)], 90, "relative")
+    assert absolute[0].skip == plan.PIXELS_ABSOLUTE_SKIP and not absolute[0].needed
+    assert (relative[0].target, relative[0].needed) == (90, True)
+
+
+def test_main_default_run_skips_containers_that_need_a_reencode(tmp_path, mocker):
+    mocker.patch("rotate_that_batch.video_utils.check_ffmpeg")
+    run_ffmpeg = mocker.patch("rotate_that_batch.transcode.run_ffmpeg")
+    source = tmp_path / "clip.avi"
+    source.write_bytes(b"avi data")
+    _make_mp4(str(tmp_path / "clip.mp4"))
+
+    result = runner.invoke(app, ["--directory", str(tmp_path), "--no-index"])
+
+    assert result.exit_code == 0
+    assert "Processed 1 videos" in result.stdout
+    assert "Skipped 1 videos: no rotation metadata" in result.stdout
+    assert "videos failed" not in result.stdout
+    run_ffmpeg.assert_not_called()
+    assert source.read_bytes() == b"avi data"
+
+
+def test_auto_engine_remuxes_matroska_display_rotation(tmp_path, mocker):
+    source = tmp_path / "clip.mkv"
+    source.write_bytes(b"mkv data")
+
+    def fake_ffmpeg(command):
+        with open(command[-1], "wb") as f:
+            f.write(b"remuxed mkv")
+        return {"seconds": 0.5}
+
+    mock_run = mocker.patch(
+        "rotate_that_batch.transcode.run_ffmpeg", side_effect=fake_ffmpeg
+    )
+    probe = mocker.patch("subprocess.run")
+    probe.return_value.stdout = json.dumps(
+        {"streams": [{"side_data_list": [{"rotation": -90}]}]}
+    ).encode()
+    exiftool_batch = mocker.patch.object(engines.ExifToolEngine, "rotate_batch")
+
+    engine = engines.AutoEngine()
+    assert engine.read_rotations([str(source)]) == {str(source): 90}
+    [result] = engine.rotate_batch([str(source)], 90)
+
+    assert result.ok and result.engine == "remux"
+    assert result.metrics["bytes_written"] == len(b"mkv data")
+    command = mock_run.call_args.args[0]
+    assert command[command.index("-display_rotation:v:0") + 1] == "270"
+    assert command.index("-display_rotation:v:0") < command.index("-i")
+    assert command[command.index("-c") + 1] == "copy"
+    assert source.read_bytes() == b"remuxed mkv"
+    assert not os.path.exists(transcode.temp_output(str(source)))
+    exiftool_batch.assert_not_called()
+
+
+def test_remux_failure_leaves_source_untouched(tmp_path, mocker):
+    source = tmp_path / "clip.mkv"
+    source.write_bytes(b"mkv data")
+
+    def failing_ffmpeg(command):
+        with open(command[-1], "wb") as f:
+            f.write(b"partial")
+        raise subprocess.CalledProcessError(1, command, stderr="Invalid data")
+
+    mocker.patch("rotate_that_batch.transcode.run_ffmpeg", side_effect=failing_ffmpeg)
+
+    [result] = transcode.RemuxEngine().rotate_batch([str(source)], 180)
+
+    assert not result.ok and result.error == "Invalid data"
+    assert source.read_bytes() == b"mkv data"
+    assert not os.path.exists(transcode.temp_output(str(source)))
+
+
+def _fake_tool(directory, name, body):
+    script = directory / name
+    script.write_text(f"#!{sys.executable}\nimport sys, time\n{body}")
+    script.chmod(0o755)
+
+
+class FakeExifTool:
+    """Stand-in for ``exiftool.ExifToolHelper`` that fails paths named bad."""
+
+    started = 0
+
+    def __init__(self, **kwargs):
+        FakeExifTool.started += 1
+        self.last_stderr = ""
+
+    def execute(self, *params):
+        stderr = []
+        for index, param in enumerate(params):
+            if param == "-echo4":
+                marker, path = params[index + 1], params[index + 2]
+                status = int("bad" in path)
+                if status:
+                    stderr.append(f"Error: Not a valid file - {path}")
+                stderr.append(marker.replace("${status}", str(status)))
+        self.last_stderr = "\n".join(stderr)
+        return ""
+
+    def terminate(self):
+        pass
+
+
+async def test_async_engine_streams_exiftool_results(tmp_path, mocker):
+    FakeExifTool.started = 0
+    mocker.patch("exiftool.ExifToolHelper", FakeExifTool)
+    files = [str(tmp_path / name) for name in ["a.3gp", "bad.3gp", "c.3gp"]]
+    native = str(tmp_path / "clip.mp4")
+    _make_mp4(native)
+
+    engine = aio.AsyncEngine(jobs=2)
+    events = [event async for event in engine.rotate(files + [native], 90)]
+
+    assert [e.completed for e in events] == [1, 2, 3, 4]
+    assert events[-1].failed == 1 and events[-1].total == 4
+    results = {e.result.path: e.result for e in events}
+    assert "Not a valid file" in results[files[1]].error
+    assert results[files[0]].ok and results[native].engine == "native"
+    assert mp4.read_rotation(native) == 90
+    # One persistent ExifTool per worker, not one per chunk.
+    assert 1 <= FakeExifTool.started <= 2
+
+
+async def test_async_engine_streams_input_and_honours_manifest_angles(tmp_path):
+    native = str(tmp_path / "clip.mp4")
+    _make_mp4(native)
+    pulled = []
+
+    def jobs():
+        yield manifest.ManifestPath(native, 270)
+        for i in itertools.count():
+            pulled.append(i)
+            yield manifest.ManifestPath(str(tmp_path / f"missing{i}.mp4"), 270)
+
+    engine = aio.AsyncEngine(jobs=2, mode="absolute", engine="native")
+    events = engine.rotate(jobs(), 90)
+    seen = {}
+    async for event in events:
+        seen[event.result.path] = event.result
+        if native in seen:
+            break
+    await events.aclose()
+
+    assert seen[native].ok and mp4.read_rotation(native) == 270
+    assert event.total is None and event.eta is None
+    assert len(pulled) < 50 * engines.DEFAULT_CHUNK_FILES
+
+
+async def test_async_engine_cancel_kills_ffmpeg_and_keeps_source(tmp_path, monkeypatch):
+    _fake_tool(
+        tmp_path,
+        "ffmpeg",
+        "open(sys.argv[-1], 'wb').write(b'partial')\ntime.sleep(30)\n",
+    )
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    source = tmp_path / "clip.mkv"
+    source.write_bytes(b"mkv data")
+    engine = aio.AsyncEngine(jobs=1)
+
+    async def consume():
+        return [event async for event in engine.rotate([str(source)], 90)]
+
+    task = asyncio.create_task(consume())
+    temp = transcode.temp_output(str(source))
+    for _ in range(200):
+        if os.path.exists(temp):
+            break
+        await asyncio.sleep(0.02)
+    assert os.path.exists(temp)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert source.read_bytes() == b"mkv data"
+    assert not os.path.exists(temp)
+
+
+def test_main_async_engine_rotates_native_files(tmp_path, mocker):
+    mocker.patch("rotate_that_batch.video_utils.check_ffmpeg")
+    for name in ["a.mp4", "b.mov"]:
+        _make_mp4(str(tmp_path / name))
+    args = ["--directory", str(tmp_path), "--angle", "180", "--async"]
+
+    result = runner.invoke(app, args)
+
+    assert result.exit_code == 0
+    assert "Processed 2 videos" in result.stdout
+    assert mp4.read_rotation(str(tmp_path / "a.mp4")) == 180
+    assert mp4.read_rotation(str(tmp_path / "b.mov")) == 180
+
+
+@pytest.mark.parametrize("fmt, layout", [("mp4", "start"), ("mov", "end")])
+def test_benchmark_fixtures_are_sparse_rotatable_videos(tmp_path, fmt, layout):
+    size = fixtures.parse_size("5G")
+    (path,) = fixtures.make_fixtures(str(tmp_path), fmt, size, layout, 1)
+
+    assert os.path.getsize(path) == size
+    assert os.stat(path).st_blocks * 512 < 1 << 20  # the mdat is a hole
+    assert mp4.read_rotation(path) == 0
+    assert mp4.set_rotation(path, 90) == mp4.MATRIX_SIZE
+    assert mp4.read_rotation(path) == 90
+
+
+def test_benchmark_reports_throughput_regressions(tmp_path):
+    files = fixtures.make_fixtures(str(tmp_path), "mp4", 65536, "end", 4)
+    case = bench.run_case("native", files, jobs=2, repeat=2, size=65536)
+    assert case["failed"] == 0
+    assert case["bytes_written"] == 4 * mp4.MATRIX_SIZE
+
+    key = {"engine": "native", "format": "mp4", "size": "64K", "layout": "end"}
+    baseline = {"cases": [dict(key, jobs=2, files_per_sec=100.0)]}
+    current = {"cases": [dict(key, jobs=2, files_per_sec=85.0)]}
+    assert bench.regressions(baseline, current, threshold=0.1)
+    assert not bench.regressions(baseline, current, threshold=0.2)
+
+
+def test_shards_partition_files_deterministically(tmp_path):
+    files = [str(tmp_path / f"dir{i % 3}" / f"clip{i}.mp4") for i in range(60)]
+    shards = [list(sharding.shard_files(files, str(tmp_path), i, 3)) for i in (1, 2, 3)]
+
+    assert sorted(sum(shards, [])) == sorted(files)
+    assert all(shards)
+    # Another mount point of the same tree splits it the same way.
+    moved = [f.replace(str(tmp_path), "/mnt/share") for f in files]
+    assert len(list(sharding.shard_files(moved, "/mnt/share", 1, 3))) == len(shards[0])
+    with pytest.raises(ValueError):
+        sharding.parse_shard("4/3")
+    with pytest.raises(ValueError):
+        sharding.parse_shard("half")
+
+
+def test_work_queue_reclaims_expired_leases_then_dead_letters(tmp_path):
+    db = str(tmp_path / "queue.sqlite")
+    first = workqueue.WorkQueue(db, "/videos", "a", lease_seconds=0.05, max_attempts=2)
+    second = workqueue.WorkQueue(db, "/videos", "b", lease_seconds=60, max_attempts=2)
+    first.add(["/videos/x.mp4"])
+
+    assert first.claim() == ["/videos/x.mp4"]
+    assert second.claim() == []  # leased by the first worker
+    time.sleep(0.1)
+    assert second.claim() == ["/videos/x.mp4"]  # the first worker died
+
+    second.complete([engines.RotationResult("/videos/x.mp4", 90, "native", "boom")])
+    assert second.counts()["dead"] == 1
+    assert second.dead() == [("/videos/x.mp4", 2, "boom")]
+    first.close()
+    second.close()
+
+
+def test_main_queue_retries_then_dead_letters_failures(tmp_path):
+    videos = tmp_path / "videos"
+    videos.mkdir()
+    _make_mp4(str(videos / "good.mp4"))
+    (videos / "bad.mp4").write_bytes(b"not a video")
+    db = str(tmp_path / "queue.sqlite")
+    args = ["--directory", str(videos), "--engine", "native", "--no-index"]
+
+    result = runner.invoke(app, args + ["--queue", db, "--max-attempts", "2"])
+
+    assert result.exit_code == 1
+    assert "1 done, 1 dead-lettered" in result.stdout
+    assert "Processed 1 videos" in result.stdout
+    with workqueue.WorkQueue(db, str(videos)) as work:
+        [(path, attempts, error)] = work.dead()
+    assert path == str(videos / "bad.mp4") and attempts == 2 and error
+    assert mp4.read_rotation(str(videos / "good.mp4")) == 90
+
+
+def test_queue_workers_in_separate_processes_share_the_files(tmp_path):
+    videos = tmp_path / "videos"
+    videos.mkdir()
+    for i in range(40):
+        _make_mp4(str(videos / f"clip{i:02d}.mp4"))
+    db = str(tmp_path / "queue.sqlite")
+    command = [sys.executable, "-m", "rotate_that_batch.cli"]
+    command += ["--directory", str(videos), "--engine", "native", "--queue", db]
+    command += ["--no-index", "--no-save-config", "--jobs", "2"]
+    env = dict(os.environ, HOME=str(tmp_path), XDG_STATE_HOME=str(tmp_path))
+    env["PYTHONPATH"] = os.pathsep.join(
+        [
+            os.path.join(os.path.dirname(__file__), "..", "src"),
+            env.get("PYTHONPATH", ""),
+        ]
+    )
+
+    workers = [
+        subprocess.Popen(command, env=env, stdout=subprocess.PIPE, text=True)
+        for _ in range(3)
+    ]
+    outputs = [worker.communicate(timeout=120)[0] for worker in workers]
+
+    assert [worker.returncode for worker in workers] == [0, 0, 0], outputs
+    with workqueue.WorkQueue(db, str(videos)) as work:
+        assert work.counts() == {"pending": 0, "leased": 0, "done": 40, "dead": 0}
+        assert work._db.execute("SELECT MAX(attempts) FROM tasks").fetchone() == (1,)
+    assert {mp4.read_rotation(str(path)) for path in videos.iterdir()} == {90}
+
+
+def test_debouncer_waits_until_a_file_stops_growing(tmp_path):
+    path = str(tmp_path / "clip.mp4")
+    with open(path, "wb") as f:
+        f.write(b"x" * 10)
+    debouncer = watch.Debouncer(settle=1.0)
+    debouncer.touch(path, 0.0)
+
+    assert debouncer.ready(0.0) == []  # first stat
+    with open(path, "ab") as f:
+        f.write(b"x" * 10)
+    assert debouncer.ready(0.9) == []  # grew: the clock restarts
+    assert debouncer.ready(1.5) == []
+    [(ready, arrived, st)] = debouncer.ready(2.0)
+    assert (ready, arrived, st.st_size) == (path, 0.0, 20)
+    assert debouncer.pending == {}
+
+
+@pytest.mark.parametrize("polling", [False, True])
+def test_watch_rotates_arrivals_in_micro_batches(tmp_path, polling):
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    _make_mp4(str(inbox / "waiting.mp4"))
+    stats_file = str(tmp_path / "stats.json")
+    watcher = watch.InboxWatcher(
+        str(inbox),
+        90,
+        jobs=2,
+        engine="native",
+        settle=0.1,
+        batch_window=0.05,
+        polling=polling,
+        poll_interval=0.05,
+        stats_file=stats_file,
+        stats_interval=0.2,
+    )
+    runner_thread = threading.Thread(target=watcher.run)
+    runner_thread.start()
+    try:
+        for i in range(5):
+            # Land each file under a temporary name, as uploaders do.
+            _make_mp4(str(inbox / f".clip{i}.part"))
+            os.rename(inbox / f".clip{i}.part", inbox / f"clip{i}.mp4")
+        deadline = time.monotonic() + 20
+        while watcher.stats.rotated < 6 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        time.sleep(0.5)  # our own writes must not be picked up again
+    finally:
+        watcher.stop.set()
+        runner_thread.join(timeout=20)
+
+    assert not runner_thread.is_alive()
+    assert {mp4.read_rotation(str(path)) for path in inbox.iterdir()} == {90}
+    stats = json.load(open(stats_file))
+    assert stats["arrived"] == stats["rotated"] == 6 and stats["failed"] == 0
+    assert stats["queue_depth"] == 0 and stats["lag_s"] == 0
+    assert 1 <= stats["batches"] <= 6
+    assert 0 < stats["latency_p50_s"] <= stats["latency_p99_s"] < 10
+
+
+def test_watch_counts_skipped_files_apart_from_rotated_ones(tmp_path):
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    done = str(inbox / "done.mp4")
+    _make_mp4(done)
+    mp4.set_rotation(done, 90)
+    (inbox / "clip.avi").write_bytes(b"avi data")
+    watcher = watch.InboxWatcher(
+        str(inbox), 90, jobs=1, settle=0.05, batch_window=0.05, polling=True
+    )
+    runner_thread = threading.Thread(target=watcher.run)
+    runner_thread.start()
+    try:
+        deadline = time.monotonic() + 20
+        while watcher.stats.skipped < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        watcher.stop.set()
+        runner_thread.join(timeout=20)
+
+    stats = watcher.stats.as_dict()
+    assert (stats["rotated"], stats["skipped"], stats["failed"]) == (0, 2, 0)
+    assert (inbox / "clip.avi").read_bytes() == b"avi data"
+
+
+def test_manifest_reads_csv_and_json_lines_and_skips_invalid_lines(tmp_path):
+    csv_file = tmp_path / "angles.csv"
+    csv_file.write_text(
+        '\nangle,path\n90,a.mp4\n180,"b, c.mov"\n45,d.mp4\n,\n270,e.avi\n'
+    )
+    listing = manifest.Manifest(str(csv_file))
+    entries = list(listing)
+    assert entries == ["a.mp4", "b, c.mov", "e.avi"]
+    assert [entry.angle for entry in entries] == [90, 180, 270]
+    assert listing.invalid == 1
+
+    jsonl_file = tmp_path / "angles.jsonl"
+    jsonl_file.write_text('{"path": "a.mp4", "angle": 90}\nnot json\n')
+    listing = manifest.Manifest(str(jsonl_file))
+    assert [(e, e.angle) for e in listing] == [("a.mp4", 90)]
+    assert listing.invalid == 1
+
+
+def test_manifest_groups_chunks_by_angle_and_engine():
+    entries = [
+        manifest.ManifestPath(f"clip{i}.{ext}", angle)
+        for i, (ext, angle) in enumerate(
+            [("mp4", 90), ("avi", 90), ("mov", 90), ("mp4", 180), ("mp4", 90)]
+        )
+    ]
+    groups = list(manifest.group_chunks([entries[:4], entries[4:]], max_files=2))
+
+    # A full chunk goes out at once; partial ones when the input runs dry.
+    assert groups == [
+        (["clip0.mp4", "clip2.mov"], 90),
+        (["clip1.avi"], 90),
+        (["clip3.mp4"], 180),
+        (["clip4.mp4"], 90),
+    ]
+    # One engine call per angle and engine once the input runs dry.
+    assert sorted(
+        manifest.group_chunks([entries], max_files=8), key=lambda g: g[0]
+    ) == [
+        (["clip0.mp4", "clip2.mov", "clip4.mp4"], 90),
+        (["clip1.avi"], 90),
+        (["clip3.mp4"], 180),
+    ]
+
+
+def test_main_rotates_a_manifest_from_stdin_each_file_by_its_angle(tmp_path):
+    videos = tmp_path / "videos"
+    videos.mkdir()
+    angles = {"a.mp4": 90, "b.mov": 180, "c.mp4": 270, "d.mp4": 90}
+    for name in angles:
+        _make_mp4(str(videos / name))
+    lines = "".join(
+        json.dumps({"path": str(videos / name), "angle": angle}) + "\n"
+        for name, angle in angles.items()
+    )
+    args = ["--engine", "native", "--no-index", "--no-save-config"]
+
+    result = runner.invoke(app, args + ["--manifest", "-"], input=lines)
+
+    assert result.exit_code == 0, result.stdout
+    assert "Processed 4 videos" in result.stdout
+    for name, angle in angles.items():
+        assert mp4.read_rotation(str(videos / name)) == angle
+
+    bad = tmp_path / "bad.csv"
+    bad.write_text(f"{videos / 'a.mp4'},180\n{videos / 'b.mov'},12\n")
+    result = runner.invoke(app, args + ["--manifest", str(bad)])
+    assert result.exit_code == 1
+    assert "Skipped 1 invalid lines" in result.stdout
+    assert mp4.read_rotation(str(videos / "a.mp4")) == 180
+
+
+def test_device_scheduler_caps_spinning_disks_and_orders_by_size(tmp_path, monkeypatch):
+    monkeypatch.setattr(devices, "is_rotational", lambda device: True)
+    sizes = {"big.mp4": 300, "small.mp4": 10, "mid.mp4": 200, "tiny.mov": 5}
+    for name, size in sizes.items():
+        (tmp_path / name).write_bytes(b"x" * size)
+    files = [str(tmp_path / name) for name in sizes]
+    with devices.DeviceScheduler(files, 90, chunk_size=2, hdd_jobs=1) as scheduler:
+        while not scheduler._fed:  # let the feeder stat every file first
+            time.sleep(0.01)
+        [first] = scheduler.take(room=4)
+        assert scheduler.take(room=4) == []  # the disk is at its limit
+        scheduler.release(first)
+        [second] = scheduler.take(room=4)
+        scheduler.release(second)
+        assert scheduler.exhausted
+
+    assert [os.path.basename(p) for p in first.paths + second.paths] == [
+        "tiny.mov",
+        "small.mp4",
+        "mid.mp4",
+        "big.mp4",
+    ]
+    [stats] = scheduler.devices.values()
+    assert (stats.kind, stats.limit, stats.files, stats.bytes) == ("hdd", 1, 4, 515)
+    assert stats.mount and stats.busy_s > 0
+
+
+def test_main_schedule_reports_per_device_throughput(tmp_path):
+    videos = tmp_path / "videos"
+    videos.mkdir()
+    for i in range(6):
+        _make_mp4(str(videos / f"clip{i}.mp4"))
+    args = ["--directory", str(videos), "--engine", "native", "--no-index"]
+
+    result = runner.invoke(app, args + ["--schedule", "--order", "inode"])
+
+    assert result.exit_code == 0, result.stdout
+    assert "Per-device throughput" in result.stdout
+    assert "Processed 6 videos" in result.stdout
+    assert {mp4.read_rotation(str(path)) for path in videos.iterdir()} == {90}
+    assert runner.invoke(app, args + ["--order", "name"]).exit_code == 1
+
+
+def test_verification_reads_headers_and_compares_media_fingerprints(tmp_path):
+    path = str(tmp_path / "clip.mp4")
+    body = _make_mp4(path, moov_at_end=True)
+    engine = engines.NativeEngine()
+    before = verification.fingerprints([path])
+    mp4.set_rotation(path, 90)
+
+    good = [engines.RotationResult(path, 90, "native")]
+    verification.verify_results(engine, good, before)
+    assert good[0].ok and good[0].fingerprint == before[path][0]
+    assert good[0].metrics["verify_s"] >= 0
+
+    wrong = [engines.RotationResult(path, 180, "native")]
+    verification.verify_results(engine, wrong, before)
+    assert wrong[0].error.endswith("rotation is 90, expected 180")
+
+    with open(path, "r+b") as f:
+        f.seek(body.index(b"\x42" * 16) + 100)
+        f.write(b"\0")
+    corrupt = [engines.RotationResult(path, 90, "native")]
+    verification.verify_results(engine, corrupt, before)
+    assert corrupt[0].error.endswith("media data changed during the write")
+
+
+def _ebml(element_id, payload=b"", unknown=False):
+    size = (1 << 56) - 1 if unknown else len(payload)
+    head = element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+    return head + (size | 1 << 56).to_bytes(8, "big") + payload
+
+
+MKV_FRAMES = [bytes([i]) * 5000 for i in range(10)]
+
+
+def _make_mkv(path, roll=None, frames=MKV_FRAMES, live=False):
+    """A Matroska file with one video and one audio track.
+
+    ``live`` lays it out as a streaming muxer would, with unknown sizes,
+    other timecodes and one cluster per frame, as a remux may.
+    """
+    projection = b""
+    if roll is not None:
+        pose = _ebml(mkv.PROJECTION_POSE_ROLL, struct.pack(">f", roll))
+        projection = _ebml(mkv.PROJECTION, pose)
+    video = _ebml(mkv.PIXEL_WIDTH, b"\x07\x80") + _ebml(mkv.PIXEL_HEIGHT, b"\x04\x38")
+    audio = _ebml(mkv.SAMPLING_FREQUENCY, struct.pack(">d", 48000))
+    audio += _ebml(mkv.CHANNELS, b"\x02")
+    tracks = _ebml(
+        mkv.TRACKS,
+        _ebml(
+            mkv.TRACK_ENTRY,
+            _ebml(mkv.TRACK_NUMBER, b"\x01")
+            + _ebml(mkv.TRACK_TYPE, b"\x01")
+            + _ebml(mkv.CODEC_ID, b"V_MPEG4/ISO/AVC")
+            + _ebml(mkv.VIDEO, video + projection),
+        )
+        + _ebml(
+            mkv.TRACK_ENTRY,
+            _ebml(mkv.TRACK_NUMBER, b"\x02")
+            + _ebml(mkv.TRACK_TYPE, b"\x02")
+            + _ebml(mkv.CODEC_ID, b"A_AAC")
+            + _ebml(mkv.AUDIO, audio),
+        ),
+    )
+    blocks = [
+        _ebml(mkv.SIMPLE_BLOCK, b"\x81" + struct.pack(">h", i + live) + b"\x80" + data)
+        + _ebml(mkv.SIMPLE_BLOCK, b"\x82" + struct.pack(">h", i) + b"\x80" + b"aac")
+        for i, data in enumerate(frames)
+    ]
+    if live:
+        clusters = b"".join(_ebml(mkv.CLUSTER, block, unknown=True) for block in blocks)
+        segment = _ebml(mkv.SEGMENT, tracks + clusters, unknown=True)
+    else:
+        segment = _ebml(mkv.SEGMENT, tracks + _ebml(mkv.CLUSTER, b"".join(blocks)))
+    header = _ebml(mkv.EBML, _ebml(mkv.DOC_TYPE, b"matroska"))
+    with open(path, "wb") as f:
+        f.write(header + segment)
+
+
+def test_matroska_reader_reads_rotation_and_stream_fingerprint(tmp_path, mocker):
+    path = str(tmp_path / "clip.mkv")
+    remuxed = str(tmp_path / "remuxed.mkv")
+    _make_mkv(path)
+    _make_mkv(remuxed, roll=-90.0, live=True)
+    probe = mocker.patch("subprocess.run")
+
+    assert mkv.read_rotation(path) == 0
+    rotations = transcode.RemuxEngine().read_rotations([path, remuxed])
+    assert rotations == {path: 0, remuxed: 90}
+    probe.assert_not_called()
+
+    # A remux keeps the streams, not the bytes around them.
+    before, is_media = verification.fingerprint(path)
+    assert is_media and verification.fingerprint(remuxed)[0] == before
+    frames = MKV_FRAMES[:3] + [b"\0" + MKV_FRAMES[3][1:]] + MKV_FRAMES[4:]
+    _make_mkv(remuxed, roll=-90.0, frames=frames, live=True)
+    assert verification.fingerprint(remuxed)[0] != before
+
+    broken = tmp_path / "broken.mkv"
+    broken.write_bytes(b"mkv data")
+    with pytest.raises(mkv.UnsupportedContainer):
+        mkv.read_rotation(str(broken))
+    assert not verification.fingerprint(str(broken))[1]
+
+
+def test_verification_catches_a_remux_that_damaged_the_streams(tmp_path, mocker):
+    path = str(tmp_path / "clip.mkv")
+    frames = [MKV_FRAMES]
+
+    def fake_ffmpeg(command):
+        # -display_rotation and ProjectionPoseRoll both turn counter-clockwise.
+        roll = float(command[command.index("-display_rotation:v:0") + 1])
+        _make_mkv(command[-1], roll=roll, frames=frames[0], live=True)
+        return {"seconds": 0.5}
+
+    mocker.patch("rotate_that_batch.transcode.run_ffmpeg", side_effect=fake_ffmpeg)
+    probe = mocker.patch("subprocess.run")
+    engine = engines.AutoEngine()
+
+    _make_mkv(path)
+    before = verification.fingerprints([path])
+    good = engine.rotate_batch([path], 90)
+    verification.verify_results(engine, good, before)
+    assert good[0].ok, good[0].error
+
+    _make_mkv(path)
+    frames[0] = MKV_FRAMES[:5]  # frames lost in the copy
+    damaged = engine.rotate_batch([path], 90)
+    verification.verify_results(engine, damaged, before)
+    assert damaged[0].error.endswith("media data changed during the write")
+    probe.assert_not_called()
+
+
+def test_fingerprint_samples_large_files(tmp_path):
+    path = tmp_path / "clip.avi"
+    size = 64 * verification.SAMPLES * verification.SAMPLE_BYTES
+    path.write_bytes(b"\0" * size)
+    digest, is_mdat = verification.fingerprint(str(path))
+    assert not is_mdat
+
+    with open(path, "r+b") as f:
+        f.seek(size - 1)  # the last sample ends at the last byte
+        f.write(b"\1")
+    assert verification.fingerprint(str(path))[0] != digest
+
+
+def test_main_verify_records_fingerprints_and_verify_time(tmp_path):
+    videos = tmp_path / "videos"
+    videos.mkdir()
+    for name in ["a.mp4", "b.mov"]:
+        _make_mp4(str(videos / name))
+    metrics_file = tmp_path / "metrics.jsonl"
+    args = ["--directory", str(videos), "--engine", "native", "--no-index"]
+
+    result = runner.invoke(
+        app, args + ["--verify", "--metrics-file", str(metrics_file)]
+    )
+
+    assert result.exit_code == 0, result.stdout
+    *entries, summary = [json.loads(line) for line in metrics_file.open()]
+    for entry in entries:
+        assert entry["ok"] and len(entry["fingerprint"]) == 32
+        assert entry["verify_s"] >= 0
+    assert "verify_s" in summary["summary"]["latency"]
+
+
+def test_rotate_many_streams_results_with_backpressure(tmp_path, capsys):
+    paths = []
+    for i in range(200):
+        paths.append(str(tmp_path / f"{i}.mp4"))
+        _make_mp4(paths[-1])
+    produced = []
+
+    def jobs():
+        for i, path in enumerate(paths):
+            produced.append(path)
+            yield (path, 180) if i % 2 else path
+
+    results = rotate_many(
+        jobs(), engine="native", concurrency=1, chunk_size=4, buffer=4
+    )
+    first = next(results)
+    time.sleep(0.2)
+    assert first.ok
+    assert len(produced) < len(paths)  # nothing buffered beyond the window
+
+    rest = list(results)
+    assert len(rest) == len(paths) - 1 and all(r.ok for r in rest)
+    assert mp4.read_rotations(paths[0]) == [90]
+    assert mp4.read_rotations(paths[1]) == [180]
+    assert not os.path.exists(config.CONFIG_FILE)
+    assert capsys.readouterr() == ("", "")
+
+
+def test_rotate_many_reports_failures_and_rejects_bad_jobs(tmp_path):
+    good = str(tmp_path / "a.mp4")
+    _make_mp4(good)
+    results = list(rotate_many([good, str(tmp_path / "gone.mp4")], engine="native"))
+    assert sorted(r.ok for r in results) == [False, True]
+
+    with pytest.raises(ValueError):
+        list(rotate_many([(good, 45)], engine="native"))
+    with pytest.raises(ValueError):
+        list(rotate_many([good], engine="nope"))
+
+
+def test_main_rotates_hard_links_once(tmp_path):
+    videos = tmp_path / "videos"
+    videos.mkdir()
+    _make_mp4(str(videos / "a.mp4"))
+    os.link(videos / "a.mp4", videos / "b.mp4")
+    args = ["--directory", str(videos), "--engine", "native", "--no-index"]
+
+    result = runner.invoke(app, args + ["--mode", "relative", "--angle", "90"])
+
+    assert result.exit_code == 0, result.stdout
+    assert "1 duplicate videos" in result.stdout
+    # Rotating each path would have added 90 degrees twice.
+    assert mp4.read_rotations(str(videos / "a.mp4")) == [90]
+    assert os.path.samefile(videos / "a.mp4", videos / "b.mp4")
+
+
+def test_main_dedup_content_fans_out_copies(tmp_path):
+    videos = tmp_path / "videos"
+    videos.mkdir()
+    for name in ["a.mp4", "b.mp4", "c.mp4"]:
+        _make_mp4(str(videos / name))
+    _make_mp4(str(videos / "other.mp4"), moov_at_end=True)
+    args = ["--directory", str(videos), "--engine", "native", "--no-index"]
+    metrics_file = tmp_path / "metrics.jsonl"
+
+    result = runner.invoke(
+        app,
+        args
+        + ["--dedup", "content", "--dedup-link", "hardlink"]
+        + ["--metrics-file", str(metrics_file)],
+    )
+
+    assert result.exit_code == 0, result.stdout
+    entries = [json.loads(line) for line in metrics_file.open()][:-1]
+    assert sorted(os.path.basename(e["path"]) for e in entries) == [
+        "a.mp4",
+        "b.mp4",
+        "c.mp4",
+        "other.mp4",
+    ]
+    assert all(e["ok"] for e in entries)
+    inodes = {(videos / n).stat().st_ino for n in ["a.mp4", "b.mp4", "c.mp4"]}
+    assert len(inodes) == 1
+    for name in ["a.mp4", "other.mp4"]:
+        assert mp4.read_rotations(str(videos / name)) == [90]
+
+
+def test_content_digest_sees_metadata_of_same_size_files(tmp_path):
+    a, b = str(tmp_path / "a.mp4"), str(tmp_path / "b.mp4")
+    _make_mp4(a)
+    _make_mp4(b)
+    assert dedup.content_digest(a) == dedup.content_digest(b)
+    mp4.set_rotation(b, 180)
+    assert dedup.content_digest(a) != dedup.content_digest(b)
+
+
+def test_dedup_fans_out_into_output_dir_and_failures(tmp_path):
+    a, b = str(tmp_path / "a.mp4"), str(tmp_path / "b.mp4")
+    _make_mp4(a)
+    os.link(a, b)
+    out = tmp_path / "out"
+    deduper = dedup.Deduplicator("inode", output_dir=str(out), base_dir=str(tmp_path))
+    assert list(deduper.unique([a, b], 90)) == [a]
+    out.mkdir()
+    (out / "a.mp4").write_bytes(b"rotated")
+    first = engines.RotationResult(a, 90, "native", output=str(out / "a.mp4"))
+
+    (results,) = deduper.fan_out([[first]])
+
+    assert [r.path for r in results] == [a, b]
+    assert results[1].output == str(out / "b.mp4")
+    assert (out / "b.mp4").read_bytes() == b"rotated"
+
+    deduper = dedup.Deduplicator("inode")
+    list(deduper.unique([a, b], 90))
+    failed = engines.RotationResult(a, 90, "native", "boom")
+    (results,) = deduper.fan_out([[failed]])
+    assert results[1].error.endswith("which failed: boom")
+
+
+def test_main_sidecar_records_rotations_without_writing_videos(tmp_path):
+    videos = tmp_path / "videos"
+    videos.mkdir()
+    for name in ["a.mp4", "b.mov"]:
+        _make_mp4(str(videos / name))
+    before = (videos / "a.mp4").read_bytes()
+    args = ["--directory", str(videos), "--engine", "native", "--no-index"]
+
+    result = runner.invoke(app, args + ["--sidecar", "file", "--angle", "270"])
+
+    assert result.exit_code == 0, result.stdout
+    assert (videos / "a.mp4").read_bytes() == before
+    assert sidecar.read_file_sidecar(str(videos / "a.mp4")) == 270
+    assert sidecar.read_file_sidecar(str(videos / "b.mov")) == 270
+
+    # Relative sidecars are planned from each video's current rotation.
+    mp4.set_rotation(str(videos / "a.mp4"), 90)
+    result = runner.invoke(
+        app, args + ["--sidecar", "file", "--mode", "relative", "--angle", "90"]
+    )
+    assert result.exit_code == 0, result.stdout
+    assert sidecar.read_file_sidecar(str(videos / "a.mp4")) == 180
+
+
+def test_sidecar_update_keeps_other_metadata(tmp_path):
+    video = str(tmp_path / "a.mp4")
+    with open(sidecar.sidecar_path(video), "w") as f:
+        f.write(
+            '<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF xmlns:rdf='
+            '"http://www.w3.org/1999/02/22-rdf-syntax-ns#"><rdf:Description '
+            'xmlns:dc="http://purl.org/dc/elements/1.1/" '
+            'xmlns:tiff="http://ns.adobe.com/tiff/1.0/"><dc:format>video/mp4'
+            "</dc:format><tiff:Orientation>1</tiff:Orientation>"
+            "</rdf:Description></rdf:RDF></x:xmpmeta>"
+        )
+
+    sidecar.write_file_sidecar(video, 90)
+
+    text = open(sidecar.sidecar_path(video)).read()
+    assert "video/mp4" in text and text.startswith("<?xpacket")
+    assert sidecar.read_file_sidecar(video) == 90
+
+
+def test_new_sidecar_is_written_atomically(tmp_path, mocker):
+    video = str(tmp_path / "a.mp4")
+    path = sidecar.sidecar_path(video)
+    mocker.patch("os.replace", side_effect=OSError("disk full"))
+
+    with pytest.raises(OSError):
+        sidecar.write_file_sidecar(video, 90)
+
+    assert os.listdir(tmp_path) == []
+    mocker.stopall()
+    sidecar.write_file_sidecar(video, 90)
+    assert os.listdir(tmp_path) == ["a.mp4.xmp"]
+    assert sidecar.read_file_sidecar(video) == 90 and os.path.exists(path)
+
+
+def test_directory_sidecars_apply_and_retire(tmp_path):
+    videos = tmp_path / "videos"
+    videos.mkdir()
+    names = ["a.mp4", "b & c.mp4", "d.mp4"]
+    for name in names:
+        _make_mp4(str(videos / name))
+    args = ["--directory", str(videos), "--engine", "native", "--no-index"]
+    assert runner.invoke(app, args + ["--sidecar", "directory"]).exit_code == 0
+    # A later run merges into the directory's sidecar.
+    manifest_file = tmp_path / "m.csv"
+    manifest_file.write_text(f"{videos / 'd.mp4'},180\n")
+    result = runner.invoke(
+        app, args + ["--sidecar", "directory", "--manifest", str(manifest_file)]
+    )
+    assert result.exit_code == 0, result.stdout
+    assert sidecar.read_directory_sidecar(str(videos)) == {
+        "a.mp4": 90,
+        "b & c.mp4": 90,
+        "d.mp4": 180,
+    }
+    assert not os.path.exists(sidecar.sidecar_path(str(videos / "a.mp4")))
+
+    result = runner.invoke(
+        app,
+        ["apply-sidecars", str(videos), "--engine", "native", "--remove"],
+    )
+
+    assert result.exit_code == 0, result.stdout
+    assert "Applied 3 sidecars" in result.stdout
+    assert mp4.read_rotations(str(videos / "b & c.mp4")) == [90]
+    assert mp4.read_rotations(str(videos / "d.mp4")) == [180]
+    assert not os.path.exists(videos / sidecar.DIRECTORY_SIDECAR)
+
+
+def test_dedup_content_rotates_files_differing_in_unsampled_bytes(tmp_path):
+    videos = tmp_path / "videos"
+    videos.mkdir()
+    size = 4 << 20
+    for name in ["a.mp4", "b.mp4"]:
+        body = _make_mp4(str(videos / name))
+        with open(videos / name, "ab") as f:
+            f.write(_box(b"free", b"\0" * (size - len(body) - 8)))
+    middle = size // 2 + 12345
+    with open(videos / "b.mp4", "r+b") as f:
+        f.seek(middle)
+        f.write(b"\1")
+    # The byte lies outside every sampled block: the hashes still match.
+    digest = dedup.content_digest(str(videos / "a.mp4"))
+    assert dedup.content_digest(str(videos / "b.mp4")) == digest
+    args = ["--directory", str(videos), "--engine", "native", "--no-index"]
+
+    result = runner.invoke(app, args + ["--dedup", "content", "--dedup-link", "copy"])
+
+    assert result.exit_code == 0, result.stdout
+    assert "duplicate" not in result.stdout
+    a, b = (videos / "a.mp4").read_bytes(), (videos / "b.mp4").read_bytes()
+    assert a[middle] == 0 and b[middle] == 1
+    for name in ["a.mp4", "b.mp4"]:
+        assert mp4.read_rotations(str(videos / name)) == [90]
+
+
+def test_dedup_content_without_link_rotates_copies_in_place(tmp_path):
+    videos = tmp_path / "videos"
+    videos.mkdir()
+    for name in ["a.mp4", "b.mp4"]:
+        _make_mp4(str(videos / name))
+    inode = (videos / "b.mp4").stat().st_ino
+    args = ["--directory", str(videos), "--engine", "native", "--no-index"]
+
+    result = runner.invoke(app, args + ["--dedup", "content"])
+
+    assert result.exit_code == 0, result.stdout
+    assert (videos / "b.mp4").stat().st_ino == inode
+    assert mp4.read_rotations(str(videos / "b.mp4")) == [90]